@@ -0,0 +1,72 @@
+import random
+import sys
+
+sys.path.insert(0, __file__.rsplit("benchmarks", 1)[0])
+
+import emu.cpu  # noqa: E402
+from emu.registers import A, B, C, D, E, H, L  # noqa: E402
+from timing import best_time  # noqa: E402
+
+# Register-to-register and (HL) loads; the one block of opcodes the original
+# if/elif chain implemented, so the numbers are comparable across versions.
+LOAD_OPCODES = [op for op in range(0x40, 0x80) if op != 0x76]
+ALU_OPCODES = list(range(0x80, 0xC0))
+
+STREAMS = [
+    ("early opcode (0x40)", "cpu.early", [0x40]),
+    ("late opcode (0x7f)", "cpu.late", [0x7F]),
+    ("loads 0x40-0x7f", "cpu.loads", LOAD_OPCODES),
+    ("alu 0x80-0xbf", "cpu.alu", ALU_OPCODES),
+]
+
+
+def bench(opcodes, count=200000, seed=0, repeats=1):
+    random.seed(seed)
+    stream = [random.choice(opcodes) for _ in range(count)]
+    cpu = emu.cpu.CPU()
+    # every register holds 0xC1 so (HL) stays in work RAM whatever gets loaded
+    for reg in [A, B, C, D, E, H, L]:
+        cpu.set_reg(reg, 0xC1)
+    execute = cpu.execute_opcode
+
+    def run():
+        for opcode in stream:
+            execute(opcode)
+
+    return count / best_time(run, repeats)
+
+
+# LD HL,0xC100; LD DE,0xD000; LD C,0; then LD A,(HL+); LD (DE),A; INC DE;
+# DEC C; JR NZ,-6 copying 256 bytes and JR -16 to start over, run from work
+# RAM once interpreted and once as translated blocks
+COPY_LOOP = [0x21, 0x00, 0xC1, 0x11, 0x00, 0xD0, 0x0E, 0x00, 0x2A, 0x12, 0x13, 0x0D, 0x20, 0xFA, 0x18, 0xF0]
+
+
+def bench_loop(method, steps=300000, repeats=1):
+    cpu = emu.cpu.CPU()
+    cpu.MEMORY.memory[0xC000:0xC000 + len(COPY_LOOP)] = bytes(COPY_LOOP)
+    cpu.REGISTERS.pc = 0xC000
+    scheduler = cpu.SCHEDULER
+    step = getattr(cpu, method)
+
+    def run():
+        for _ in range(steps):
+            scheduler.now += step()
+
+    start = scheduler.now
+    elapsed = best_time(run, repeats)
+    return (scheduler.now - start) / repeats / elapsed
+
+
+def run(repeats):
+    results = {name: (bench(opcodes, repeats=repeats), "instructions/s") for _, name, opcodes in STREAMS}
+    results["cpu.loop_interpreted"] = (bench_loop("execute_next_opcode", repeats=repeats), "cycles/s")
+    results["cpu.loop_blocks"] = (bench_loop("execute_next_block", repeats=repeats), "cycles/s")
+    return results
+
+
+if __name__ == "__main__":
+    for label, _, opcodes in STREAMS:
+        print("%-20s: %12.0f instructions/s" % (label, bench(opcodes)))
+    print("%-20s: %12.0f cycles/s" % ("loop interpreted", bench_loop("execute_next_opcode")))
+    print("%-20s: %12.0f cycles/s" % ("loop as blocks", bench_loop("execute_next_block")))
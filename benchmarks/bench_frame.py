@@ -0,0 +1,49 @@
+import sys
+
+sys.path.insert(0, __file__.rsplit("benchmarks", 1)[0])
+
+import emu.cpu  # noqa: E402
+from timing import best_time  # noqa: E402
+
+ROM = __file__.rsplit("benchmarks", 1)[0] + "roms/Tetris (World).gb"
+
+
+# The first frames are spent clearing memory, so the clock only starts once
+# the title screen is up
+def bench(warmup=60, frames=60, repeats=1):
+    cpu = emu.cpu.CPU(ROM)
+    for _ in range(warmup):
+        cpu.update()
+
+    def run():
+        for _ in range(frames):
+            cpu.update()
+
+    return frames / best_time(run, repeats)
+
+
+# A game waiting for VBlank the way the boot ROM does: LDH A,(0x44);
+# CP 0x90; JR NZ, then acknowledge it and go round again
+LY_POLL = [0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA, 0x3E, 0x00, 0xE0, 0x0F, 0x18, 0xF2]
+
+
+def bench_idle(frames=60, repeats=1):
+    cpu = emu.cpu.CPU()
+    cpu.MEMORY.memory[0xC000:0xC000 + len(LY_POLL)] = bytes(LY_POLL)
+    cpu.REGISTERS.pc = 0xC000
+
+    def run():
+        for _ in range(frames):
+            cpu.update(render=False)
+
+    return frames / best_time(run, repeats)
+
+
+def run(repeats):
+    return {"frame.tetris": (bench(repeats=repeats), "frames/s"),
+            "frame.idle_ly_poll": (bench_idle(repeats=repeats), "frames/s")}
+
+
+if __name__ == "__main__":
+    print("%-20s: %12.1f frames/s" % ("tetris", bench()))
+    print("%-20s: %12.1f frames/s" % ("idle LY poll", bench_idle()))
@@ -0,0 +1,81 @@
+import random
+import sys
+
+sys.path.insert(0, __file__.rsplit("benchmarks", 1)[0])
+
+import emu.memory  # noqa: E402
+from timing import best_time  # noqa: E402
+
+ROM = __file__.rsplit("benchmarks", 1)[0] + "roms/Tetris (World).gb"
+
+# (name, addresses read, addresses written). ROM writes switch banks and most
+# I/O writes have side effects, so those regions only get the harmless ones.
+REGIONS = [
+    ("rom0", range(0x0000, 0x4000), None),
+    ("romx", range(0x4000, 0x8000), None),
+    ("vram", range(0x8000, 0xA000), range(0x8000, 0xA000)),
+    ("extram", range(0xA000, 0xC000), range(0xA000, 0xC000)),
+    ("wram", range(0xC000, 0xE000), range(0xC000, 0xE000)),
+    ("echo", range(0xE000, 0xFE00), range(0xE000, 0xFE00)),
+    ("oam", range(0xFE00, 0xFEA0), range(0xFE00, 0xFEA0)),
+    ("io", range(0xFF40, 0xFF4C), [0xFF42, 0xFF43, 0xFF47, 0xFF48, 0xFF49, 0xFF4A, 0xFF4B]),
+    ("hram", range(0xFF80, 0xFFFF), range(0xFF80, 0xFFFF)),
+]
+
+
+def make_memory():
+    memory = emu.memory.Memory(ROM)
+    memory.init()
+    memory.mapper.set_ram_enabled(True)
+    return memory
+
+
+def bench_read(memory, addresses, count=100000, seed=0, repeats=1):
+    random.seed(seed)
+    stream = [random.choice(addresses) for _ in range(count)]
+    read = memory.read
+
+    def run():
+        for address in stream:
+            read(address)
+
+    return count / best_time(run, repeats)
+
+
+def bench_write(memory, addresses, count=100000, seed=0, repeats=1):
+    random.seed(seed)
+    stream = [(random.choice(addresses), random.randrange(0x100)) for _ in range(count)]
+    write = memory.write
+
+    def run():
+        for address, data in stream:
+            write(address, data)
+
+    return count / best_time(run, repeats)
+
+
+# OAM DMA from each kind of source the games use
+def bench_dma(memory, count=2000, repeats=1):
+    sources = [0x40, 0xA0, 0xC0] * (count // 3)
+
+    def run():
+        for source in sources:
+            memory.do_dma_transfer(source)
+
+    return len(sources) / best_time(run, repeats)
+
+
+def run(repeats):
+    memory = make_memory()
+    results = {}
+    for name, reads, writes in REGIONS:
+        results["memory.read." + name] = (bench_read(memory, reads, repeats=repeats), "reads/s")
+        if writes is not None:
+            results["memory.write." + name] = (bench_write(memory, writes, repeats=repeats), "writes/s")
+    results["memory.dma"] = (bench_dma(memory, repeats=repeats), "transfers/s")
+    return results
+
+
+if __name__ == "__main__":
+    for name, (value, unit) in run(1).items():
+        print("%-20s: %12.0f %s" % (name, value, unit))
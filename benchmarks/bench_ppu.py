@@ -0,0 +1,46 @@
+import random
+import sys
+
+sys.path.insert(0, __file__.rsplit("benchmarks", 1)[0])
+
+import emu.memory  # noqa: E402
+from timing import best_time  # noqa: E402
+
+
+# Random tiles, maps and 40 sprites all over the screen with the window
+# covering the bottom right, so every scanline has work on both layers
+def make_memory(seed=0):
+    random.seed(seed)
+    memory = emu.memory.Memory()
+    memory.init()
+    memory.memory[0x8000:0xA000] = bytes(random.randrange(0x100) for _ in range(0x2000))
+    memory.memory[0xFE00:0xFEA0] = bytes(random.randrange(0x100) for _ in range(0xA0))
+    memory.memory[0xFF40] = 0xF3  # LCD, window on the 0x9C00 map, 0x8000 tiles, sprites, background
+    memory.memory[0xFF4A] = 0x40
+    memory.memory[0xFF4B] = 0x57
+    memory.invalidate_caches()
+    memory.decode_tiles()
+    return memory
+
+
+def bench_scanlines(render, memory, frames=20, repeats=1):
+    def run():
+        for _ in range(frames):
+            for line in range(emu.memory.SCREEN_HEIGHT):
+                memory.memory[0xFF44] = line
+                render()
+
+    return frames * emu.memory.SCREEN_HEIGHT / best_time(run, repeats)
+
+
+def run(repeats):
+    memory = make_memory()
+    return {
+        "ppu.render_tiles": (bench_scanlines(memory.render_tiles, memory, repeats=repeats), "scanlines/s"),
+        "ppu.render_sprites": (bench_scanlines(memory.render_sprites, memory, repeats=repeats), "scanlines/s"),
+    }
+
+
+if __name__ == "__main__":
+    for name, (value, unit) in run(1).items():
+        print("%-20s: %12.0f %s" % (name, value, unit))
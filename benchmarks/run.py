@@ -0,0 +1,79 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import bench_dispatch
+import bench_frame
+import bench_memory
+import bench_ppu
+
+SUITES = {
+    "cpu": bench_dispatch,
+    "memory": bench_memory,
+    "ppu": bench_ppu,
+    "frame": bench_frame,
+}
+
+
+def run_suites(names, repeats):
+    results = {}
+    for name in names:
+        for key, (value, unit) in SUITES[name].run(repeats).items():
+            results[key] = {"value": value, "unit": unit}
+            print("%-24s %14.1f %s" % (key, value, unit))
+    return results
+
+
+# Every result is a rate, so anything that dropped by more than the threshold
+# is a regression
+def compare(results, baseline, threshold):
+    regressions = []
+    print("\n%-24s %14s %14s %8s" % ("benchmark", "baseline", "current", "change"))
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]["value"]
+        change = result["value"] / old - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print("%-24s %14.1f %14.1f %+7.1f%%%s" % (key, old, result["value"], change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CPU, memory and PPU throughput.")
+    parser.add_argument("--only", action="append", choices=list(SUITES),
+                        help="run just this suite, can be given more than once")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per benchmark, the best one counts (default 5)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON file from an earlier --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown that counts as a regression (default 0.1, i.e. 10%%)")
+    args = parser.parse_args(argv)
+
+    results = run_suites(args.only or list(SUITES), args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "repeats": args.repeats,
+                "results": results,
+            }, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
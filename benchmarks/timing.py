@@ -0,0 +1,11 @@
+import time
+
+
+# Shortest of a few runs, the host only ever adds noise on top of the real cost
+def best_time(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+
+import emu.capture
+import emu.cpu
+import emu.profiling
+
+
+#############################################################################
+#                                                                           #
+#                              HEADLESS RUNNER                              #
+#                                                                           #
+#############################################################################
+
+# Frames are LCD frames, VBlank to VBlank, paced at the LCD's 59.7 Hz.
+# frameskip K draws one frame out of every K + 1, the last frame is always
+# drawn so the screen holds where the run ended up
+def is_drawn(frame, frames, frameskip):
+    return frame % (frameskip + 1) == frameskip or frame == frames - 1
+
+
+def run(cpu, frames, turbo=False, frameskip=0):
+    frame_time = 1 / emu.cpu.LCD_FRAMES_PER_SECOND
+    drawn = 0
+
+    start = time.perf_counter()
+    next_frame = start
+    for frame in range(frames):
+        render = is_drawn(frame, frames, frameskip)
+        cpu.run_frame(render)
+        drawn += render
+        if not turbo:
+            next_frame += frame_time
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - start
+
+    return drawn, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m emu")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run a ROM without a display")
+    run_parser.add_argument("rom")
+    run_parser.add_argument("--frames", type=int, default=600, help="LCD frames to emulate (default 600)")
+    run_parser.add_argument("--turbo", action="store_true", help="run as fast as possible instead of at 59.7 Hz")
+    run_parser.add_argument("--frameskip", type=int, default=0, metavar="K",
+                            help="only draw one frame out of every K + 1")
+    run_parser.add_argument("--profile", metavar="FILE",
+                            help="count opcodes, memory accesses and subsystem time, and write them as JSON")
+    run_parser.add_argument("--flamegraph", metavar="FILE", help="write the profile as collapsed stacks")
+    run_parser.add_argument("--capture", metavar="TARGET",
+                            help="write the drawn frames to a file, a directory of PNGs or a command's stdin")
+    run_parser.add_argument("--capture-format", choices=emu.capture.FORMATS, default="raw",
+                            help="raw RGB, y4m, png or pipe (default raw)")
+    run_parser.add_argument("--capture-drop", action="store_true",
+                            help="drop frames instead of waiting when the writer falls behind")
+
+    args = parser.parse_args(argv)
+    if args.frames < 1 or args.frameskip < 0:
+        parser.error("--frames must be at least 1 and --frameskip can't be negative")
+
+    cpu = emu.cpu.CPU(args.rom)
+    profiler = None
+    if args.profile or args.flamegraph:
+        profiler = emu.profiling.Profiler(cpu)
+        profiler.start()
+    capture = None
+    if args.capture:
+        capture = emu.capture.Capture(args.capture, args.capture_format, policy="drop" if args.capture_drop else "block")
+        capture.attach(cpu)
+
+    drawn, elapsed = run(cpu, args.frames, args.turbo, args.frameskip)
+    print("%d frames (%d drawn) in %.2fs, %.1f FPS" % (args.frames, drawn, elapsed, args.frames / elapsed))
+
+    if capture is not None:
+        capture.close()
+        print("captured %(written)d frames, %(duplicates)d duplicates skipped, %(dropped)d dropped" % capture.stats())
+
+    if profiler is not None:
+        profiler.stop()
+        if args.profile:
+            profiler.write_json(args.profile)
+        if args.flamegraph:
+            profiler.write_folded(args.flamegraph)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import numpy as np
+
+#############################################################################
+#                                                                           #
+#                                ALU TABLES                                 #
+#                                                                           #
+#############################################################################
+
+# The flags (and, where it isn't a one liner, the result) of every 8 bit
+# ALU operation for every input, so an instruction costs one index instead
+# of a chain of bit_set/bit_reset calls. Tables are bytes, indexing them
+# gives back the cached small ints.
+#
+#   ADD_FLAGS, SUB_FLAGS    carry << 16 | a << 8 | operand, also ADC, SBC, CP,
+#                           and H C of ADD HL / ADD SP from one byte of them
+#   AND_FLAGS, ZERO_FLAGS   result, ZERO_FLAGS is just Z for OR and XOR
+#   INC_FLAGS, DEC_FLAGS    value before, Z N H, carry is kept by the caller
+#   SHIFT_RESULTS/_FLAGS    SHIFT_<op> | carry << 8 | value for the CB
+#                           rotates and shifts, RLCA etc. keep only C
+#   BIT_FLAGS               bit << 8 | value, Z N H, carry is kept by the caller
+#   DAA_RESULTS/_FLAGS      (F & 0x70) << 4 | a
+
+Z, N, H, C = 0x80, 0x40, 0x20, 0x10
+
+SHIFT_RLC, SHIFT_RRC, SHIFT_RL, SHIFT_RR, SHIFT_SLA, SHIFT_SRA, SHIFT_SWAP, SHIFT_SRL = (i << 9 for i in range(8))
+SHIFT_OPERATIONS = {"RLC": SHIFT_RLC, "RRC": SHIFT_RRC, "RL": SHIFT_RL, "RR": SHIFT_RR, "SLA": SHIFT_SLA,
+                    "SRA": SHIFT_SRA, "SWAP": SHIFT_SWAP, "SRL": SHIFT_SRL}
+
+
+def flag(condition, value):
+    return np.where(condition, value, 0)
+
+
+def build_arithmetic():
+    carry, a, operand = np.meshgrid(np.arange(2), np.arange(0x100), np.arange(0x100), indexing="ij")
+    total = a + operand + carry
+    add = (flag(total & 0xFF == 0, Z) | flag((a & 0xF) + (operand & 0xF) + carry > 0xF, H) |
+           flag(total > 0xFF, C))
+    difference = a - operand - carry
+    sub = (flag(difference & 0xFF == 0, Z) | N | flag((a & 0xF) - (operand & 0xF) - carry < 0, H) |
+           flag(difference < 0, C))
+    return bytes(add.astype(np.uint8).ravel()), bytes(sub.astype(np.uint8).ravel())
+
+
+def build_shifts():
+    results = bytearray(8 << 9)
+    flags = bytearray(8 << 9)
+    for carry in range(2):
+        for value in range(0x100):
+            outcomes = [
+                (((value << 1) | (value >> 7)) & 0xFF, value >> 7),
+                ((value >> 1) | ((value & 1) << 7), value & 1),
+                (((value << 1) | carry) & 0xFF, value >> 7),
+                ((value >> 1) | (carry << 7), value & 1),
+                ((value << 1) & 0xFF, value >> 7),
+                ((value >> 1) | (value & 0x80), value & 1),
+                (((value << 4) | (value >> 4)) & 0xFF, 0),
+                (value >> 1, value & 1),
+            ]
+            for operation, (result, carry_out) in enumerate(outcomes):
+                index = operation << 9 | carry << 8 | value
+                results[index] = result
+                flags[index] = (Z if result == 0 else 0) | (C if carry_out else 0)
+    return bytes(results), bytes(flags)
+
+
+def build_daa():
+    results = bytearray(0x800)
+    flags = bytearray(0x800)
+    for f in range(0, 0x80, 0x10):
+        for value in range(0x100):
+            a = value
+            carry = f & C
+            if not f & N:
+                if f & C or a > 0x99:
+                    a += 0x60
+                    carry = C
+                if f & H or (a & 0xF) > 0x9:
+                    a += 0x6
+            else:
+                if f & C:
+                    a -= 0x60
+                if f & H:
+                    a -= 0x6
+            a &= 0xFF
+            index = f << 4 | value
+            results[index] = a
+            flags[index] = (Z if a == 0 else 0) | (f & N) | carry
+    return bytes(results), bytes(flags)
+
+
+ADD_FLAGS, SUB_FLAGS = build_arithmetic()
+ZERO_FLAGS = bytes(Z if value == 0 else 0 for value in range(0x100))
+AND_FLAGS = bytes(flags | H for flags in ZERO_FLAGS)
+INC_FLAGS = bytes((Z if (value + 1) & 0xFF == 0 else 0) | (H if value & 0xF == 0xF else 0) for value in range(0x100))
+DEC_FLAGS = bytes((Z if value == 1 else 0) | N | (H if value & 0xF == 0 else 0) for value in range(0x100))
+SHIFT_RESULTS, SHIFT_FLAGS = build_shifts()
+BIT_FLAGS = bytes((0 if value >> bit & 1 else Z) | H for bit in range(8) for value in range(0x100))
+DAA_RESULTS, DAA_FLAGS = build_daa()
+
+# for the namespaces generated code runs in
+TABLES = {name: value for name, value in globals().items() if name.endswith(("_FLAGS", "_RESULTS"))}
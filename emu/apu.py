@@ -0,0 +1,387 @@
+import collections
+
+import numpy as np
+
+import emu.cpu
+
+#############################################################################
+#                                                                           #
+#                                SOUND (APU)                                #
+#                                                                           #
+#############################################################################
+
+# Nothing is stepped per cycle. While a frame runs Memory only logs sound
+# register writes with the cycle they happened on; at the end of the frame
+# the log splits the frame into stretches where the registers hold still,
+# also split on the 512 Hz frame sequencer that clocks lengths, envelopes
+# and the sweep, and every channel renders each stretch as one NumPy array.
+#
+# Muted, the log is still applied so the channels stay in step with the
+# game, but nothing is rendered.
+
+CLOCK = emu.cpu.MAX_CYCLES_PER_SECOND
+SEQUENCER_PERIOD = CLOCK // 512
+AMPLITUDE = 512  # int16 units per step of channel volume, 4 channels at 15 stay under 32767
+
+# +1/-1 for each of the 8 steps of the 12.5%, 25%, 50% and 75% duty cycles
+DUTY = np.array([[0, 0, 0, 0, 0, 0, 0, 1], [1, 0, 0, 0, 0, 0, 0, 1], [1, 0, 0, 0, 0, 1, 1, 1],
+                 [0, 1, 1, 1, 1, 1, 1, 0]], dtype=np.float32) * 2 - 1
+NOISE_DIVISORS = [8, 16, 32, 48, 64, 80, 96, 112]
+# wave channel output level for each NR32 volume code: mute, 100%, 50%, 25%
+WAVE_VOLUMES = [0.0, 1.0, 0.5, 0.25]
+
+
+# One full period of the noise channel's output, +1/-1, for the 15 and 7 bit
+# LFSR, so rendering noise is indexing at the LFSR's position
+def lfsr_sequence(short):
+    lfsr = 0x7FFF
+    period = 127 if short else 32767
+    bits = np.zeros(period, dtype=np.float32)
+    for i in range(period):
+        feedback = (lfsr ^ (lfsr >> 1)) & 1
+        lfsr = (lfsr >> 1) | (feedback << 14)
+        if short:
+            lfsr = (lfsr & ~0x40) | (feedback << 6)
+        bits[i] = 1 - (lfsr & 1) * 2
+    return bits
+
+
+LFSR_SEQUENCES = [lfsr_sequence(False), lfsr_sequence(True)]
+
+
+class Envelope:
+    def __init__(self):
+        self.dac = False
+        self.initial_volume = 0
+        self.increase = False
+        self.period = 0
+        self.volume = 0
+        self.timer = 0
+
+    def write(self, data):
+        self.initial_volume = data >> 4
+        self.increase = bool(data & 0x08)
+        self.period = data & 0x07
+        self.dac = bool(data & 0xF8)
+
+    def trigger(self):
+        self.volume = self.initial_volume
+        self.timer = self.period
+
+    def clock(self):
+        if not self.period:
+            return
+        self.timer -= 1
+        if self.timer <= 0:
+            self.timer = self.period
+            if self.increase and self.volume < 15:
+                self.volume += 1
+            elif not self.increase and self.volume > 0:
+                self.volume -= 1
+
+
+class Channel:
+    LENGTH = 64
+
+    def __init__(self):
+        self.enabled = False
+        self.length = 0
+        self.length_enabled = False
+        self.frequency = 0
+        self.position = 0.0  # where in its waveform the channel is, in waveform steps
+
+    @property
+    def dac(self):
+        return self.envelope.dac
+
+    def write_frequency(self, register, data):
+        if register == 3:
+            self.frequency = (self.frequency & 0x700) | data
+        else:
+            self.frequency = (self.frequency & 0xFF) | (data & 0x07) << 8
+            self.length_enabled = bool(data & 0x40)
+            if data & 0x80:
+                self.trigger()
+
+    def trigger(self):
+        self.enabled = self.dac
+        if self.length == 0:
+            self.length = self.LENGTH
+
+    def clock_length(self):
+        if self.length_enabled and self.length > 0:
+            self.length -= 1
+            if self.length == 0:
+                self.enabled = False
+
+    # Waveform step of each of the next count samples, moving step at a time
+    def advance(self, count, step, period):
+        positions = self.position + step * np.arange(count, dtype=np.float64)
+        self.position = (self.position + step * count) % period
+        return positions.astype(np.int64) % period
+
+
+class SquareChannel(Channel):
+    def __init__(self, sweep=False):
+        super().__init__()
+        self.envelope = Envelope()
+        self.duty = 0
+        self.has_sweep = sweep
+        self.sweep_period = 0
+        self.sweep_negate = False
+        self.sweep_shift = 0
+        self.sweep_timer = 0
+        self.sweep_enabled = False
+        self.shadow_frequency = 0
+
+    def write(self, register, data):
+        if register == 0:
+            self.sweep_period = (data >> 4) & 0x07
+            self.sweep_negate = bool(data & 0x08)
+            self.sweep_shift = data & 0x07
+        elif register == 1:
+            self.duty = data >> 6
+            self.length = 64 - (data & 0x3F)
+        elif register == 2:
+            self.envelope.write(data)
+            if not self.dac:
+                self.enabled = False
+        else:
+            self.write_frequency(register, data)
+
+    def trigger(self):
+        super().trigger()
+        self.envelope.trigger()
+        if self.has_sweep:
+            self.shadow_frequency = self.frequency
+            self.sweep_timer = self.sweep_period or 8
+            self.sweep_enabled = bool(self.sweep_period or self.sweep_shift)
+            if self.sweep_shift:
+                self.sweep_target()
+
+    def sweep_target(self):
+        change = self.shadow_frequency >> self.sweep_shift
+        target = self.shadow_frequency - change if self.sweep_negate else self.shadow_frequency + change
+        if target > 0x7FF:
+            self.enabled = False
+        return target
+
+    def clock_sweep(self):
+        self.sweep_timer -= 1
+        if self.sweep_timer > 0:
+            return
+        self.sweep_timer = self.sweep_period or 8
+        if self.sweep_enabled and self.sweep_period:
+            target = self.sweep_target()
+            if target <= 0x7FF and self.sweep_shift:
+                self.frequency = self.shadow_frequency = target
+                self.sweep_target()
+
+    def render(self, count, sample_rate):
+        hertz = 131072 / (2048 - self.frequency)
+        if not self.enabled or self.envelope.volume == 0 or hertz > sample_rate / 2:
+            return None
+        return DUTY[self.duty][self.advance(count, hertz * 8 / sample_rate, 8)] * self.envelope.volume
+
+
+class WaveChannel(Channel):
+    LENGTH = 256
+
+    def __init__(self):
+        super().__init__()
+        self.dac_enabled = False
+        self.volume_code = 0  # 0 mute, 1 full, 2 half, 3 quarter
+        self.samples = np.zeros(32, dtype=np.float32)
+
+    @property
+    def dac(self):
+        return self.dac_enabled
+
+    def write(self, register, data):
+        if register == 0:
+            self.dac_enabled = bool(data & 0x80)
+            if not self.dac_enabled:
+                self.enabled = False
+        elif register == 1:
+            self.length = 256 - data
+        elif register == 2:
+            self.volume_code = (data >> 5) & 0x03
+        else:
+            self.write_frequency(register, data)
+
+    def write_sample(self, index, data):
+        self.samples[index * 2] = data >> 4
+        self.samples[index * 2 + 1] = data & 0x0F
+
+    def trigger(self):
+        super().trigger()
+        self.position = 0.0
+
+    def render(self, count, sample_rate):
+        hertz = 65536 / (2048 - self.frequency)
+        if not self.enabled or self.volume_code == 0 or hertz * 16 > sample_rate / 2:
+            return None
+        # samples are 0 to 15, centred and doubled to the +-15 the other
+        # channels reach at full volume
+        levels = (self.samples - 7.5) * 2 * WAVE_VOLUMES[self.volume_code]
+        return levels[self.advance(count, hertz * 32 / sample_rate, 32)]
+
+
+class NoiseChannel(Channel):
+    def __init__(self):
+        super().__init__()
+        self.envelope = Envelope()
+        self.shift = 0
+        self.short = False
+        self.divisor = 8
+
+    def write(self, register, data):
+        if register == 1:
+            self.length = 64 - (data & 0x3F)
+        elif register == 2:
+            self.envelope.write(data)
+            if not self.dac:
+                self.enabled = False
+        elif register == 3:
+            self.shift = data >> 4
+            self.short = bool(data & 0x08)
+            self.divisor = NOISE_DIVISORS[data & 0x07]
+        elif register == 4:
+            self.length_enabled = bool(data & 0x40)
+            if data & 0x80:
+                self.trigger()
+
+    def trigger(self):
+        super().trigger()
+        self.envelope.trigger()
+        self.position = 0.0
+
+    def render(self, count, sample_rate):
+        if not self.enabled or self.envelope.volume == 0 or self.shift >= 14:
+            return None
+        sequence = LFSR_SEQUENCES[self.short]
+        hertz = CLOCK / (self.divisor << self.shift)
+        return sequence[self.advance(count, hertz / sample_rate, len(sequence))] * self.envelope.volume
+
+
+class APU:
+    def __init__(self, cpu, sample_rate=48000, muted=False, buffer_frames=60):
+        self.cpu = cpu
+        self.memory = cpu.MEMORY
+        self.scheduler = cpu.SCHEDULER
+        self.sample_rate = sample_rate
+        self.muted = muted
+        self.buffers = collections.deque(maxlen=buffer_frames)  # one (samples, 2) int16 array per frame
+        self.channels = [SquareChannel(sweep=True), SquareChannel(), WaveChannel(), NoiseChannel()]
+        self.powered = True
+        self.left_volume = 7
+        self.right_volume = 7
+        self.panning = 0xFF
+        self.time = 0  # cycle everything has been rendered up to
+        self.sequencer_step = 0
+
+    def attach(self):
+        # pick up the registers as they are now, without triggering anything
+        for address in range(0xFF10, 0xFF40):
+            data = self.memory.memory[address]
+            self.write(address, data & 0x7F if address in (0xFF14, 0xFF19, 0xFF1E, 0xFF23) else data)
+        self.time = self.scheduler.now
+        self.memory.sound_writes = []
+        self.cpu.frame_hooks.append(self.on_frame)
+
+    def detach(self):
+        self.cpu.frame_hooks.remove(self.on_frame)
+        self.memory.sound_writes = None
+
+    # Every frame rendered since the last pull as one (samples, 2) int16
+    # array, left then right
+    def pull(self):
+        if not self.buffers:
+            return np.zeros((0, 2), dtype=np.int16)
+        samples = np.concatenate(self.buffers)
+        self.buffers.clear()
+        return samples
+
+    def on_frame(self):
+        writes = self.memory.sound_writes
+        end = self.scheduler.now
+        if end < self.time:  # a state was loaded, there is nothing sensible to render
+            self.time = end
+            writes.clear()
+            return
+
+        stretches = []
+        for time, address, data in writes:
+            self.run_until(time, stretches)
+            self.write(address, data)
+        writes.clear()
+        self.run_until(end, stretches)
+
+        status = sum(1 << i for i, channel in enumerate(self.channels) if channel.enabled)
+        self.memory.memory[0xFF26] = (0x80 if self.powered else 0) | 0x70 | status
+
+        if not self.muted:
+            mixed = np.concatenate(stretches) if stretches else np.zeros((0, 2), dtype=np.float32)
+            self.buffers.append((mixed * AMPLITUDE).astype(np.int16))
+
+    # Renders up to a cycle, stopping at every frame sequencer tick on the way
+    def run_until(self, time, stretches):
+        while True:
+            tick = (self.time // SEQUENCER_PERIOD + 1) * SEQUENCER_PERIOD
+            if tick > time:
+                break
+            self.render(tick, stretches)
+            self.clock_sequencer()
+        self.render(time, stretches)
+
+    def render(self, time, stretches):
+        # samples are counted from cycle 0 so the stretches add up to the
+        # right number wherever they are cut
+        count = time * self.sample_rate // CLOCK - self.time * self.sample_rate // CLOCK
+        self.time = time
+        if self.muted or count <= 0:
+            return
+        mixed = np.zeros((count, 2), dtype=np.float32)
+        if self.powered:
+            for i, channel in enumerate(self.channels):
+                samples = channel.render(count, self.sample_rate)
+                if samples is None:
+                    continue
+                if self.panning >> (i + 4) & 1:
+                    mixed[:, 0] += samples
+                if self.panning >> i & 1:
+                    mixed[:, 1] += samples
+            mixed[:, 0] *= (self.left_volume + 1) / 8
+            mixed[:, 1] *= (self.right_volume + 1) / 8
+        stretches.append(mixed)
+
+    def clock_sequencer(self):
+        step = self.sequencer_step
+        self.sequencer_step = (step + 1) & 7
+        if step & 1 == 0:
+            for channel in self.channels:
+                channel.clock_length()
+        if step in (2, 6):
+            self.channels[0].clock_sweep()
+        if step == 7:
+            for channel in (self.channels[0], self.channels[1], self.channels[3]):
+                channel.envelope.clock()
+
+    def write(self, address, data):
+        if address >= 0xFF30:
+            self.channels[2].write_sample(address - 0xFF30, data)
+        elif address == 0xFF26:
+            self.powered = bool(data & 0x80)
+            if not self.powered:
+                for channel in self.channels:
+                    channel.enabled = False
+        elif not self.powered:
+            return
+        elif address == 0xFF24:
+            self.left_volume = (data >> 4) & 0x07
+            self.right_volume = data & 0x07
+        elif address == 0xFF25:
+            self.panning = data
+        elif address < 0xFF24:
+            channel, register = divmod(address - 0xFF10, 5)
+            self.channels[channel].write(register, data)
@@ -0,0 +1,385 @@
+import re
+
+from emu.alu import TABLES
+from emu.opcodes import (INSTRUCTIONS, CB_INSTRUCTIONS, BRANCH_MNEMONICS, describe, generate_branch,
+                         generate_straight, instruction_length)
+from emu.scheduler import NEVER
+
+#############################################################################
+#                                                                           #
+#                          BLOCK TRANSLATION CACHE                          #
+#                                                                           #
+#############################################################################
+
+# Code that runs often enough gets translated a basic block at a time: the
+# straight-line run of instructions from a pc up to the next branch, EI or
+# store that could reach I/O or the mapper becomes one Python function.
+# Immediates are baked in, pc is only written once at the end and the 8 bit
+# registers live in local variables, so none of the per instruction fetch,
+# decode and dispatch is left.
+#
+# Blocks are keyed by pc, with the ROM bank in the upper bits for the
+# switchable bank. ROM never changes under a block; blocks in work RAM and
+# high RAM are thrown away when a byte they were built from is written.
+#
+# A block that jumps back to its own start without writing memory is an
+# idle loop candidate, e.g. LDH A,(0x44); CP 0x90; JR NZ polling LY. Once
+# an iteration leaves every register as it found it, the following ones
+# will too until the next scheduler event changes what it reads, so they
+# are skipped in one go.
+
+SPEC = [None] * 0x100
+for entry in INSTRUCTIONS:
+    SPEC[entry[0]] = entry
+CB_SPEC = [None] * 0x100
+for entry in CB_INSTRUCTIONS:
+    CB_SPEC[entry[0]] = entry
+
+HOT_THRESHOLD = 8  # times a pc is interpreted before it gets a block
+MAX_INSTRUCTIONS = 32
+
+# (first, last) address of each area blocks are built in, a block never
+# crosses the end of one
+ROM_AREAS = [(0x0000, 0x3FFF), (0x4000, 0x7FFF)]
+RAM_AREAS = [(0xC000, 0xDFFF), (0xFF80, 0xFFFE)]
+ECHO_OFFSET = 0x2000  # 0xE000-0xFDFF is another way of writing 0xC000-0xDDFF
+# I/O registers that only change at a scheduler event or between frames,
+# everything else in 0xFF00-0xFF7F moves on its own
+IDLE_IO = [0xFF00, 0xFF0F, 0xFF44]
+
+REGISTER = re.compile(r"\br\[(\d)\]")
+TARGET = re.compile(r"r\[(\d)\] (\S*)= ")
+PAIR_WRITE = re.compile(r"reg\.(af|bc|de|hl) = (.*)")
+PAIR_HALVES = {"af": (7, 6), "bc": (0, 1), "de": (2, 3), "hl": (4, 5)}
+
+
+# Immediates are read once here instead of every time the code runs
+def bake_immediates(lines, read, address, length):
+    if length == 2:
+        return [line.replace("cpu.get_n_byte()", "0x%02X" % read(address + 1)) for line in lines]
+    elif length == 3:
+        word = read(address + 1) | read(address + 2) << 8
+        return [line.replace("cpu.get_nn_bytes()", "0x%04X" % word) for line in lines]
+    return lines
+
+
+def block_key(pc, rom_bank):
+    if 0x4000 <= pc < 0x8000:
+        return rom_bank << 16 | pc
+    return pc
+
+
+def jump_target(entry, read, address):
+    length = instruction_length(entry)
+    if entry[1] == "JR":
+        offset = read(address + 1)
+        return (address + length + offset - ((offset & 0x80) << 1)) & 0xFFFF
+    if entry[1] == "JP" and entry[3] == ("immediate", "16"):
+        return read(address + 1) | read(address + 2) << 8
+    return None
+
+
+# Whole iterations of an idle loop that fit before the next event, every one
+# of them would read the same values and leave the same registers
+def idle_cycles(scheduler, cycles):
+    deadline = scheduler.next_deadline
+    if deadline == NEVER:
+        return cycles
+    return cycles * max(1, (deadline - scheduler.now) // cycles)
+
+
+def find_area(pc):
+    for first, last in ROM_AREAS + RAM_AREAS:
+        if first <= pc <= last:
+            return first, last
+    return None
+
+
+# Keeps the 8 bit registers in locals r0-r7, loading each from the register
+# file the first time it is used and writing back the ones that changed.
+# Anything that calls into the CPU reads the register file itself, so the
+# locals are written back before it and loaded again afterwards.
+class BlockBuilder:
+    def __init__(self):
+        self.body = []
+        self.loaded = set()
+        self.dirty = set()
+
+    def load(self, number):
+        if number not in self.loaded:
+            self.body.append("r%d = r[%d]" % (number, number))
+            self.loaded.add(number)
+
+    def flush(self):
+        for number in sorted(self.dirty):
+            self.body.append("r[%d] = r%d" % (number, number))
+        self.dirty.clear()
+
+    def add(self, lines):
+        if any("cpu." in line for line in lines):
+            self.flush()
+            self.loaded.clear()
+            self.body += lines
+            return
+        for line in lines:
+            pair = PAIR_WRITE.match(line)
+            if pair:
+                self.add_line("pair = " + pair.group(2))
+                high, low = PAIR_HALVES[pair.group(1)]
+                self.add_line("r[%d] = (pair >> 8) & 0xFF" % high)
+                self.add_line("r[%d] = pair & 0xFF" % low)
+            else:
+                self.add_line(line)
+
+    def add_line(self, line):
+        target = TARGET.match(line)
+        rest = line[target.end():] if target else line
+        for number in REGISTER.findall(rest):
+            self.load(int(number))
+        if target:
+            number = int(target.group(1))
+            if target.group(2):
+                self.load(number)
+            self.loaded.add(number)
+            self.dirty.add(number)
+        self.body.append(REGISTER.sub(r"r\1", line))
+
+    # For code that must not load anything itself, the registers that are
+    # already in locals are read from there and the rest from the list
+    def use_loaded(self, line):
+        return REGISTER.sub(lambda match: "r" + match.group(1) if int(match.group(1)) in self.loaded
+                            else match.group(0), line)
+
+
+class BlockCache:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.MEMORY
+        self.blocks = {}
+        self.counts = {}
+        self.ram_code = {}  # address -> keys of the RAM blocks built from it
+        self.ram_blocks = {}  # key -> addresses the RAM block was built from
+        self.watched = {}  # page -> (view, handler) it had before being watched
+        self.memory.invalidate_hooks.append(self.clear_ram)
+        self.memory.bank0_hooks.append(self.clear_bank0)
+
+    def miss(self, pc):
+        key = block_key(pc, self.memory.current_rom_bank)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count >= HOT_THRESHOLD:
+            block = self.compile(pc, key)
+            if block is not None:
+                del self.counts[key]
+                return block(self.cpu)
+        return self.cpu.execute_next_opcode()
+
+    #############################################################################
+    #                                                                           #
+    #                               TRANSLATION                                 #
+    #                                                                           #
+    #############################################################################
+
+    def compile(self, pc, key):
+        area = find_area(pc)
+        if area is None:
+            return None
+        read = self.memory.read
+        builder = BlockBuilder()
+        body = builder.body
+        address = pc
+        cycles = 0
+        clock_moved = False
+        terminator = None
+        idle = True
+
+        for _ in range(MAX_INSTRUCTIONS):
+            entry = SPEC[read(address)]
+            if entry is None:
+                break
+            length = instruction_length(entry)
+            if address + length - 1 > area[1]:
+                break
+            if entry[1] in BRANCH_MNEMONICS and entry[1] != "PREFIX":
+                terminator = entry
+                break
+            if entry[1] == "PREFIX":
+                entry = CB_SPEC[read(address + 1)]
+            idle = idle and is_idle_safe(entry, read, address)
+
+            lines = bake_immediates(generate_straight(entry), read, address, length)
+
+            body.append("# %04X %s" % (address, describe(entry)))
+            # I/O reads and writes see the clock where this instruction starts
+            if cycles and any("mem." in line for line in lines):
+                body.append("sched.now = now + %d" % cycles)
+                clock_moved = True
+            builder.add(lines)
+            cycles += entry[4]
+            address += length
+            if ends_block(entry, read, address - length):
+                break
+
+        if address == pc and terminator is None:
+            return None
+        idle = idle and terminator is not None and jump_target(terminator, read, address) == pc
+
+        builder.flush()
+        if terminator is None:
+            body.append("reg.pc = 0x%04X" % address)
+            # the caller adds the cycles to the clock as it was when the block began
+            if clock_moved:
+                body.append("sched.now = now")
+            body.append("return %d" % cycles)
+            end = address
+        else:
+            length = instruction_length(terminator)
+            end = address + length
+            lines = bake_immediates(generate_branch(terminator), read, address, length)
+            body.append("# %04X %s" % (address, describe(terminator)))
+            body.append("reg.pc = 0x%04X" % (end & 0xFFFF))
+            if cycles and any("mem." in line for line in lines):
+                body.append("sched.now = now + %d" % cycles)
+                clock_moved = True
+            taken = terminator[4][0] if isinstance(terminator[4], tuple) else terminator[4]
+            for line in lines:
+                code = line.lstrip()
+                indent = line[:len(line) - len(code)]
+                if code.startswith("return "):
+                    if clock_moved:
+                        body.append(indent + "sched.now = now")
+                    if idle and int(code[7:]) == taken:
+                        body.append(indent + "if r == start:")
+                        body.append(indent + "    return idle_cycles(sched, %d)" % (cycles + taken))
+                    body.append(indent + "return %d" % (cycles + int(code[7:])))
+                else:
+                    body.append(indent + builder.use_loaded(code))
+
+        lines = ["def block(cpu):", "    reg = cpu.REGISTERS", "    r = reg.r", "    mem = cpu.MEMORY"]
+        if clock_moved or idle:
+            lines += ["    sched = cpu.SCHEDULER", "    now = sched.now"]
+        if idle:
+            lines.append("    start = r[:]")
+        lines += ["    " + line for line in body]
+        namespace = dict(TABLES, idle_cycles=idle_cycles)
+        exec(compile("\n".join(lines), "<block %X>" % key, "exec"), namespace)
+        block = namespace["block"]
+
+        self.blocks[key] = block
+        if area in RAM_AREAS:
+            self.add_ram_code(key, range(pc, end))
+        return block
+
+    #############################################################################
+    #                                                                           #
+    #                               INVALIDATION                                #
+    #                                                                           #
+    #############################################################################
+
+    def add_ram_code(self, key, addresses):
+        self.ram_blocks[key] = addresses
+        for address in addresses:
+            self.ram_code.setdefault(address, set()).add(key)
+            page = address >> 8
+            if page not in self.watched:
+                self.watch(page, 0)
+                if 0xC0 <= page < 0xDE:
+                    self.watch(page + (ECHO_OFFSET >> 8), ECHO_OFFSET)
+
+    # Puts a write handler in front of a page holding code, keeping whatever
+    # the page did on writes before
+    def watch(self, page, offset):
+        memory = self.memory
+        view = memory.write_pages[page]
+        handler = memory.write_handlers[page]
+        self.watched[page] = (view, handler)
+        code = self.ram_code
+
+        if view is None:
+            def write(address, data):
+                handler(address, data)
+                if address - offset in code:
+                    self.invalidate(address - offset)
+        else:
+            def write(address, data):
+                view[address & 0xFF] = data
+                if address - offset in code:
+                    self.invalidate(address - offset)
+
+        memory.write_pages[page] = None
+        memory.write_handlers[page] = write
+
+    def invalidate(self, address):
+        for key in list(self.ram_code.get(address, ())):
+            del self.blocks[key]
+            for code_address in self.ram_blocks.pop(key):
+                keys = self.ram_code[code_address]
+                keys.discard(key)
+                if not keys:
+                    del self.ram_code[code_address]
+        if not self.ram_code:
+            self.unwatch()
+
+    def unwatch(self):
+        memory = self.memory
+        for page, (view, handler) in self.watched.items():
+            memory.write_pages[page] = view
+            memory.write_handlers[page] = handler
+        self.watched.clear()
+
+    # MBC1 can swap the bank at 0x0000-0x3FFF too, blocks there aren't keyed by it
+    def clear_bank0(self):
+        for key in [key for key in self.blocks if key < 0x4000]:
+            del self.blocks[key]
+        for key in [key for key in self.counts if key < 0x4000]:
+            del self.counts[key]
+
+    def clear_ram(self):
+        for key in self.ram_blocks:
+            del self.blocks[key]
+        self.ram_blocks.clear()
+        self.ram_code.clear()
+        self.unwatch()
+
+
+# Nothing that writes memory, the stack pointer or the interrupt state, and
+# reads only from fixed addresses whose value can't change between events
+def is_idle_safe(entry, read, address):
+    mnemonic, destination, source = entry[1], entry[2], entry[3]
+    if mnemonic in ("PUSH", "POP", "DI", "EI") or destination == ("register16", "sp"):
+        return False
+    if destination is not None and destination[0] in ("address", "high"):
+        return False
+    if source is not None and source[0] in ("address", "high"):
+        if source == ("high", "n"):
+            source_address = 0xFF00 | read(address + 1)
+        elif source == ("address", "nn"):
+            source_address = read(address + 1) | read(address + 2) << 8
+        else:
+            return False
+        return not 0xFF00 <= source_address < 0xFF80 or source_address in IDLE_IO
+    return True
+
+
+# A store to I/O can move the clock's events or raise an interrupt and one
+# below 0x8000 can switch banks, so the block stops after any store that
+# might land there. Only stores to an immediate address can be ruled out.
+def ends_block(entry, read, address):
+    mnemonic, destination, source = entry[1], entry[2], entry[3]
+    if mnemonic in ("EI", "PUSH"):
+        return True
+    if mnemonic in ("BIT", "RES", "SET"):
+        return mnemonic != "BIT" and source[0] == "address"
+    if destination is None or destination[0] not in ("address", "high"):
+        return False
+    if destination == ("high", "n"):
+        return not is_plain_store(0xFF00 | read(address + 1))
+    if destination == ("address", "nn"):
+        word = read(address + 1) | read(address + 2) << 8
+        last = (word + 1) & 0xFFFF if source == ("register16", "sp") else word
+        return not (is_plain_store(word) and is_plain_store(last))
+    return True  # (C), (BC), (DE), (HL)
+
+
+def is_plain_store(address):
+    return 0x8000 <= address < 0xFF00 or 0xFF80 <= address < 0xFFFF
@@ -0,0 +1,180 @@
+import os
+import queue
+import shlex
+import struct
+import subprocess
+import threading
+import zlib
+
+import numpy as np
+
+import emu.cpu
+from emu.memory import SCREEN_HEIGHT, SCREEN_WIDTH
+
+#############################################################################
+#                                                                           #
+#                               FRAME CAPTURE                               #
+#                                                                           #
+#############################################################################
+
+# Every frame the LCD finishes drawing is copied into a bounded queue at
+# VBlank, where it is whole, and a background thread does the encoding and
+# writing, so the emulator only pays for the copy. Frames identical to the
+# last one queued are skipped. When the writer falls behind and the queue is
+# full, the "block" policy waits for it and "drop" throws the frame away and
+# counts it.
+#
+# Formats:
+#   raw   the frames' bytes back to back, RGB24 (or one byte per pixel for
+#         greyscale screens)
+#   y4m   YUV4MPEG2, 4:4:4 for RGB screens and mono for greyscale ones
+#   png   one PNG per frame, target is a directory, files are named by the
+#         number of the frame so skipped duplicates show up as gaps
+#   pipe  raw frames into the stdin of a command, e.g. ffmpeg -f rawvideo
+#         -pix_fmt rgb24 -s 160x144 -r 4194304/70224 -i - out.mp4
+
+FORMATS = ["raw", "y4m", "png", "pipe"]
+POLICIES = ["block", "drop"]
+
+# BT.601 full range RGB -> YCbCr rows
+YCBCR = np.array([[0.299, 0.587, 0.114], [-0.168736, -0.331264, 0.5], [0.5, -0.418688, -0.081312]])
+
+
+def png_bytes(frame):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    colour_type = 2 if frame.ndim == 3 else 0  # truecolour or greyscale
+    rows = np.zeros((frame.shape[0], frame[0].size + 1), dtype=np.uint8)  # each row starts with filter type 0
+    rows[:, 1:] = frame.reshape(frame.shape[0], -1)
+    header = struct.pack(">IIBBBBB", frame.shape[1], frame.shape[0], 8, colour_type, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+def y4m_planes(frame):
+    if frame.ndim == 2:
+        return frame.tobytes()
+    ycbcr = frame @ YCBCR.T + (0, 128, 128)
+    return np.clip(np.rint(ycbcr), 0, 255).astype(np.uint8).transpose(2, 0, 1).tobytes()
+
+
+class Capture:
+    def __init__(self, target, format="raw", queue_size=64, policy="block", skip_duplicates=True):
+        if format not in FORMATS:
+            raise ValueError("Unknown capture format %r, expected one of %s" % (format, ", ".join(FORMATS)))
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy %r, expected one of %s" % (policy, ", ".join(POLICIES)))
+        self.target = target
+        self.format = format
+        self.policy = policy
+        self.skip_duplicates = skip_duplicates
+        self.queue = queue.Queue(queue_size)
+        self.memory = None
+        self.last = None
+
+        self.frames = 0  # frames handed over by the emulator
+        self.duplicates = 0
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+
+        self.process = None
+        if format == "png":
+            os.makedirs(target, exist_ok=True)
+            self.file = None
+        elif format == "pipe":
+            command = shlex.split(target) if isinstance(target, str) else target
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            self.file = self.process.stdin
+        else:
+            self.file = open(target, "wb")
+        self.header_written = False
+
+        self.thread = threading.Thread(target=self.write_frames, name="capture writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, cpu):
+        self.memory = cpu.MEMORY
+        self.memory.vblank_hooks.append(self.on_frame)
+
+    def detach(self):
+        if self.memory is not None:
+            self.memory.vblank_hooks.remove(self.on_frame)
+            self.memory = None
+
+    def on_frame(self, screen):
+        number = self.frames
+        self.frames += 1
+        if self.skip_duplicates and self.last is not None and np.array_equal(screen, self.last):
+            self.duplicates += 1
+            return
+        frame = screen.copy()
+        self.last = frame
+        if self.policy == "block":
+            self.queue.put((number, frame))
+        else:
+            try:
+                self.queue.put_nowait((number, frame))
+            except queue.Full:
+                self.dropped += 1
+                self.last = None  # the next frame has to go in even if it matches this one
+
+    #############################################################################
+    #                                                                           #
+    #                               WRITER THREAD                               #
+    #                                                                           #
+    #############################################################################
+
+    def write_frames(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so the emulator never blocks on a dead writer
+            try:
+                self.write_frame(*item)
+                self.written += 1
+            except Exception as error:
+                self.error = error
+
+    def write_frame(self, number, frame):
+        if self.format == "png":
+            with open(os.path.join(self.target, "frame_%06d.png" % number), "wb") as file:
+                file.write(png_bytes(frame))
+        elif self.format == "y4m":
+            if not self.header_written:
+                colour_space = "C444" if frame.ndim == 3 else "Cmono"
+                self.file.write(b"YUV4MPEG2 W%d H%d F%d:%d Ip A1:1 %s\n" % (
+                    SCREEN_WIDTH, SCREEN_HEIGHT, emu.cpu.MAX_CYCLES_PER_SECOND, emu.cpu.LCD_FRAME_CYCLES,
+                    colour_space.encode()))
+                self.header_written = True
+            self.file.write(b"FRAME\n" + y4m_planes(frame))
+        else:
+            self.file.write(frame.tobytes())
+
+    # Waits for every queued frame to be written, raises whatever stopped the
+    # writer if something did
+    def close(self):
+        self.detach()
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.process is not None:
+            self.process.wait()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return {"frames": self.frames, "written": self.written, "duplicates": self.duplicates,
+                "dropped": self.dropped}
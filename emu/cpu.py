@@ -1,8 +1,14 @@
+import emu.blocks
 import emu.memory
 import emu.registers
 import emu.rom
-from emu.memory import test_bit, bit_set, bit_reset, bit_get_val
-from emu.registers import FLAG_Z, FLAG_C, FLAG_H, FLAG_N
+import emu.state
+from emu.alu import (ADD_FLAGS, SUB_FLAGS, AND_FLAGS, ZERO_FLAGS, INC_FLAGS, DEC_FLAGS, SHIFT_RESULTS, SHIFT_FLAGS,
+                     BIT_FLAGS, DAA_RESULTS, DAA_FLAGS, SHIFT_RLC, SHIFT_RRC, SHIFT_RL, SHIFT_RR, SHIFT_SLA, SHIFT_SRA,
+                     SHIFT_SWAP, SHIFT_SRL)
+from emu.registers import A, F
+from emu.opcodes import OPCODES
+from emu.scheduler import FRAME, NEVER
 
 
 #
@@ -14,290 +20,106 @@ from emu.registers import FLAG_Z, FLAG_C, FLAG_H, FLAG_N
 # So for example if the stack pointer is 0xff00 and I want to load it into address 0x1234, the instruction would look like this: 0x08 0x34 0x12 And memory at 0x1234 and 0x1235 would look like this?: 0x1234 - 0x00 0x1235 - 0xff Is that correct?
 #
 
+MAX_CYCLES_PER_SECOND = 4194304
+MAX_CYCLES = MAX_CYCLES_PER_SECOND // 60
+FRAMES_PER_SECOND = MAX_CYCLES_PER_SECOND / MAX_CYCLES
+# what the LCD itself takes from one VBlank to the next, 154 lines of 456
+LCD_FRAME_CYCLES = 70224
+LCD_FRAMES_PER_SECOND = MAX_CYCLES_PER_SECOND / LCD_FRAME_CYCLES  # 59.7
+
+
 class CPU:
-    def __init__(self, rom=None):
-        self.MEMORY = emu.memory.Memory(rom)
+    def __init__(self, rom=None, screen=None, colours=emu.memory.COLOURS):
+        self.MEMORY = emu.memory.Memory(rom, screen, colours)
         self.REGISTERS = self.MEMORY.registers
-        self.clockcycles = 0
+        self.SCHEDULER = self.MEMORY.scheduler
+        self.halted = False
+        self.frame_hooks = []  # called with no arguments at the end of every update
+        self.BLOCKS = emu.blocks.BlockCache(self)
         self.MEMORY.init()
 
-    def update(self):
-        MAX_CYCLES_PER_SECOND = 4194304
-        MAX_CYCLES = MAX_CYCLES_PER_SECOND / 60
-        cyclesthisupdate = 0
-
-        while cyclesthisupdate < MAX_CYCLES:
-            cycles = self.execute_next_opcode()
-            cyclesthisupdate += cycles
-            self.clockcycles += cycles
-            self.MEMORY.update_timers(cycles)
-            self.MEMORY.update_graphics(cycles)
-            self.MEMORY.do_interrupts()
-
-        self.MEMORY.render_screen()
-
+    # the scheduler owns the clock, everything else is stamped against it
+    @property
+    def clockcycles(self):
+        return self.SCHEDULER.now
+
+    # Runs instructions back to back until the scheduler has something due,
+    # then lets the timers, LCD and interrupts catch up in one go. The LCD
+    # still keeps time when render is off, it just draws nothing.
+    #
+    # An update is a 60th of a second. until_vblank instead runs up to the
+    # start of the next VBlank, one LCD frame, where the screen holds a
+    # whole frame; with the LCD off that never comes, so it stops after an
+    # LCD frame's worth of cycles.
+    def update(self, render=True, until_vblank=False):
+        memory = self.MEMORY
+        memory.render_enabled = render
+        scheduler = self.SCHEDULER
+        execute = self.execute_next_block
+        scheduler.schedule_in(FRAME, LCD_FRAME_CYCLES if until_vblank else MAX_CYCLES)
+        vblank_count = memory.vblank_count
+
+        while True:
+            while scheduler.now < scheduler.next_deadline:
+                scheduler.now += execute()
+            if memory.run_events():
+                self.halted = False  # an interrupt was serviced, its handler runs now
+            if scheduler.is_due(FRAME) or until_vblank and memory.vblank_count != vblank_count:
+                break
+
+        scheduler.cancel(FRAME)
+        for hook in self.frame_hooks:
+            hook()
+
+    def run_frame(self, render=True):
+        self.update(render, until_vblank=True)
+
+    def save_state(self) -> bytes:
+        return emu.state.save_state(self)
+
+    def load_state(self, data):
+        emu.state.load_state(self, data)
+
+    # registers are addressed by number, see emu.registers
     def set_reg(self, reg, val):
-        self.REGISTERS.__setattr__(reg, val)
+        self.REGISTERS.r[reg] = val
 
     def get_reg(self, reg):
-        return self.REGISTERS.__getattribute__(reg)
+        return self.REGISTERS.r[reg]
 
     def execute_next_opcode(self):
+        if self.halted:
+            if self.MEMORY.memory[0xFF0F] & self.MEMORY.memory[0xFFFF] & 0x1F:
+                self.halted = False
+            else:
+                # nothing can raise an interrupt before the next event, so
+                # the 4 cycle steps up to it are taken all at once
+                deadline = self.SCHEDULER.next_deadline
+                if deadline == NEVER:
+                    return 4
+                return max(4, -(-(deadline - self.SCHEDULER.now) // 4) * 4)
         opcode = self.MEMORY.read(self.REGISTERS.pc)
         self.REGISTERS.pc += 1
         return self.execute_opcode(opcode)
 
+    # Runs the translated block at pc, or interprets one instruction where
+    # there isn't one yet, see emu.blocks
+    def execute_next_block(self):
+        if self.halted:
+            return self.execute_next_opcode()
+        pc = self.REGISTERS.pc
+        if 0x4000 <= pc < 0x8000:
+            block = self.BLOCKS.blocks.get(self.MEMORY.current_rom_bank << 16 | pc)
+        else:
+            block = self.BLOCKS.blocks.get(pc)
+        if block is None:
+            return self.BLOCKS.miss(pc)
+        return block(self)
+
     def execute_opcode(self, opcode) -> int:
         if opcode > 0xFF:
             raise ValueError("Unknown opcode")
-        # NOP
-        elif opcode == 0x00:
-            return 4
-
-        # LD load
-        elif opcode == 0x2:
-            self.MEMORY.write(self.REGISTERS.bc, self.REGISTERS.a)
-            return 8
-
-        elif opcode == 0x12:
-            self.MEMORY.write(self.REGISTERS.de, self.REGISTERS.a)
-            return 8
-
-        elif opcode == 0x22:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.a)
-            self.REGISTERS.hl += 1
-            return 8
-        elif opcode == 0x32:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.a)
-            self.REGISTERS.hl -= 1
-            return 8
-        elif opcode == 0x6:
-            self.set_reg("b", self.get_n_byte())
-            return 8
-        elif opcode == 0x16:
-            self.set_reg("d", self.get_n_byte())
-            return 8
-        elif opcode == 0x26:
-            self.set_reg("h", self.get_n_byte())
-            return 8
-        elif opcode == 0x36:
-            self.MEMORY.write(self.REGISTERS.hl, self.get_n_byte())
-            return 12
-        elif opcode == 0xa:
-            self.set_reg("a", self.MEMORY.read(self.REGISTERS.bc))
-            return 8
-        elif opcode == 0x1a:
-            self.set_reg("a", self.MEMORY.read(self.REGISTERS.de))
-            return 8
-        elif opcode == 0x2a:
-            self.set_reg("a", self.MEMORY.read(self.REGISTERS.hl))
-            self.REGISTERS.hl += 1
-            return 8
-        elif opcode == 0x3a:
-            self.set_reg("a", self.MEMORY.read(self.REGISTERS.hl))
-            self.REGISTERS.hl -= 1
-            return 8
-        elif opcode == 0xe:
-            self.set_reg("c", self.get_n_byte())
-            return 8
-        elif opcode == 0x1e:
-            self.set_reg("e", self.get_n_byte())
-            return 8
-        elif opcode == 0x2e:
-            self.set_reg("l", self.get_n_byte())
-            return 8
-        elif opcode == 0x3e:
-            self.set_reg("a", self.get_n_byte())
-            return 8
-        elif opcode == 0x40:
-            self.set_reg("b", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x41:
-            self.set_reg("b", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x42:
-            self.set_reg("b", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x43:
-            self.set_reg("b", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x44:
-            self.set_reg("b", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x45:
-            self.set_reg("b", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x46:
-            self.set_reg("b", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x47:
-            self.set_reg("b", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x48:
-            self.set_reg("c", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x49:
-            self.set_reg("c", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x4a:
-            self.set_reg("c", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x4b:
-            self.set_reg("c", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x4c:
-            self.set_reg("c", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x4d:
-            self.set_reg("c", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x4e:
-            self.set_reg("c", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x4f:
-            self.set_reg("c", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x50:
-            self.set_reg("d", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x51:
-            self.set_reg("d", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x52:
-            self.set_reg("d", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x53:
-            self.set_reg("d", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x54:
-            self.set_reg("d", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x55:
-            self.set_reg("d", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x56:
-            self.set_reg("d", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x57:
-            self.set_reg("d", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x58:
-            self.set_reg("e", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x59:
-            self.set_reg("e", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x5a:
-            self.set_reg("e", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x5b:
-            self.set_reg("e", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x5c:
-            self.set_reg("e", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x5d:
-            self.set_reg("e", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x5e:
-            self.set_reg("e", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x5f:
-            self.set_reg("e", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x60:
-            self.set_reg("h", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x61:
-            self.set_reg("h", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x62:
-            self.set_reg("h", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x63:
-            self.set_reg("h", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x64:
-            self.set_reg("h", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x65:
-            self.set_reg("h", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x66:
-            self.set_reg("h", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x67:
-            self.set_reg("h", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x68:
-            self.set_reg("l", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x69:
-            self.set_reg("l", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x6a:
-            self.set_reg("l", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x6b:
-            self.set_reg("l", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x6c:
-            self.set_reg("l", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x6d:
-            self.set_reg("l", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x6e:
-            self.set_reg("l", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x6f:
-            self.set_reg("l", self.REGISTERS.a)
-            return 4
-        elif opcode == 0x70:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.b)
-            return 8
-        elif opcode == 0x71:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.c)
-            return 8
-        elif opcode == 0x72:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.d)
-            return 8
-        elif opcode == 0x73:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.e)
-            return 8
-        elif opcode == 0x74:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.h)
-            return 8
-        elif opcode == 0x75:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.l)
-            return 8
-        elif opcode == 0x77:
-            self.MEMORY.write(self.REGISTERS.hl, self.REGISTERS.a)
-            return 8
-        elif opcode == 0x78:
-            self.set_reg("a", self.REGISTERS.b)
-            return 4
-        elif opcode == 0x79:
-            self.set_reg("a", self.REGISTERS.c)
-            return 4
-        elif opcode == 0x7a:
-            self.set_reg("a", self.REGISTERS.d)
-            return 4
-        elif opcode == 0x7b:
-            self.set_reg("a", self.REGISTERS.e)
-            return 4
-        elif opcode == 0x7c:
-            self.set_reg("a", self.REGISTERS.h)
-            return 4
-        elif opcode == 0x7d:
-            self.set_reg("a", self.REGISTERS.l)
-            return 4
-        elif opcode == 0x7e:
-            self.set_reg("a", self.MEMORY.read(self.REGISTERS.hl))
-            return 8
-        elif opcode == 0x7f:
-            self.set_reg("a", self.REGISTERS.a)
-            return 4
+        return OPCODES[opcode](self)
 
     def get_n_byte(self):
         n = self.MEMORY.read(self.REGISTERS.pc)
@@ -310,114 +132,131 @@ class CPU:
         self.REGISTERS.pc += 2
         return (n2 << 8) | n1
 
-    def add8bit(self, reg, to_add, use_immediate, add_carry):
-        before = self.get_reg(reg)
-
-        if use_immediate:
-            n = self.MEMORY.read(self.REGISTERS.pc)
-            self.REGISTERS.pc += 1
-            adding = n
-        else:
-            adding = to_add
-
-        if add_carry:
-            if test_bit(self.REGISTERS.f, FLAG_C):
-                adding += 1
+    #############################################################################
+    #                                                                           #
+    #                                 8 BIT ALU                                 #
+    #                                                                           #
+    #############################################################################
 
-        ans = before + adding
-
-        if ans > 0xFF:
-            ans -= 0x100
-
-        self.set_reg(reg, ans)
-        self.REGISTERS.f = 0
-
-        if ans == 0:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_Z)
-
-        htest = before & 0xF
-        htest += adding & 0xF
-
-        if htest > 0xF:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_H)
-
-        if before + adding > 0xFF:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_C)
-
-    def sub8bit(self, reg, to_sub, use_immediate, sub_carry):
-        before = self.get_reg(reg)
+    # Flags come from the tables in emu.alu, see emu.opcodes for the inlined
+    # versions the opcodes use
 
+    def add8bit(self, reg, to_add, use_immediate, add_carry):
         if use_immediate:
-            n = self.MEMORY.read(self.REGISTERS.pc)
-            self.REGISTERS.pc += 1
-            subbing = n
-        else:
-            subbing = to_sub
-
-        if sub_carry:
-            if test_bit(self.REGISTERS.f, FLAG_C):
-                subbing += 1
-
-        ans = before - subbing
-
-        if ans < 0:
-            ans += 0x100
-
-        self.set_reg(reg, ans)
-        self.REGISTERS.f = 0
-
-        if ans == 0:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_Z)
-
-        htest = before & 0xF
-        htest -= subbing & 0xF
-
-        if htest < 0:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_H)
+            to_add = self.get_n_byte()
+        r = self.REGISTERS.r
+        carry = r[F] >> 4 & 1 if add_carry else 0
+        before = r[reg]
+        r[F] = ADD_FLAGS[carry << 16 | before << 8 | to_add]
+        r[reg] = (before + to_add + carry) & 0xFF
+
+    def sub8bit(self, reg, to_sub, use_immediate, sub_carry, store=True):
+        if use_immediate:
+            to_sub = self.get_n_byte()
+        r = self.REGISTERS.r
+        carry = r[F] >> 4 & 1 if sub_carry else 0
+        before = r[reg]
+        r[F] = SUB_FLAGS[carry << 16 | before << 8 | to_sub]
+        if store:
+            r[reg] = (before - to_sub - carry) & 0xFF
+
+    def cp8bit(self, reg, to_cp, use_immediate):
+        self.sub8bit(reg, to_cp, use_immediate, False, store=False)
+
+    def and8bit(self, reg, to_and, use_immediate):
+        if use_immediate:
+            to_and = self.get_n_byte()
+        r = self.REGISTERS.r
+        r[reg] &= to_and
+        r[F] = AND_FLAGS[r[reg]]
 
-        if before < subbing:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_C)
+    def or8bit(self, reg, to_or, use_immediate):
+        if use_immediate:
+            to_or = self.get_n_byte()
+        r = self.REGISTERS.r
+        r[reg] |= to_or
+        r[F] = ZERO_FLAGS[r[reg]]
 
     def xor8bit(self, reg, to_xor, use_immediate):
-        before = self.get_reg(reg)
-
         if use_immediate:
-            n = self.MEMORY.read(self.REGISTERS.pc)
-            self.REGISTERS.pc += 1
-            xor = n
-        else:
-            xor = to_xor
-
-        ans = before ^ xor
-
-        self.set_reg(reg, ans)
-        self.REGISTERS.f = 0
-
-        if ans == 0:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_Z)
-
-    def rrc8bit(self, reg):
-        val = self.get_reg(reg)
-        is_lsb_set = test_bit(val, 0)
-
-        self.REGISTERS.f = 0
-
-        val >>= 1
-
-        if is_lsb_set:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_C)
-            val = bit_set(val, 7)
-
-        if val == 0:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_Z)
-
-        self.set_reg(reg, val)
-
-    def test8bit(self, reg, bit):
-        if test_bit(self.get_reg(reg), bit):
-            self.REGISTERS.f = bit_reset(self.REGISTERS.f, FLAG_Z)
-        else:
-            self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_Z)
-
-        self.REGISTERS.f = bit_reset(self.REGISTERS.f, FLAG_N)
-        self.REGISTERS.f = bit_set(self.REGISTERS.f, FLAG_H)
+            to_xor = self.get_n_byte()
+        r = self.REGISTERS.r
+        r[reg] ^= to_xor
+        r[F] = ZERO_FLAGS[r[reg]]
+
+    # carry is left untouched by INC and DEC
+    def inc8bit(self, val):
+        r = self.REGISTERS.r
+        r[F] = r[F] & 0x10 | INC_FLAGS[val]
+        return (val + 1) & 0xFF
+
+    def dec8bit(self, val):
+        r = self.REGISTERS.r
+        r[F] = r[F] & 0x10 | DEC_FLAGS[val]
+        return (val - 1) & 0xFF
+
+    def daa(self):
+        r = self.REGISTERS.r
+        index = (r[F] & 0x70) << 4 | r[A]
+        r[A] = DAA_RESULTS[index]
+        r[F] = DAA_FLAGS[index]
+
+    #############################################################################
+    #                                                                           #
+    #                                16 BIT ALU                                 #
+    #                                                                           #
+    #############################################################################
+
+    def add16bit(self, to_add):
+        r = self.REGISTERS.r
+        before = self.REGISTERS.hl
+        # the high byte addition, carrying in from the low one, sets H and C
+        carry = 1 if (before & 0xFF) + (to_add & 0xFF) > 0xFF else 0
+        r[F] = r[F] & 0x80 | ADD_FLAGS[carry << 16 | (before & 0xFF00) | to_add >> 8] & 0x30
+        self.REGISTERS.hl = (before + to_add) & 0xFFFF
+
+    def add_sp_signed(self, offset):
+        sp = self.REGISTERS.sp
+        # flags come from the unsigned low byte addition, Z and N cleared
+        self.REGISTERS.r[F] = ADD_FLAGS[(sp & 0xFF) << 8 | offset & 0xFF] & 0x30
+        return (sp + offset) & 0xFFFF
+
+    #############################################################################
+    #                                                                           #
+    #                          ROTATES, SHIFTS AND BITS                         #
+    #                                                                           #
+    #############################################################################
+
+    def shift(self, operation, val):
+        r = self.REGISTERS.r
+        index = operation | (r[F] & 0x10) << 4 | val
+        r[F] = SHIFT_FLAGS[index]
+        return SHIFT_RESULTS[index]
+
+    def rlc8bit(self, val):
+        return self.shift(SHIFT_RLC, val)
+
+    def rrc8bit(self, val):
+        return self.shift(SHIFT_RRC, val)
+
+    def rl8bit(self, val):
+        return self.shift(SHIFT_RL, val)
+
+    def rr8bit(self, val):
+        return self.shift(SHIFT_RR, val)
+
+    def sla8bit(self, val):
+        return self.shift(SHIFT_SLA, val)
+
+    def sra8bit(self, val):
+        return self.shift(SHIFT_SRA, val)
+
+    def srl8bit(self, val):
+        return self.shift(SHIFT_SRL, val)
+
+    def swap8bit(self, val):
+        return self.shift(SHIFT_SWAP, val)
+
+    def test8bit(self, val, bit):
+        r = self.REGISTERS.r
+        r[F] = r[F] & 0x10 | BIT_FLAGS[bit << 8 | val]
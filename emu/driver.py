@@ -0,0 +1,91 @@
+import asyncio
+
+import emu.cpu
+from emu.memory import JOYPAD_KEYS
+
+#############################################################################
+#                                                                           #
+#                               ASYNCIO DRIVER                              #
+#                                                                           #
+#############################################################################
+
+# Runs an emulator inside an asyncio application. Each LCD frame, up to its
+# VBlank, is emulated in an executor so the event loop stays free, and the
+# frames are paced at the LCD's 59.7 Hz against fixed deadlines (start + n
+# frame times) so sleep jitter never adds up.
+# A driver that falls more than MAX_LAG frames behind gives up on the missed
+# deadlines instead of running flat out to catch up, and counts them.
+#
+# Inputs are (key, pressed) put on the driver's queue, key being a
+# JOYPAD_KEYS name or number. Everything queued is applied between frames.
+#
+#     driver = AsyncDriver(emu.cpu.CPU(rom))
+#     async for frame in driver:
+#         ...
+
+MAX_LAG = 4  # frames
+
+
+class AsyncDriver:
+    def __init__(self, cpu, inputs=None, uncapped=False, executor=None):
+        self.cpu = cpu
+        self.inputs = inputs if inputs is not None else asyncio.Queue()
+        self.uncapped = uncapped
+        self.executor = executor  # None is the loop's default thread pool
+        self.frame_time = 1 / emu.cpu.LCD_FRAMES_PER_SECOND
+        self.frame = 0
+        self.late_frames = 0
+        self.running = False
+
+    def __aiter__(self):
+        return self.frames()
+
+    # Emulates frames, forever when count is None, and yields a copy of each
+    # finished screen
+    async def frames(self, count=None):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        deadline = loop.time()
+        end = None if count is None else self.frame + count
+        try:
+            while self.running and (end is None or self.frame < end):
+                self.apply_inputs()
+                await loop.run_in_executor(self.executor, self.cpu.run_frame)
+                self.frame += 1
+                yield self.cpu.MEMORY.screen_data.copy()
+
+                if self.uncapped:
+                    await asyncio.sleep(0)
+                    continue
+                deadline += self.frame_time
+                delay = deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay > MAX_LAG * self.frame_time:
+                    self.late_frames += int(-delay / self.frame_time)
+                    deadline = loop.time()
+        finally:
+            self.running = False
+
+    async def run(self, count=None):
+        async for _ in self.frames(count):
+            pass
+
+    def stop(self):
+        self.running = False
+
+    def press(self, key):
+        self.inputs.put_nowait((key, True))
+
+    def release(self, key):
+        self.inputs.put_nowait((key, False))
+
+    def apply_inputs(self):
+        memory = self.cpu.MEMORY
+        while not self.inputs.empty():
+            key, pressed = self.inputs.get_nowait()
+            key = JOYPAD_KEYS.get(key, key)
+            if pressed:
+                memory.key_pressed(key)
+            else:
+                memory.key_released(key)
@@ -0,0 +1,104 @@
+import time
+
+import numpy as np
+
+#############################################################################
+#                                                                           #
+#                          TRIPLE BUFFERED SCREEN                           #
+#                                                                           #
+#############################################################################
+
+# The LCD draws into a back buffer. At VBlank, with the frame complete, the
+# back buffer is published as the latest frame and drawing moves on to a
+# buffer that is neither the one just published nor the one the consumer
+# is reading. A consumer on another thread takes the latest frame without
+# copying and without locks, and can hold on to it as long as it likes: the
+# emulator never waits for it, frames it didn't get to are just dropped.
+#
+# Publishing and acquiring only ever store one attribute at a time, which
+# the GIL makes atomic. acquire() marks the buffer it wants as being read
+# and then checks it is still the latest; if a new frame came out in
+# between, the emulator may already be drawing into it, so it tries again.
+#
+# Two buffers aren't enough for this: with the consumer holding one and the
+# newest frame in the other, the emulator would have nowhere to draw.
+
+
+class FrameBuffer:
+    def __init__(self, cpu, buffers=3):
+        if buffers < 3:
+            raise ValueError("A lock-free framebuffer needs at least 3 buffers, got %d" % buffers)
+        self.memory = cpu.MEMORY
+        screen = self.memory.screen_data
+        self.buffers = [np.zeros_like(screen) for _ in range(buffers)]
+        self.back = 0  # buffer the LCD is drawing into
+        self.latest = None  # (frame number, buffer, time published) of the newest complete frame
+        self.reading = None  # buffer the consumer holds
+        self.published = 0
+        self.acquired = None  # frame number the consumer holds
+        self.dropped = 0  # complete frames the consumer never saw
+        self.previous_screen = screen
+
+    def attach(self):
+        self.previous_screen = self.memory.screen_data
+        self.memory.screen_data = self.buffers[self.back]
+        self.memory.vblank_hooks.append(self.swap)
+
+    def detach(self):
+        self.memory.vblank_hooks.remove(self.swap)
+        self.memory.screen_data = self.previous_screen
+
+    #############################################################################
+    #                                                                           #
+    #                             EMULATION THREAD                              #
+    #                                                                           #
+    #############################################################################
+
+    # screen is the finished back buffer
+    def swap(self, screen):
+        self.published += 1
+        self.latest = (self.published, self.back, time.perf_counter())
+        reading = self.reading
+        self.back = next(i for i in range(len(self.buffers)) if i != self.back and i != reading)
+        self.memory.screen_data = self.buffers[self.back]
+
+    #############################################################################
+    #                                                                           #
+    #                              CONSUMER THREAD                              #
+    #                                                                           #
+    #############################################################################
+
+    # The newest complete frame, or None before the first one. It stays
+    # untouched until the next acquire() or release().
+    def acquire(self):
+        while True:
+            latest = self.latest
+            if latest is None:
+                return None
+            number, buffer, _ = latest
+            self.reading = buffer
+            if self.latest is latest:
+                break
+        if self.acquired is not None and number > self.acquired + 1:
+            self.dropped += number - self.acquired - 1
+        self.acquired = number
+        return self.buffers[buffer]
+
+    def release(self):
+        self.reading = None
+
+    # How many frames newer than the held one are out, 0 when it is current
+    @property
+    def frame_age(self):
+        if self.acquired is None:
+            return self.published
+        return self.published - self.acquired
+
+    # Seconds since the newest frame was published
+    def latest_age(self):
+        latest = self.latest
+        return None if latest is None else time.perf_counter() - latest[2]
+
+    def stats(self):
+        return {"published": self.published, "acquired": self.acquired, "dropped": self.dropped,
+                "frame_age": self.frame_age}
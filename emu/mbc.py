@@ -0,0 +1,305 @@
+import struct
+
+#############################################################################
+#                                                                           #
+#                           CARTRIDGE MAPPERS                               #
+#                                                                           #
+#############################################################################
+
+# The memory bank controller on the cartridge decides which ROM bank is seen
+# at 0x4000-0x7FFF (and on MBC1 at 0x0000-0x3FFF) and which RAM bank, if
+# any, at 0xA000-0xBFFF. Games talk to it by writing to ROM.
+#
+# A mapper installs one write handler per controller register into the
+# memory page table and, whenever a register changes, points the banked
+# pages straight at the active bank: a memoryview page of the cartridge for
+# ROM and of Memory.ram_banks for RAM. A banked read is then the same single
+# subscript as any other read, only switching costs anything. Disabled RAM
+# and anything that isn't plain bytes (MBC2's 4 bit RAM, the MBC3 clock) go
+# through handlers instead.
+#
+# Every mapper keeps its registers as written in rom_bank, ram_bank,
+# ram_enabled and mode, banks() turns them into the banks that are mapped.
+
+CLOCK = 4194304  # cycles per second, emu.cpu.MAX_CYCLES_PER_SECOND
+PAGE_SIZE = 0x100
+RAM_BANK_SIZE = 0x2000
+RAM_BANK_PAGES = RAM_BANK_SIZE // PAGE_SIZE
+SECONDS_PER_DAY = 86400
+RTC_DAYS = 512  # the day counter is 9 bits
+
+# ram enabled, mode, ROM bank, RAM bank, then the MBC3 clock: seconds, cycle
+# they were counted up to, halted, day carry, last latch write, latched
+# seconds, minutes, hours, days low, days high
+STATE = struct.Struct("<?BHBQQ??B5s")
+
+
+class Mapper:
+    def __init__(self, memory):
+        self.memory = memory
+        self.cartridge = memory.cartridge
+        view = memoryview(memory.ram_banks)
+        self.ram_pages = [view[i:i + PAGE_SIZE] for i in range(0, len(view), PAGE_SIZE)]
+        self.ram_bank_count = len(view) // RAM_BANK_SIZE
+
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.ram_enabled = False
+        self.mode = 0
+        self.bank0 = 0  # ROM bank mapped at 0x0000-0x3FFF
+        self.ram_mapped = None  # (enabled, bank) mapped at 0xA000-0xBFFF
+
+        self.rtc_seconds = 0
+        self.rtc_cycle = 0
+        self.rtc_halted = False
+        self.rtc_carry = False
+        self.latch_written = 0xFF
+        self.latched = bytes(5)
+
+    # (start, end, write handler) of each controller register
+    def registers(self):
+        return []
+
+    # (bank at 0x0000, bank at 0x4000, RAM bank) the registers select
+    def banks(self):
+        return 0, 1, 0
+
+    # Installs the register handlers and the current banks, after the page
+    # table has been built or the registers loaded from a save state
+    def map(self):
+        memory = self.memory
+        memory.map_handler(0x0000, 0x7FFF, write=self.write_nothing)
+        for start, end, write in self.registers():
+            memory.map_handler(start, end, write=write)
+        if self.cartridge is not None:
+            self.bank0 = self.banks()[0] % self.cartridge.bank_count
+            memory.read_pages[0x00:0x40] = self.cartridge.bank_pages[self.bank0]
+        self.ram_mapped = None
+        self.switch_banks()
+
+    def switch_banks(self):
+        bank0, bank, ram_bank = self.banks()
+        memory = self.memory
+        cartridge = self.cartridge
+        if cartridge is not None:
+            bank = bank % cartridge.bank_count
+            memory.read_pages[0x40:0x80] = cartridge.bank_pages[bank]
+            memory.current_rom_bank = bank
+            bank0 = bank0 % cartridge.bank_count
+            if bank0 != self.bank0:
+                self.bank0 = bank0
+                memory.read_pages[0x00:0x40] = cartridge.bank_pages[bank0]
+                for hook in memory.bank0_hooks:
+                    hook()
+        if (self.ram_enabled, ram_bank) != self.ram_mapped:
+            self.ram_mapped = (self.ram_enabled, ram_bank)
+            self.map_ram(ram_bank)
+
+    def map_ram(self, ram_bank):
+        memory = self.memory
+        if self.ram_enabled:
+            start = (ram_bank % self.ram_bank_count) * RAM_BANK_PAGES
+            pages = self.ram_pages[start:start + RAM_BANK_PAGES]
+            memory.read_pages[0xA0:0xC0] = pages
+            memory.write_pages[0xA0:0xC0] = pages
+        else:
+            memory.map_handler(0xA000, 0xBFFF, read=self.read_nothing, write=self.write_nothing)
+
+    def set_ram_enabled(self, enabled):
+        if enabled != self.ram_enabled:
+            self.ram_enabled = enabled
+            self.switch_banks()
+
+    def write_ram_enable(self, address, data):
+        self.set_ram_enabled(data & 0xF == 0xA)
+
+    def read_nothing(self, address):
+        return 0xFF
+
+    def write_nothing(self, address, data):
+        pass
+
+    def save_state(self):
+        return STATE.pack(self.ram_enabled, self.mode, self.rom_bank, self.ram_bank, self.rtc_seconds,
+                          self.rtc_cycle, self.rtc_halted, self.rtc_carry, self.latch_written, self.latched)
+
+    def load_state(self, data):
+        (self.ram_enabled, self.mode, self.rom_bank, self.ram_bank, self.rtc_seconds, self.rtc_cycle,
+         self.rtc_halted, self.rtc_carry, self.latch_written, self.latched) = STATE.unpack(data)
+        self.map()
+
+
+# No controller, cartridge RAM is always there if there is any
+class ROMOnly(Mapper):
+    def __init__(self, memory):
+        super().__init__(memory)
+        self.ram_enabled = self.cartridge is not None and self.cartridge.ram_size > 0
+
+
+# 5 bit ROM bank register and a 2 bit one that is either the top of the ROM
+# bank or, in mode 1, the RAM bank and the bank at 0x0000 as well
+class MBC1(Mapper):
+    def registers(self):
+        return [(0x0000, 0x1FFF, self.write_ram_enable), (0x2000, 0x3FFF, self.write_rom_bank),
+                (0x4000, 0x5FFF, self.write_ram_bank), (0x6000, 0x7FFF, self.write_mode)]
+
+    def banks(self):
+        bank = self.ram_bank << 5 | (self.rom_bank & 0x1F or 1)
+        if self.mode:
+            return self.ram_bank << 5, bank, self.ram_bank
+        return 0, bank, 0
+
+    def write_rom_bank(self, address, data):
+        self.rom_bank = data & 0x1F
+        self.switch_banks()
+
+    def write_ram_bank(self, address, data):
+        self.ram_bank = data & 0x3
+        self.switch_banks()
+
+    def write_mode(self, address, data):
+        self.mode = data & 0x1
+        self.switch_banks()
+
+
+# 4 bit ROM bank and 512 4 bit cells of RAM built in. Bit 8 of the address
+# picks the register, so the handlers alternate page by page.
+class MBC2(Mapper):
+    def registers(self):
+        return [(page << 8, page << 8 | 0xFF, self.write_rom_bank if page & 1 else self.write_ram_enable)
+                for page in range(0x00, 0x40)]
+
+    def banks(self):
+        return 0, self.rom_bank & 0xF or 1, 0
+
+    def map_ram(self, ram_bank):
+        if self.ram_enabled:
+            self.memory.map_handler(0xA000, 0xBFFF, read=self.read_ram, write=self.write_ram)
+        else:
+            self.memory.map_handler(0xA000, 0xBFFF, read=self.read_nothing, write=self.write_nothing)
+
+    def write_rom_bank(self, address, data):
+        self.rom_bank = data & 0xF
+        self.switch_banks()
+
+    def read_ram(self, address):
+        return self.memory.ram_banks[address & 0x1FF] | 0xF0
+
+    def write_ram(self, address, data):
+        self.memory.ram_banks[address & 0x1FF] = data & 0xF
+
+
+# 7 bit ROM bank, RAM banks 0-3 and, on cartridges with a timer, the clock
+# registers as RAM banks 8-0xC. The clock runs on emulated time so runs stay
+# reproducible; it is only brought up to date when it is looked at.
+class MBC3(Mapper):
+    def __init__(self, memory, has_rtc=False):
+        super().__init__(memory)
+        self.has_rtc = has_rtc
+
+    def registers(self):
+        return [(0x0000, 0x1FFF, self.write_ram_enable), (0x2000, 0x3FFF, self.write_rom_bank),
+                (0x4000, 0x5FFF, self.write_ram_bank), (0x6000, 0x7FFF, self.write_latch)]
+
+    def banks(self):
+        return 0, self.rom_bank & 0x7F or 1, self.ram_bank
+
+    def map_ram(self, ram_bank):
+        if self.ram_enabled and ram_bank >= 0x8:
+            if self.has_rtc and ram_bank <= 0xC:
+                self.memory.map_handler(0xA000, 0xBFFF, read=self.read_rtc, write=self.write_rtc)
+            else:
+                self.memory.map_handler(0xA000, 0xBFFF, read=self.read_nothing, write=self.write_nothing)
+        else:
+            super().map_ram(ram_bank)
+
+    def write_rom_bank(self, address, data):
+        self.rom_bank = data & 0x7F
+        self.switch_banks()
+
+    def write_ram_bank(self, address, data):
+        self.ram_bank = data & 0xF
+        self.switch_banks()
+
+    # writing 0 then 1 copies the running clock into the registers games read
+    def write_latch(self, address, data):
+        if self.latch_written == 0 and data == 1:
+            self.latched = self.rtc_registers()
+        self.latch_written = data
+
+    def update_rtc(self):
+        now = self.memory.scheduler.now
+        if self.rtc_halted:
+            self.rtc_cycle = now
+            return
+        elapsed = (now - self.rtc_cycle) // CLOCK
+        self.rtc_seconds += elapsed
+        self.rtc_cycle += elapsed * CLOCK
+        if self.rtc_seconds >= RTC_DAYS * SECONDS_PER_DAY:
+            self.rtc_seconds %= RTC_DAYS * SECONDS_PER_DAY
+            self.rtc_carry = True
+
+    # seconds, minutes, hours, days low, days high (bit 0 day 8, 6 halt, 7 carry)
+    def rtc_registers(self):
+        self.update_rtc()
+        seconds = self.rtc_seconds
+        days = seconds // SECONDS_PER_DAY
+        return bytes([seconds % 60, seconds // 60 % 60, seconds // 3600 % 24, days & 0xFF,
+                      days >> 8 | self.rtc_halted << 6 | self.rtc_carry << 7])
+
+    def read_rtc(self, address):
+        return self.latched[self.ram_bank - 0x8]
+
+    def write_rtc(self, address, data):
+        registers = bytearray(self.rtc_registers())
+        registers[self.ram_bank - 0x8] = data
+        seconds, minutes, hours, days_low, days_high = registers
+        days = (days_high & 0x1) << 8 | days_low
+        self.rtc_seconds = (((days * 24 + (hours & 0x1F)) * 60 + (minutes & 0x3F)) * 60 + (seconds & 0x3F))
+        if self.ram_bank == 0x8:
+            self.rtc_cycle = self.memory.scheduler.now  # writing the seconds restarts the current one
+        self.rtc_halted = bool(days_high & 0x40)
+        self.rtc_carry = bool(days_high & 0x80)
+
+
+# 9 bit ROM bank split over two registers, bank 0 included, and 16 RAM banks
+class MBC5(Mapper):
+    def registers(self):
+        return [(0x0000, 0x1FFF, self.write_ram_enable), (0x2000, 0x2FFF, self.write_rom_bank_low),
+                (0x3000, 0x3FFF, self.write_rom_bank_high), (0x4000, 0x5FFF, self.write_ram_bank)]
+
+    def banks(self):
+        return 0, self.rom_bank, self.ram_bank
+
+    def write_rom_bank_low(self, address, data):
+        self.rom_bank = self.rom_bank & 0x100 | data
+        self.switch_banks()
+
+    def write_rom_bank_high(self, address, data):
+        self.rom_bank = (data & 0x1) << 8 | self.rom_bank & 0xFF
+        self.switch_banks()
+
+    def write_ram_bank(self, address, data):
+        self.ram_bank = data & 0xF
+        self.switch_banks()
+
+
+# cartridge type (header byte 0x147) -> mapper and the arguments it takes
+MAPPERS = {
+    0x00: (ROMOnly, {}), 0x08: (ROMOnly, {}), 0x09: (ROMOnly, {}),
+    0x01: (MBC1, {}), 0x02: (MBC1, {}), 0x03: (MBC1, {}),
+    0x05: (MBC2, {}), 0x06: (MBC2, {}),
+    0x0F: (MBC3, {"has_rtc": True}), 0x10: (MBC3, {"has_rtc": True}),
+    0x11: (MBC3, {}), 0x12: (MBC3, {}), 0x13: (MBC3, {}),
+    0x19: (MBC5, {}), 0x1A: (MBC5, {}), 0x1B: (MBC5, {}), 0x1C: (MBC5, {}), 0x1D: (MBC5, {}), 0x1E: (MBC5, {}),
+}
+
+
+def create_mapper(memory):
+    if memory.cartridge is None:
+        return ROMOnly(memory)
+    cartridge_type = memory.cartridge.cartridge_type
+    if cartridge_type not in MAPPERS:
+        raise ValueError("Unsupported cartridge type 0x%02X" % cartridge_type)
+    mapper, arguments = MAPPERS[cartridge_type]
+    return mapper(memory, **arguments)
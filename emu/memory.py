@@ -1,35 +1,98 @@
+import numpy as np
+
+import emu.mbc
 import emu.rom
 import emu.registers
+import emu.scheduler
+from emu.scheduler import TIMER, LCD, INTERRUPT
+
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 144
+
+# shade 0 to 3, lightest to darkest
+COLOURS = np.array([[0xFF, 0xFF, 0xFF], [0xCC, 0xCC, 0xCC], [0x77, 0x77, 0x77], [0x00, 0x00, 0x00]], dtype=np.uint8)
+# the same shades as single values, for greyscale framebuffers
+GREYS = COLOURS[:, 0].copy()
+# ready made colour schemes, any array shaped like COLOURS or GREYS works
+COLOUR_SCHEMES = {
+    "grey": COLOURS,
+    "green": np.array([[0x9B, 0xBC, 0x0F], [0x8B, 0xAC, 0x0F], [0x30, 0x62, 0x30], [0x0F, 0x38, 0x0F]], dtype=np.uint8),
+}
+
+# bit of joypad_state each key owns, directions in the low nibble
+JOYPAD_KEYS = {"right": 0, "left": 1, "up": 2, "down": 3, "a": 4, "b": 5, "select": 6, "start": 7}
+
+PALETTE_SHIFTS = np.arange(4) * 2
+TILE_OFFSETS = np.arange(SCREEN_WIDTH // 8 + 1)
+
+TILE_COUNT = 384
+TILE_LINES = np.arange(8)
+# Which of the 384 tiles a tile number refers to in the 0x8000 (unsigned) and
+# 0x8800 (signed) tile data areas
+TILE_INDEX = np.stack([np.arange(0x100), 0x80 + (np.arange(0x100) ^ 0x80)])
+
+
+# The 8 colour numbers of a tile row for every row word (tile rows are two
+# bytes, low bitplane first, read as a little endian word), bit 7 being the
+# leftmost pixel
+def build_tile_rows():
+    words = np.arange(0x10000)[:, None]
+    bits = 7 - np.arange(8)
+    return ((((words >> (bits + 8)) & 1) << 1) | ((words >> bits) & 1)).astype(np.uint8)
+
+
+TILE_ROWS = build_tile_rows()
 
 
 class Memory:
     MEMORY_SIZE = 0x10000
     RAM_BANK_TOTAL_SIZE = 0x8000
 
-    def __init__(self, rom=None):
-        self.memory = [0x00] * Memory.MEMORY_SIZE
-        self.registers = emu.registers.Registers(pc=0x100, s=0xFF, p=0xFE, a=0x01, f=0xB0, b=0x00, c=0x13, d=0x00,
+    # screen is the array frames are drawn into, (144, 160, 3) for RGB
+    # colours or (144, 160) when colours holds one value per shade
+    def __init__(self, rom=None, screen=None, colours=COLOURS):
+        self.memory = bytearray(Memory.MEMORY_SIZE)
+        # rom is a path or an already loaded emu.rom.Cartridge
+        if rom is None or isinstance(rom, emu.rom.Cartridge):
+            self.cartridge = rom
+        else:
+            self.cartridge = emu.rom.load_cartridge(rom)
+        ram_size = self.cartridge.ram_size if self.cartridge is not None else 0
+        self.ram_banks = bytearray(max(ram_size, Memory.RAM_BANK_TOTAL_SIZE))
+        self.current_rom_bank = 1  # bank at 0x4000-0x7FFF, kept up to date by the mapper
+        self.bank0_hooks = []  # called when the mapper swaps the bank at 0x0000-0x3FFF
+        self.mapper = emu.mbc.create_mapper(self)
+        self.map_pages()
+        self.registers = emu.registers.Registers(pc=0x100, sp=0xFFFE, a=0x01, f=0xB0, b=0x00, c=0x13, d=0x00,
                                                  e=0xD8, h=0x01, l=0x4D)  # we want get_opcode to start at address 0
+        self.scheduler = emu.scheduler.Scheduler()
+        self.last_sync = 0  # cycle the timers and LCD were last brought up to
         self.timer_counter = 0
         self.divider_counter = 0
 
         self.interrupt_master = True
-
-        self.memory_banking = self.get_memory_bank_setting()  # 1 for mbc1, 2 for mbc2
-
-        self.rom_banking = 0
-        self.current_rom_bank = 1
-
-        self.ram_banks = [0x00] * Memory.RAM_BANK_TOTAL_SIZE
-        self.current_ram_bank = 0
-
-        self.cartridge_memory = (emu.rom.get_instructions(rom) if rom is not None else None)
-        self.enable_ram = False
-
-        self.screen_data = [[[0, 0, 0]] * 144 for _ in range(160)]
+        self.ime_pending = None  # cycle an EI ended on, IME comes on once the instruction after it has run
+
+        self.memory_array = np.frombuffer(self.memory, dtype=np.uint8)
+        self.memory_words = np.frombuffer(self.memory, dtype="<u2")
+        # decoded colour numbers of every tile, [x flip, tile, line, x]
+        self.tile_cache = np.zeros((2, TILE_COUNT, 8, 8), dtype=np.uint8)
+        self.dirty_tiles = set()
+        self.invalidate_hooks = []  # called by invalidate_caches for caches kept outside Memory
+        if screen is None:
+            screen = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH) + colours.shape[1:], dtype=np.uint8)
+        self.screen_data = screen
+        self.set_colours(colours)
+        self.background_line = np.zeros(SCREEN_WIDTH, dtype=np.uint8)
+        self.sprite_lines = None  # sprites on each scanline, rebuilt after OAM changes
+        self.sprite_height = 8  # sprite height sprite_lines was built for
         self.scanline_counter = 456
+        self.render_enabled = True  # frames nobody looks at can skip drawing
+        self.vblank_count = 0  # times the LCD has reached VBlank
+        self.vblank_hooks = []  # called with screen_data when the LCD finishes drawing the last line of a frame
 
-        self.joypad_state = 0
+        self.joypad_state = 0xFF  # active low, every button released
+        self.sound_writes = None  # (cycle, address, data) of sound register writes, a list while an APU listens
 
     #############################################################################
     #                                                                           #
@@ -37,44 +100,161 @@ class Memory:
     #                                                                           #
     #############################################################################
 
+    # The address space is split into 256 pages of 256 bytes. Pages that are
+    # plain RAM or ROM hold a memoryview onto self.memory and are indexed
+    # directly, the rest hold None and go through the matching handler. The
+    # cartridge mapper points the ROM and cartridge RAM pages at the active
+    # banks, see emu.mbc.
+
+    PAGE_SIZE = 0x100
+
+    def map_pages(self):
+        view = memoryview(self.memory)
+        pages = [view[page * Memory.PAGE_SIZE:(page + 1) * Memory.PAGE_SIZE] for page in range(0x100)]
+
+        self.read_pages = list(pages)
+        self.write_pages = list(pages)
+        self.read_handlers = [None] * 0x100
+        self.write_handlers = [None] * 0x100
+
+        self.map_handler(0x8000, 0x97FF, write=self.write_tile_data)
+        self.map_handler(0xFE00, 0xFEFF, write=self.write_oam)
+        self.map_handler(0xFF00, 0xFFFF, read=self.read_io, write=self.write_io)
+
+        # ECHO ram is the same memory as 0xC000-0xDDFF so it just shares the pages
+        for page in range(0xE0, 0xFE):
+            self.read_pages[page] = pages[page - 0x20]
+            self.write_pages[page] = pages[page - 0x20]
+        self.mapper.map()  # ROM, cartridge RAM and the mapper's registers
+
+    def map_handler(self, start, end, read=None, write=None):
+        for page in range(start >> 8, (end >> 8) + 1):
+            if read is not None:
+                self.read_pages[page] = None
+                self.read_handlers[page] = read
+            if write is not None:
+                self.write_pages[page] = None
+                self.write_handlers[page] = write
+
     def write(self, address, data):
-        if address < 0x8000:  # ROM
-            self.handle_banking(address, data)
-        elif 0xFE00 > address >= 0xE000:  # ECHO ram also writes to RAM
-            self.memory[address] = data
-            self.write(address - 0x2000, data)
-        elif 0xFEFF > address >= 0xFEA0:  # Restricted area
+        page = self.write_pages[address >> 8]
+        if page is None:
+            self.write_handlers[address >> 8](address, data)
+        else:
+            page[address & 0xFF] = data
+
+    def read(self, address):
+        page = self.read_pages[address >> 8]
+        if page is None:
+            return self.read_handlers[address >> 8](address)
+        return page[address & 0xFF]
+
+    # Copies a whole range in at most one slice per page. Banked ROM and RAM
+    # are plain pages onto the active bank, pages behind a handler go a byte
+    # at a time so reads of I/O still sync and writes still have their
+    # effects, except tile data and OAM which only need their caches told.
+
+    def read_block(self, address, length):
+        end = address + length
+        if address < 0 or end > Memory.MEMORY_SIZE:
+            raise ValueError("0x%X bytes from 0x%04X runs past the address space" % (length, address))
+        data = bytearray(length)
+        start = address
+        while address < end:
+            page = address >> 8
+            chunk_end = min(end, (page + 1) * Memory.PAGE_SIZE)
+            chunk = slice(address - start, chunk_end - start)
+            view = self.read_pages[page]
+            if view is not None:
+                data[chunk] = view[address & 0xFF:((chunk_end - 1) & 0xFF) + 1]
+            else:
+                data[chunk] = bytes(self.read(byte) for byte in range(address, chunk_end))
+            address = chunk_end
+        return bytes(data)
+
+    def write_block(self, address, data):
+        end = address + len(data)
+        if address < 0 or end > Memory.MEMORY_SIZE:
+            raise ValueError("0x%X bytes from 0x%04X runs past the address space" % (len(data), address))
+        data = memoryview(data).cast("B")
+        start = address
+        while address < end:
+            page = address >> 8
+            chunk_end = min(end, (page + 1) * Memory.PAGE_SIZE)
+            chunk = data[address - start:chunk_end - start]
+            view = self.write_pages[page]
+            handler = self.write_handlers[page]
+            if view is not None:
+                view[address & 0xFF:((chunk_end - 1) & 0xFF) + 1] = chunk
+            elif handler == self.write_tile_data:
+                self.memory[address:chunk_end] = chunk
+                self.dirty_tiles.update(range((address - 0x8000) >> 4, ((chunk_end - 1 - 0x8000) >> 4) + 1))
+            elif handler == self.write_oam:
+                oam_end = min(chunk_end, 0xFEA0)
+                if address < oam_end:
+                    self.memory[address:oam_end] = chunk[:oam_end - address]
+                    self.sprite_lines = None
+            else:
+                for offset, byte in enumerate(chunk):
+                    handler(address + offset, byte)
+            address = chunk_end
+
+    def write_tile_data(self, address, data):
+        self.memory[address] = data
+        self.dirty_tiles.add((address - 0x8000) >> 4)
+
+    def write_oam(self, address, data):
+        if address >= 0xFEA0:  # Restricted area
             return
-        elif address == Memory.TMC:
+        self.memory[address] = data
+        self.sprite_lines = None
+
+    def read_io(self, address):
+        if address == 0xFF00:
+            return self.get_joypad_state()
+        if address in Memory.SYNC_REGISTERS:
+            self.sync()
+        return self.memory[address]
+
+    def write_io(self, address, data):
+        if address in Memory.SYNC_REGISTERS:
+            self.sync()
+        if address == Memory.TMC:
             current_freq = self.get_clock_freq()
             self.memory[Memory.TMC] = data
             new_freq = self.get_clock_freq()
             if current_freq != new_freq:
                 self.set_clock_freq()
+            self.schedule_timer()
         elif address == 0xFF04:
             self.memory[0xFF04] = 0
-        elif 0xA000 <= address <= 0xC000:
-            if self.enable_ram != 0:
-                new_address = address - 0xA000
-                self.ram_banks[new_address + (self.current_ram_bank * 0x2000)] = data
+            self.divider_counter = 0
+        elif address == Memory.TIMA or address == Memory.TMA:
+            self.memory[address] = data
+            self.schedule_timer()
+        elif address == 0xFF40:
+            self.memory[0xFF40] = data
+            self.set_lcd_status()
+            self.schedule_lcd()
+        elif address == 0xFF41:
+            self.memory[0xFF41] = (data & 0x78) | (self.memory[0xFF41] & 0x07)  # mode and coincidence are read only
         elif address == 0xFF44:
             self.memory[0xFF44] = 0
+            self.schedule_lcd()
         elif address == 0xFF46:
             self.do_dma_transfer(data)
-        else:
+        elif 0xFF47 <= address <= 0xFF49:
             self.memory[address] = data
-
-    def read(self, address):
-        if 0x4000 <= address <= 0x7FFF:
-            new_address = address - 0x4000
-            return self.cartridge_memory[new_address + (self.current_rom_bank * 0x4000)]
-        elif 0xA000 <= address <= 0xBFFF:
-            new_address = address - 0xA000
-            return self.ram_banks[new_address + (self.current_ram_bank * 0x2000)]
-        elif 0xFF00 == address:
-            return self.get_joypad_state()
+            self.update_palette(address - 0xFF47)
+        elif 0xFF10 <= address < 0xFF40:
+            self.memory[address] = data
+            if self.sound_writes is not None:
+                self.sound_writes.append((self.scheduler.now, address, data))
+        elif address == 0xFF0F or address == 0xFFFF:
+            self.memory[address] = data
+            self.scheduler.schedule_in(INTERRUPT, 0)
         else:
-            return self.memory[address]
+            self.memory[address] = data
 
     def init(self):
         self.memory[0xFF05] = 0x00
@@ -108,6 +288,39 @@ class Memory:
         self.memory[0xFF4A] = 0x00
         self.memory[0xFF4B] = 0x00
         self.memory[0xFFFF] = 0x00
+        self.update_palettes()
+        self.schedule_timer()
+        self.schedule_lcd()
+
+    #############################################################################
+    #                                                                           #
+    #                           EVENT HANDLING CODE                             #
+    #                                                                           #
+    #############################################################################
+
+    # Timers and the LCD are only brought up to date when one of their events
+    # is due or when a register they own is read or written
+    SYNC_REGISTERS = frozenset((0xFF04, 0xFF05, 0xFF06, 0xFF07, 0xFF40, 0xFF41, 0xFF44, 0xFF45))
+
+    def sync(self):
+        elapsed = self.scheduler.now - self.last_sync
+        if elapsed > 0:
+            self.last_sync = self.scheduler.now
+            self.update_timers(elapsed)
+            self.update_graphics(elapsed)
+
+    def run_events(self):
+        self.sync()
+        self.schedule_timer()
+        self.schedule_lcd()
+        self.scheduler.cancel(INTERRUPT)
+        if self.ime_pending is not None:
+            if self.scheduler.now > self.ime_pending:
+                self.ime_pending = None
+                self.interrupt_master = True
+            else:
+                self.scheduler.schedule(INTERRUPT, self.ime_pending + 1)
+        return self.do_interrupts()
 
     #############################################################################
     #                                                                           #
@@ -120,41 +333,46 @@ class Memory:
     TMC = 0xFF07
 
     CLOCKSPEED = 4194304
+    CLOCK_PERIODS = (1024, 16, 64, 256)  # 4096, 262144, 65536 and 16384 Hz
 
     def update_timers(self, cycles):
         self.do_divider_register(cycles)
         if self.is_clock_enabled():
             self.timer_counter -= cycles
-            if self.timer_counter <= 0:
-                self.set_clock_freq()
-                if self.read(Memory.TIMA) == 255:
-                    self.write(Memory.TIMA, self.read(Memory.TMA))
+            while self.timer_counter <= 0:
+                self.timer_counter += self.get_clock_period()
+                if self.memory[Memory.TIMA] == 255:
+                    self.memory[Memory.TIMA] = self.memory[Memory.TMA]
                     self.request_interrupt(2)
                 else:
-                    self.write(Memory.TIMA, self.read(Memory.TIMA) + 1)
+                    self.memory[Memory.TIMA] += 1
 
     def do_divider_register(self, cycles):
         self.divider_counter += cycles
-        if self.divider_counter >= 255:
-            self.divider_counter = 0
-            self.memory[0xFF04] += 1
+        if self.divider_counter >= 256:
+            self.memory[0xFF04] = (self.memory[0xFF04] + (self.divider_counter >> 8)) & 0xFF
+            self.divider_counter &= 0xFF
 
     def is_clock_enabled(self):
-        return test_bit(self.read(Memory.TMC), 2)
+        return test_bit(self.memory[Memory.TMC], 2)
 
     def get_clock_freq(self):
-        return self.read(Memory.TMC) & 0x3
+        return self.memory[Memory.TMC] & 0x3
+
+    def get_clock_period(self):
+        return Memory.CLOCK_PERIODS[self.get_clock_freq()]
 
     def set_clock_freq(self):
-        freq = self.get_clock_freq()
-        if freq == 0:
-            self.timer_counter = 1024  # freq 4096
-        elif freq == 1:
-            self.timer_counter = 16  # freq 262144
-        elif freq == 2:
-            self.timer_counter = 64  # freq 65536
-        elif freq == 3:
-            self.timer_counter = 256  # freq 16382
+        self.timer_counter = self.get_clock_period()
+
+    # TIMA counts up once every period and the interrupt comes with the tick
+    # that takes it past 255
+    def schedule_timer(self):
+        if self.is_clock_enabled():
+            ticks = 0xFF - self.memory[Memory.TIMA]
+            self.scheduler.schedule_in(TIMER, self.timer_counter + ticks * self.get_clock_period())
+        else:
+            self.scheduler.cancel(TIMER)
 
     #############################################################################
     #                                                                           #
@@ -163,25 +381,42 @@ class Memory:
     #############################################################################
 
     def request_interrupt(self, _id):
-        req = self.read(0xFF0F)
-        req = bit_set(req, _id)
-        self.write(0xFF0F, req)
+        self.memory[0xFF0F] = bit_set(self.memory[0xFF0F], _id)
+        self.scheduler.schedule_in(INTERRUPT, 0)
 
+    # RETI turns IME on straight away
+    def enable_interrupts(self):
+        self.interrupt_master = True
+        self.scheduler.schedule_in(INTERRUPT, 0)
+
+    # EI only does once the instruction after it has run, so EI; HALT halts
+    # before an interrupt that is already pending gets serviced. The clock is
+    # still at the start of the 4 cycle EI here.
+    def enable_interrupts_delayed(self):
+        self.ime_pending = self.scheduler.now + 4
+        self.scheduler.schedule(INTERRUPT, self.ime_pending + 1)
+
+    def disable_interrupts(self):
+        self.interrupt_master = False
+        self.ime_pending = None
+
+    # Services the highest priority interrupt that is requested and enabled.
+    # Returns whether one was, a halted CPU has to wake up to run it.
     def do_interrupts(self):
         if self.interrupt_master:
-            req = self.read(0xFF0F)
-            enabled = self.read(0xFFFF)
+            req = self.memory[0xFF0F]
+            enabled = self.memory[0xFFFF]
             if req > 0:
                 for i in range(0, 5):
                     if test_bit(req, i):
                         if test_bit(enabled, i):
                             self.service_interrupt(i)
+                            return True
+        return False
 
     def service_interrupt(self, interrupt):
         self.interrupt_master = False
-        req = self.read(0xFF0F)
-        req = bit_reset(req, interrupt)
-        self.write(0xFF0F, req)
+        self.memory[0xFF0F] = bit_reset(self.memory[0xFF0F], interrupt)
 
         self.push_word_onto_stack(self.registers.pc)
 
@@ -191,88 +426,13 @@ class Memory:
             self.registers.pc = 0x48
         elif interrupt == 2:
             self.registers.pc = 0x50
+        elif interrupt == 3:
+            self.registers.pc = 0x58
         elif interrupt == 4:
             self.registers.pc = 0x60
 
     def push_word_onto_stack(self, pc):
-        ...
-
-    #############################################################################
-    #                                                                           #
-    #                        MEMORY BANK HANDLING CODE                          #
-    #                                                                           #
-    #############################################################################
-
-    def get_memory_bank_setting(self):
-        setting = self.read(0x147)
-        if setting == 1:
-            self.memory_banking = 1
-        elif setting == 2:
-            self.memory_banking = 1
-        elif setting == 3:
-            self.memory_banking = 1
-        elif setting == 5:
-            self.memory_banking = 2
-        elif setting == 6:
-            self.memory_banking = 2
-        else:
-            return 0
-
-    def handle_banking(self, address, data):
-        if address < 0x2000:
-            if self.memory_banking != 0:
-                self.do_ram_bank_enable(address, data)
-        elif 0x2000 <= address < 0x4000:
-            if self.memory_banking != 0:
-                self.do_change_lo_rom_bank(data)
-        elif 0x4000 <= address < 0x6000:
-            if self.memory_banking == 1:
-                if self.rom_banking:
-                    self.do_change_hi_rom_bank(data)
-                else:
-                    self.do_ram_bank_change(data)
-        elif 0x6000 <= address < 0x8000:
-            if self.memory_banking == 1:
-                self.do_change_rom_ram_mode(data)
-
-    def do_ram_bank_enable(self, address, data):
-        if self.memory_banking == 2:
-            if address & 0b10000 >= 1:
-                return
-        test_data = data & 0xF
-        if test_data == 0xA:
-            self.enable_ram = True
-        elif test_data == 0x0:
-            self.enable_ram = False
-
-    def do_change_lo_rom_bank(self, data):
-        if self.memory_banking == 2:
-            self.current_rom_bank = data & 0xF
-            if self.current_rom_bank == 0:
-                self.current_rom_bank += 1
-            return
-
-        lower5 = data & 31
-        self.current_rom_bank &= 224
-        self.current_rom_bank |= lower5
-        if self.current_rom_bank == 0:
-            self.current_rom_bank += 1
-
-    def do_change_hi_rom_bank(self, data):
-        self.current_rom_bank &= 31
-        data &= 224
-        self.current_rom_bank |= data
-        if self.current_rom_bank == 0:
-            self.current_rom_bank += 1
-
-    def do_ram_bank_change(self, data):
-        self.current_ram_bank = data & 0x3
-
-    def do_change_rom_ram_mode(self, data):
-        new_data = data & 0x1
-        self.rom_banking = not (new_data == 0)
-        if self.rom_banking:
-            self.current_ram_bank = 0
+        self.push_to_stack(pc)
 
     #############################################################################
     #                                                                           #
@@ -280,29 +440,45 @@ class Memory:
     #                                                                           #
     #############################################################################
 
-    def render_screen(self):
-        ...
-
     def update_graphics(self, cycles):
-        self.set_lcd_status()
-
-        if self.is_lcd_enabled():
-            self.scanline_counter -= cycles
-        else:
+        if not self.is_lcd_enabled():
+            self.set_lcd_status()
             return
 
-        if self.scanline_counter <= 0:
+        self.scanline_counter -= cycles
+        while self.scanline_counter <= 0:
+            if self.memory[0xFF44] < 144:
+                self.draw_scan_line()
             self.memory[0xFF44] += 1
-            current_line = self.read(0xFF44)
-            self.scanline_counter = 456
+            current_line = self.memory[0xFF44]
+            self.scanline_counter += 456
             if current_line == 144:
                 self.request_interrupt(0)
+                self.vblank_count += 1
+                if self.render_enabled:
+                    screen = self.screen_data
+                    for hook in self.vblank_hooks:
+                        hook(screen)
             elif current_line > 153:
                 self.memory[0xFF44] = 0
-            elif current_line < 144:
-                self.draw_scan_line()
+        self.set_lcd_status()
+
+    # Only HBlank starting and the end of the line can raise interrupts, the
+    # switch to mode 3 is picked up by the sync when STAT is read
+    def schedule_lcd(self):
+        if not self.is_lcd_enabled():
+            self.scheduler.cancel(LCD)
+            return
+        counter = self.scanline_counter
+        if self.memory[0xFF44] < 144 and counter >= Memory.MODE3_BOUNDS:
+            counter -= Memory.MODE3_BOUNDS - 1
+        self.scheduler.schedule_in(LCD, counter)
 
     def draw_scan_line(self):
+        if not self.render_enabled:
+            return
+        if self.dirty_tiles:
+            self.decode_tiles()
         control = self.read(0xFF40)
         if test_bit(control, 0):
             self.render_tiles()
@@ -310,183 +486,157 @@ class Memory:
             self.render_sprites()
 
     def render_tiles(self):
-        un_sig = True
-
-        scroll_y = self.read(0xFF42)
-        scroll_x = self.read(0xFF43)
-        window_y = self.read(0xFF4A)
-        window_x = self.read(0xFF4B) - 7
+        control = self.memory[0xFF40]
+        scanline = self.memory[0xFF44]
+
+        scroll_y = self.memory[0xFF42]
+        scroll_x = self.memory[0xFF43]
+        window_y = self.memory[0xFF4A]
+        window_x = self.memory[0xFF4B] - 7
+
+        background_memory = 0x9C00 if test_bit(control, 3) else 0x9800
+        colour_nums = self.tile_row_colours(control, background_memory, (scroll_y + scanline) & 0xFF,
+                                            scroll_x, SCREEN_WIDTH)
+
+        if test_bit(control, 5) and window_y <= scanline and window_x < SCREEN_WIDTH:
+            window_memory = 0x9C00 if test_bit(control, 6) else 0x9800
+            start = max(window_x, 0)
+            colour_nums[start:] = self.tile_row_colours(control, window_memory, scanline - window_y,
+                                                        start - window_x, SCREEN_WIDTH - start)
+
+        self.background_line = colour_nums
+        self.screen_data[scanline] = self.palette_colours[colour_nums]
+
+    # Decodes count pixels of one row of a tile map, starting at x_pos, a whole
+    # tile at a time
+    def tile_row_colours(self, control, map_address, y_pos, x_pos, count):
+        offset = x_pos & 7
+        tiles = ((x_pos >> 3) + TILE_OFFSETS[:(offset + count + 7) >> 3]) & 31
+        tile_nums = self.memory_array[map_address + (y_pos // 8) * 32 + tiles]
+
+        tiles = TILE_INDEX[0 if test_bit(control, 4) else 1, tile_nums]
+        colour_nums = self.tile_cache[0, tiles, y_pos % 8].ravel()
+        return colour_nums[offset:offset + count]
 
-        using_window = False
-
-        if test_bit(self.read(0xFF40), 5):
-            if window_y <= self.read(0xFF44):
-                using_window = True
+    #############################################################################
+    #                                                                           #
+    #                                TILE CACHE                                 #
+    #                                                                           #
+    #############################################################################
 
-        if test_bit(self.read(0xFF40), 4):
-            tile_data = 0x8000
-        else:
-            tile_data = 0x8800
-            un_sig = False
+    # Writes to tile data only mark the tile dirty, every dirty tile is decoded
+    # in one go before the next scanline that could use it is drawn
 
-        if using_window is False:
-            if test_bit(self.read(0xFF40), 3):
-                background_memory = 0x9C00
-            else:
-                background_memory = 0x9800
-        else:
-            if test_bit(self.read(0xFF40), 6):
-                background_memory = 0x9C00
-            else:
-                background_memory = 0x9800
+    def decode_tiles(self):
+        tiles = np.fromiter(self.dirty_tiles, dtype=np.intp, count=len(self.dirty_tiles))
+        self.dirty_tiles.clear()
 
-        if not using_window:
-            y_pos = scroll_y + self.read(0xFF44)
-        else:
-            y_pos = self.read(0xFF44) - window_y
+        rows = TILE_ROWS[self.memory_words[0x4000 + tiles[:, None] * 8 + TILE_LINES]]
+        self.tile_cache[0, tiles] = rows
+        self.tile_cache[1, tiles] = rows[:, :, ::-1]
 
-        tile_row = (y_pos // 8) * 32  # TODO might be wrong (change // to /)
+    def invalidate_tiles(self):
+        self.dirty_tiles.update(range(TILE_COUNT))
 
-        for pixel in range(160):
-            x_pos = pixel + scroll_x
-            if using_window:
-                if pixel >= window_x:
-                    x_pos = pixel - window_x
+    # everything decoded from memory, for when it gets replaced wholesale
+    def invalidate_caches(self):
+        self.invalidate_tiles()
+        self.sprite_lines = None
+        self.update_palettes()
+        for hook in self.invalidate_hooks:
+            hook()
 
-            tile_col = x_pos / 8
-            tile_address = background_memory + tile_row + tile_col
+    #############################################################################
+    #                                                                           #
+    #                               SPRITE INDEX                                #
+    #                                                                           #
+    #############################################################################
 
-            if un_sig:
-                tile_num = self.read(tile_address)
-            else:
-                tile_num = self.read(tile_address) - 128
+    # Which sprites each scanline shows only changes when OAM or the sprite
+    # height does, so it is worked out once for the whole screen then and
+    # rendering a line just walks its list
+
+    MAX_SPRITES_PER_LINE = 10
+
+    # Like the hardware, a line takes the first 10 sprites in OAM that cover
+    # it wherever they are on x, then they are ordered by priority: smaller x
+    # first, OAM order on a tie
+    def build_sprite_lines(self, y_size):
+        lines = [[] for _ in range(SCREEN_HEIGHT)]
+        oam = self.memory[0xFE00:0xFEA0]
+        for sprite in range(0, 0xA0, 4):
+            top = oam[sprite] - 16
+            x_pos = oam[sprite + 1]
+            tile_location = oam[sprite + 2]
+            attributes = oam[sprite + 3]
+            flip = 1 if test_bit(attributes, 5) else 0
+            palette = 1 if test_bit(attributes, 4) else 0
+            behind = test_bit(attributes, 7)
+            for scanline in range(max(top, 0), min(top + y_size, SCREEN_HEIGHT)):
+                if len(lines[scanline]) == Memory.MAX_SPRITES_PER_LINE:
+                    continue
+                line = scanline - top
+                if test_bit(attributes, 6):  # y flip
+                    line = y_size - 1 - line
+                tile = tile_location
+                if y_size == 16:
+                    # the bottom half of a tall sprite is the next tile
+                    tile = (tile_location & 0xFE) + (line >> 3)
+                    line &= 7
+                lines[scanline].append(((x_pos, sprite), (x_pos - 8, flip, tile, line, palette, behind)))
+        self.sprite_lines = [[sprite for _, sprite in sorted(line)] for line in lines]
+        self.sprite_height = y_size
+
+    # Only a handful of sprites share a line, too few for numpy to pay off, so
+    # they are decoded in Python and written to the scanline in one go
+    def render_sprites(self):
+        y_size = 16 if test_bit(self.memory[0xFF40], 2) else 8
+        if self.sprite_lines is None or self.sprite_height != y_size:
+            self.build_sprite_lines(y_size)
+        scanline = self.memory[0xFF44]
+        sprites = self.sprite_lines[scanline]
+        if not sprites:
+            return
 
-            tile_location = tile_data
+        background = None
+        # pixel -> index into palette_colours, None where the sprite that owns
+        # the pixel is hidden behind the background
+        owned = {}
+
+        # highest priority first, the first sprite with a colour on a pixel
+        # owns it even when it is hidden itself
+        for x_pos, flip, tile, line, palette, behind in sprites:
+            colour_nums = self.tile_cache[flip, tile, line].tolist()
+            first = 4 + palette * 4
+            # sprites with priority bit 7 are only drawn over background colour 0
+            if behind and background is None:
+                background = self.background_line.tolist()
+
+            for x_pix, colour_num in enumerate(colour_nums):
+                pixel = x_pos + x_pix
+                if colour_num == 0 or pixel in owned or pixel < 0 or pixel >= SCREEN_WIDTH:
+                    continue
+                if behind and background[pixel] != 0:
+                    owned[pixel] = None
+                else:
+                    owned[pixel] = first + colour_num
 
-            if un_sig:
-                tile_location += (tile_num * 16)
-            else:
-                tile_location += ((tile_num + 128) * 16)
-
-            line = y_pos % 8
-            line *= 2
-            data1 = self.read(tile_location + line)
-            data2 = self.read(tile_location + line + 1)
-
-            colour_bit = x_pos % 8
-            colour_bit -= 7
-            colour_bit *= -1
-
-            colour_num = bit_get_val(data2, colour_bit)
-            colour_num <<= 1
-            colour_num |= bit_get_val(data1, colour_bit)
-
-            col = self.get_colour(colour_num, 0xFF47)
-            red = 0
-            green = 0
-            blue = 0
-
-            if col == 0:
-                red = 255
-                green = 255
-                blue = 255
-            elif col == 1:
-                red = 0xCC
-                green = 0xCC
-                blue = 0xCC
-            elif col == 2:
-                red = 0x77
-                green = 0x77
-                blue = 0x77
-
-            scanline = self.read(0xFF44)
-
-            if scanline < 0 or scanline > 143 or pixel < 0 or pixel > 159:
-                continue
-
-            self.screen_data[pixel][scanline][0] = red
-            self.screen_data[pixel][scanline][1] = green
-            self.screen_data[pixel][scanline][2] = blue
+        pixels = [pixel for pixel, colour in owned.items() if colour is not None]
+        self.screen_data[scanline, pixels] = self.palette_colours[[owned[pixel] for pixel in pixels]]
 
-    def render_sprites(self):
-        use8x16 = False
-        if test_bit(self.read(0xFF40), 2):
-            use8x16 = True
-
-        for sprite in range(40):
-            index = sprite * 4
-            y_pos = self.read(0xFE00 + index) - 16
-            x_pos = self.read(0xFE00 + index + 1) - 8
-            tile_location = self.read(0xFE00 + index + 2)
-            attributes = self.read(0xFE00 + index + 3)
-
-            y_flip = test_bit(attributes, 6)
-            x_flip = test_bit(attributes, 5)
-
-            scanline = self.read(0xFF44)
-
-            y_size = 8
-            if use8x16:
-                y_size = 16
-
-            if y_pos <= scanline < (y_pos + y_size):
-                line = scanline - y_pos
-                if y_flip:
-                    line -= y_size
-                    line *= -1
-
-                line *= 2
-                data_address = (0x8000 + (tile_location * 16)) + line
-                data1 = self.read(data_address)
-                data2 = self.read(data_address + 1)
-                for tile_pixel in range(7, -1, -1):
-                    colour_bit = tile_pixel
-                    if x_flip:
-                        colour_bit -= 7
-                        colour_bit *= -1
-                    colour_num = bit_get_val(data2, colour_bit)
-                    colour_num <<= 1
-                    colour_num |= bit_get_val(data1, colour_bit)
-
-                    colour_address = (0xFF49 if test_bit(attributes, 4) else 0xFF48)
-                    col = self.get_colour(colour_num, colour_address)
-                    red = 0
-                    green = 0
-                    blue = 0
-
-                    if col == 0:
-                        continue
-                    elif col == 1:
-                        red = 0xCC
-                        green = 0xCC
-                        blue = 0xCC
-                    elif col == 2:
-                        red = 0x77
-                        green = 0x77
-                        blue = 0x77
-
-                    x_pix = 0 - tile_pixel
-                    x_pix += 7
-
-                    pixel = x_pos + x_pix
-
-                    if scanline < 0 or scanline > 143 or pixel < 0 or pixel > 159:
-                        continue
-
-                    self.screen_data[pixel][scanline][0] = red
-                    self.screen_data[pixel][scanline][1] = green
-                    self.screen_data[pixel][scanline][2] = blue
+    MODE2_BOUNDS = 456 - 80
+    MODE3_BOUNDS = MODE2_BOUNDS - 172
 
     def set_lcd_status(self):
-        status = self.read(0xFF41)
+        status = self.memory[0xFF41]
         if not self.is_lcd_enabled():
             self.scanline_counter = 456
             self.memory[0xFF44] = 0
             status &= 252
             status = bit_set(status, 0)
-            self.write(0xFF41, status)
+            self.memory[0xFF41] = status
             return
-        current_line = self.read(0xFF44)
+        current_line = self.memory[0xFF44]
         current_mode = status & 0b11
 
         mode = 0
@@ -499,17 +649,14 @@ class Memory:
             status = bit_reset(status, 1)
             req_int = test_bit(status, 4)
         else:
-            mode2bounds = 456 - 80
-            mode3bounds = mode2bounds - 172
-
             # mode 2
-            if self.scanline_counter >= mode2bounds:
+            if self.scanline_counter >= Memory.MODE2_BOUNDS:
                 mode = 2
                 status = bit_set(status, 1)
                 status = bit_reset(status, 0)
                 req_int = test_bit(status, 5)
             # mode 3
-            elif self.scanline_counter >= mode3bounds:
+            elif self.scanline_counter >= Memory.MODE3_BOUNDS:
                 mode = 3
                 status = bit_set(status, 1)
                 status = bit_set(status, 0)
@@ -520,28 +667,48 @@ class Memory:
                 status = bit_reset(status, 0)
                 req_int = test_bit(status, 3)
 
-        if req_int and (mode is not current_mode):
+        if req_int and (mode != current_mode):
             self.request_interrupt(1)
 
-        if current_line == self.read(0xFF45):
-            status = bit_set(status, 2)
-            if test_bit(status, 6):
+        # LY only gets compared on a sync, so the interrupt is raised when the
+        # line starts matching rather than on every look at it
+        if current_line == self.memory[0xFF45]:
+            if test_bit(status, 6) and not test_bit(status, 2):
                 self.request_interrupt(1)
+            status = bit_set(status, 2)
         else:
             status = bit_reset(status, 2)
-        self.write(0xFF41, status)
+        self.memory[0xFF41] = status
 
     def is_lcd_enabled(self):
-        return test_bit(self.read(0xFF40), 7)
+        return test_bit(self.memory[0xFF40], 7)
+
+    #############################################################################
+    #                                                                           #
+    #                                 PALETTES                                  #
+    #                                                                           #
+    #############################################################################
+
+    # palette_colours holds the final colour of colour numbers 0-3 under BGP
+    # then OBP0 then OBP1, so a scanline's colour numbers (plus 4 or 8 for a
+    # sprite palette) turn into pixels with a single index. The table is only
+    # rebuilt when one of the palette registers or the colour scheme changes.
+
+    def set_colours(self, colours):
+        if colours.shape[1:] != self.screen_data.shape[2:]:
+            raise ValueError("colours of shape %s can't be drawn into a screen of shape %s"
+                             % (colours.shape, self.screen_data.shape))
+        self.colours = colours
+        self.palette_colours = np.zeros((12,) + colours.shape[1:], dtype=np.uint8)
+        self.update_palettes()
 
-    def get_colour(self, colour_num, address):
-        palette = self.read(address)
-        hi = (colour_num * 2) + 1
-        lo = (colour_num * 2)
+    def update_palette(self, palette):
+        shades = (self.memory[0xFF47 + palette] >> PALETTE_SHIFTS) & 0x3
+        self.palette_colours[palette * 4:palette * 4 + 4] = self.colours[shades]
 
-        colour = bit_get_val(palette, hi) << 1
-        colour |= bit_get_val(palette, lo)
-        return colour
+    def update_palettes(self):
+        for palette in range(3):
+            self.update_palette(palette)
 
     #############################################################################
     #                                                                           #
@@ -550,9 +717,7 @@ class Memory:
     #############################################################################
 
     def do_dma_transfer(self, data):
-        address = data << 8
-        for i in range(0xA0):
-            self.write(0xFE00 + i, self.read(address + i))
+        self.write_block(0xFE00, self.read_block(data << 8, 0xA0))
 
     #############################################################################
     #                                                                           #
@@ -606,15 +771,19 @@ class Memory:
     #                                                                           #
     #############################################################################
 
+    # the stack grows down and words are stored little endian, so the high
+    # byte goes in first and ends up at the higher address
     def push_to_stack(self, address):
-        self.write(self.registers.sp, address % 256)
-        self.write(self.registers.sp - 1, address // 256)
-        self.registers.sp -= 2
+        sp = self.registers.sp
+        self.write((sp - 1) & 0xFFFF, address >> 8)
+        self.write((sp - 2) & 0xFFFF, address & 0xFF)
+        self.registers.sp = (sp - 2) & 0xFFFF
 
     def pop_from_stack(self):
-        big = self.read(self.registers.sp + 1)
-        small = self.read(self.registers.sp + 2)
-        self.registers.sp += 2
+        sp = self.registers.sp
+        small = self.read(sp)
+        big = self.read((sp + 1) & 0xFFFF)
+        self.registers.sp = (sp + 2) & 0xFFFF
         return (big << 8) | small
 
 #############################################################################
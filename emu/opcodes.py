@@ -0,0 +1,437 @@
+#############################################################################
+#                                                                           #
+#                          DECLARATIVE OPCODE SPEC                          #
+#                                                                           #
+#############################################################################
+
+# Every instruction is described the same way code_typing.py describes the
+# loads: (opcode, mnemonic, destination, source, cycles). Operands are
+# (kind, value) tuples, None when the instruction does not take one, and
+# conditional instructions list their cycles as (taken, not_taken).
+#
+# Operand kinds:
+#   register    8 bit register              ("register", "a")
+#   register16  16 bit register pair        ("register16", "bc")
+#   address     memory at a register pair   ("address", "hl"), "hl+", "hl-"
+#               or a 16 bit immediate       ("address", "nn")
+#   high        memory at 0xFF00 + n or c   ("high", "n"), ("high", "c")
+#   immediate   byte, word or signed byte   ("immediate", "8"), "16", "s8"
+#   condition   flag test for jumps         ("condition", "nz")
+#   bit         bit number for BIT/RES/SET  ("bit", 3)
+#   vector      RST target address          ("vector", 0x38)
+
+import re
+
+from emu.alu import SHIFT_OPERATIONS, TABLES
+from emu.registers import REGISTER_NUMBERS
+
+REGISTERS_8 = ["b", "c", "d", "e", "h", "l", "hl", "a"]
+ALU_MNEMONICS = ["ADD", "ADC", "SUB", "SBC", "AND", "XOR", "OR", "CP"]
+CB_MNEMONICS = ["RLC", "RRC", "RL", "RR", "SLA", "SRA", "SWAP", "SRL"]
+CONDITIONS = ["nz", "z", "nc", "c"]
+
+ILLEGAL_OPCODES = [0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD]
+
+
+def r8(name):
+    return ("address", "hl") if name == "hl" else ("register", name)
+
+
+def build_spec():
+    spec = [
+        (0x00, "NOP", None, None, 4),
+        (0x02, "LD", ("address", "bc"), ("register", "a"), 8),
+        (0x12, "LD", ("address", "de"), ("register", "a"), 8),
+        (0x22, "LD", ("address", "hl+"), ("register", "a"), 8),
+        (0x32, "LD", ("address", "hl-"), ("register", "a"), 8),
+        (0x0A, "LD", ("register", "a"), ("address", "bc"), 8),
+        (0x1A, "LD", ("register", "a"), ("address", "de"), 8),
+        (0x2A, "LD", ("register", "a"), ("address", "hl+"), 8),
+        (0x3A, "LD", ("register", "a"), ("address", "hl-"), 8),
+        (0x08, "LD", ("address", "nn"), ("register16", "sp"), 20),
+        (0xEA, "LD", ("address", "nn"), ("register", "a"), 16),
+        (0xFA, "LD", ("register", "a"), ("address", "nn"), 16),
+        (0xE0, "LD", ("high", "n"), ("register", "a"), 12),
+        (0xF0, "LD", ("register", "a"), ("high", "n"), 12),
+        (0xE2, "LD", ("high", "c"), ("register", "a"), 8),
+        (0xF2, "LD", ("register", "a"), ("high", "c"), 8),
+        (0xF9, "LD", ("register16", "sp"), ("register16", "hl"), 8),
+        (0xF8, "LDHL", ("register16", "hl"), ("immediate", "s8"), 12),
+        (0xE8, "ADD", ("register16", "sp"), ("immediate", "s8"), 16),
+        (0x07, "RLCA", None, None, 4),
+        (0x0F, "RRCA", None, None, 4),
+        (0x17, "RLA", None, None, 4),
+        (0x1F, "RRA", None, None, 4),
+        (0x27, "DAA", None, None, 4),
+        (0x2F, "CPL", None, None, 4),
+        (0x37, "SCF", None, None, 4),
+        (0x3F, "CCF", None, None, 4),
+        (0x10, "STOP", None, None, 4),
+        (0x76, "HALT", None, None, 4),
+        (0xF3, "DI", None, None, 4),
+        (0xFB, "EI", None, None, 4),
+        (0x18, "JR", None, ("immediate", "s8"), 12),
+        (0xC3, "JP", None, ("immediate", "16"), 16),
+        (0xE9, "JP", None, ("register16", "hl"), 4),
+        (0xCD, "CALL", None, ("immediate", "16"), 24),
+        (0xC9, "RET", None, None, 16),
+        (0xD9, "RETI", None, None, 16),
+        (0xCB, "PREFIX", None, None, 0),
+    ]
+
+    for i, pair in enumerate(["bc", "de", "hl", "sp"]):
+        spec.append((0x01 + i * 16, "LD", ("register16", pair), ("immediate", "16"), 12))
+        spec.append((0x03 + i * 16, "INC", ("register16", pair), None, 8))
+        spec.append((0x0B + i * 16, "DEC", ("register16", pair), None, 8))
+        spec.append((0x09 + i * 16, "ADD", ("register16", "hl"), ("register16", pair), 8))
+
+    for i, pair in enumerate(["bc", "de", "hl", "af"]):
+        spec.append((0xC1 + i * 16, "POP", ("register16", pair), None, 12))
+        spec.append((0xC5 + i * 16, "PUSH", None, ("register16", pair), 16))
+
+    for i, condition in enumerate(CONDITIONS):
+        spec.append((0x20 + i * 8, "JR", ("condition", condition), ("immediate", "s8"), (12, 8)))
+        spec.append((0xC2 + i * 8, "JP", ("condition", condition), ("immediate", "16"), (16, 12)))
+        spec.append((0xC4 + i * 8, "CALL", ("condition", condition), ("immediate", "16"), (24, 12)))
+        spec.append((0xC0 + i * 8, "RET", ("condition", condition), None, (20, 8)))
+
+    for i in range(8):
+        spec.append((0xC7 + i * 8, "RST", None, ("vector", i * 8), 16))
+        spec.append((0xC6 + i * 8, ALU_MNEMONICS[i], ("register", "a"), ("immediate", "8"), 8))
+
+    for i, name in enumerate(REGISTERS_8):
+        is_hl = name == "hl"
+        spec.append((0x04 + i * 8, "INC", r8(name), None, 12 if is_hl else 4))
+        spec.append((0x05 + i * 8, "DEC", r8(name), None, 12 if is_hl else 4))
+        spec.append((0x06 + i * 8, "LD", r8(name), ("immediate", "8"), 12 if is_hl else 8))
+
+    base = 0x40
+    for i in REGISTERS_8:
+        for j in REGISTERS_8:
+            if i == "hl" and j == "hl":
+                base += 1  # 0x76 is HALT
+                continue
+            spec.append((base, "LD", r8(i), r8(j), 8 if any([i == "hl", j == "hl"]) else 4))
+            base += 1
+
+    for i, mnemonic in enumerate(ALU_MNEMONICS):
+        for j, name in enumerate(REGISTERS_8):
+            spec.append((0x80 + i * 8 + j, mnemonic, ("register", "a"), r8(name), 8 if name == "hl" else 4))
+
+    return sorted(spec)
+
+
+def build_cb_spec():
+    spec = []
+    for opcode in range(0x100):
+        operand = r8(REGISTERS_8[opcode & 0x7])
+        is_hl = operand[0] == "address"
+        group = opcode >> 6
+        if group == 0:
+            spec.append((opcode, CB_MNEMONICS[opcode >> 3], operand, None, 16 if is_hl else 8))
+        else:
+            mnemonic = ["BIT", "RES", "SET"][group - 1]
+            spec.append((opcode, mnemonic, ("bit", (opcode >> 3) & 0x7), operand, (12 if mnemonic == "BIT" else 16) if is_hl else 8))
+    return spec
+
+
+INSTRUCTIONS = build_spec()
+CB_INSTRUCTIONS = build_cb_spec()
+
+
+def describe(entry):
+    opcode, mnemonic, destination, source, cycles = entry
+    operands = [format_operand(op) for op in (destination, source) if op is not None]
+    return mnemonic + (" " + ",".join(operands) if operands else "")
+
+
+def format_operand(operand):
+    kind, value = operand
+    if kind == "address":
+        return "(%s)" % value
+    elif kind == "high":
+        return "(0xff00+%s)" % value
+    elif kind == "vector":
+        return hex(value)
+    return str(value)
+
+
+# Bytes taken by the opcode and its operands, STOP and PREFIX eat one more
+def instruction_length(entry):
+    opcode, mnemonic, destination, source, cycles = entry
+    if mnemonic in ("STOP", "PREFIX"):
+        return 2
+    length = 1
+    for operand in (destination, source):
+        if operand in (("immediate", "8"), ("immediate", "s8"), ("high", "n")):
+            length += 1
+        elif operand in (("immediate", "16"), ("address", "nn")):
+            length += 2
+    return length
+
+
+#############################################################################
+#                                                                           #
+#                             CODE GENERATION                               #
+#                                                                           #
+#############################################################################
+
+# Like code_typing.py the spec is turned into Python source, but instead of
+# an elif chain every opcode becomes its own function so the CPU can index
+# straight into a 256 entry table.
+
+# 8 bit registers index the register file by number, pairs and pc/sp go
+# through the Registers attributes
+def reg_source(name):
+    if name in REGISTER_NUMBERS:
+        return "r[%d]" % REGISTER_NUMBERS[name]
+    return "reg." + name
+
+
+# Reading a pair is done inline, writing one goes through the setter
+def pair_source(name):
+    if name in ("af", "bc", "de", "hl"):
+        return "(%s << 8 | %s)" % (reg_source(name[0]), reg_source(name[1]))
+    return reg_source(name)
+
+
+def condition_source(condition):
+    test = "%s & %s" % (reg_source("f"), "0x80" if condition[-1] == "z" else "0x10")
+    return "not " + test if condition[0] == "n" else test
+
+
+# Returns (setup lines, read expression, write format) for an operand
+def location(operand):
+    kind, value = operand
+    if kind == "register":
+        return [], reg_source(value), reg_source(value) + " = {}"
+    elif kind == "register16":
+        return [], pair_source(value), reg_source(value) + " = {}"
+    elif kind == "immediate":
+        if value == "8":
+            return [], "cpu.get_n_byte()", None
+        elif value == "16":
+            return [], "cpu.get_nn_bytes()", None
+        return ["n = cpu.get_n_byte()"], "(n - ((n & 0x80) << 1))", None
+    elif kind == "address":
+        if value == "nn":
+            setup = ["addr = cpu.get_nn_bytes()"]
+        elif value in ("hl+", "hl-"):
+            step = "+ 1" if value == "hl+" else "- 1"
+            setup = ["addr = %s" % pair_source("hl"), "%s = (addr %s) & 0xFFFF" % (reg_source("hl"), step)]
+        else:
+            setup = ["addr = %s" % pair_source(value)]
+        return setup, "mem.read(addr)", "mem.write(addr, {})"
+    elif kind == "high":
+        if value == "n":
+            setup = ["addr = 0xFF00 | cpu.get_n_byte()"]
+        else:
+            setup = ["addr = 0xFF00 | %s" % reg_source("c")]
+        return setup, "mem.read(addr)", "mem.write(addr, {})"
+    raise ValueError("Unknown operand " + repr(operand))
+
+
+def generate_ld(destination, source):
+    src_setup, src, _ = location(source)
+    if destination == ("address", "nn") and source == ("register16", "sp"):
+        return ["addr = cpu.get_nn_bytes()",
+                "mem.write(addr, %s & 0xFF)" % src,
+                "mem.write((addr + 1) & 0xFFFF, %s >> 8)" % src]
+    dst_setup, _, dst = location(destination)
+    if src_setup and dst_setup:
+        return src_setup + ["val = " + src] + dst_setup + [dst.format("val")]
+    return src_setup + dst_setup + [dst.format(src)]
+
+
+# Returns (lines, expression, write format) with anything that isn't a
+# register read once into val, for operands used more than once
+def operand_value(operand):
+    setup, get, put = location(operand)
+    if get.startswith("r["):
+        return setup, get, put
+    return setup + ["val = " + get], "val", put
+
+
+# Flags come out of the tables in emu.alu, computed from the operands before
+# the result is stored
+def generate_alu(mnemonic, source):
+    a = reg_source("a")
+    f = reg_source("f")
+    lines, src, _ = operand_value(source)
+    if mnemonic in ("ADD", "ADC", "SUB", "SBC", "CP"):
+        table, sign = ("ADD_FLAGS", "+") if mnemonic in ("ADD", "ADC") else ("SUB_FLAGS", "-")
+        if mnemonic in ("ADC", "SBC"):
+            lines += ["carry = %s >> 4 & 1" % f,
+                      "%s = %s[carry << 16 | %s << 8 | %s]" % (f, table, a, src),
+                      "%s = (%s %s %s %s carry) & 0xFF" % (a, a, sign, src, sign)]
+        else:
+            lines.append("%s = %s[%s << 8 | %s]" % (f, table, a, src))
+            if mnemonic != "CP":
+                lines.append("%s = (%s %s %s) & 0xFF" % (a, a, sign, src))
+        return lines
+    operator = {"AND": "&", "OR": "|", "XOR": "^"}[mnemonic]
+    table = "AND_FLAGS" if mnemonic == "AND" else "ZERO_FLAGS"
+    return lines + ["%s %s= %s" % (a, operator, src), "%s = %s[%s]" % (f, table, a)]
+
+
+def generate_inc_dec(mnemonic, operand):
+    f = reg_source("f")
+    lines, value, put = operand_value(operand)
+    return lines + ["%s = %s & 0x10 | %s_FLAGS[%s]" % (f, f, mnemonic, value),
+                    put.format("(%s %s 1) & 0xFF" % (value, "+" if mnemonic == "INC" else "-"))]
+
+
+# CB rotates and shifts, and RLCA/RRCA/RLA/RRA which clear Z
+def generate_shift(mnemonic, operand, keep_zero=True):
+    f = reg_source("f")
+    lines, value, put = operand_value(operand)
+    index = "0x%03X | " % SHIFT_OPERATIONS[mnemonic]
+    if mnemonic in ("RL", "RR"):
+        index += "(%s & 0x10) << 4 | " % f
+    mask = "" if keep_zero else " & 0x10"
+    return lines + ["index = %s%s" % (index, value), "%s = SHIFT_FLAGS[index]%s" % (f, mask),
+                    put.format("SHIFT_RESULTS[index]")]
+
+
+def generate_read_modify_write(operand, expression):
+    setup, get, put = location(operand)
+    return setup + [put.format(expression.format(get))]
+
+
+# Source lines for an instruction that always falls through to the next pc
+def generate_straight(entry):
+    opcode, mnemonic, destination, source, cycles = entry
+    a = reg_source("a")
+    f = reg_source("f")
+
+    if mnemonic == "NOP":
+        return []
+    elif mnemonic == "LD":
+        return generate_ld(destination, source)
+    elif mnemonic in ALU_MNEMONICS and destination == ("register", "a"):
+        return generate_alu(mnemonic, source)
+    elif mnemonic in ("INC", "DEC") and destination[0] == "register16":
+        pair = destination[1]
+        return ["%s = (%s %s 1) & 0xFFFF" % (reg_source(pair), pair_source(pair), "+" if mnemonic == "INC" else "-")]
+    elif mnemonic in ("INC", "DEC"):
+        return generate_inc_dec(mnemonic, destination)
+    elif mnemonic == "ADD" and destination == ("register16", "hl"):
+        return ["cpu.add16bit(%s)" % pair_source(source[1])]
+    elif mnemonic in ("ADD", "LDHL"):
+        setup, src, _ = location(source)
+        return setup + ["%s = cpu.add_sp_signed(%s)" % (reg_source(destination[1]), src)]
+    elif mnemonic == "PUSH":
+        return ["mem.push_to_stack(%s)" % pair_source(source[1])]
+    elif mnemonic == "POP":
+        mask = " & 0xFFF0" if destination[1] == "af" else ""
+        return ["%s = mem.pop_from_stack()%s" % (reg_source(destination[1]), mask)]
+    elif mnemonic in ("RLCA", "RRCA", "RLA", "RRA"):
+        return generate_shift(mnemonic[:-1], ("register", "a"), keep_zero=False)
+    elif mnemonic == "DAA":
+        return ["index = (%s & 0x70) << 4 | %s" % (f, a), "%s = DAA_RESULTS[index]" % a,
+                "%s = DAA_FLAGS[index]" % f]
+    elif mnemonic == "CPL":
+        return ["%s ^= 0xFF" % a, "%s |= 0x60" % f]
+    elif mnemonic == "SCF":
+        return ["%s = (%s & 0x80) | 0x10" % (f, f)]
+    elif mnemonic == "CCF":
+        return ["%s = (%s & 0x90) ^ 0x10" % (f, f)]
+    elif mnemonic == "DI":
+        return ["mem.disable_interrupts()"]
+    elif mnemonic == "EI":
+        return ["mem.enable_interrupts_delayed()"]
+    elif mnemonic in CB_MNEMONICS:
+        return generate_shift(mnemonic, destination)
+    elif mnemonic == "BIT":
+        setup, get, _ = location(source)
+        return setup + ["%s = %s & 0x10 | BIT_FLAGS[0x%03X | %s]" % (f, f, destination[1] << 8, get)]
+    elif mnemonic == "RES":
+        return generate_read_modify_write(source, "{} & 0x%02X" % (~(1 << destination[1]) & 0xFF))
+    elif mnemonic == "SET":
+        return generate_read_modify_write(source, "{} | 0x%02X" % (1 << destination[1]))
+    return None
+
+
+# Source lines, including the returns, for instructions that may change pc
+def generate_branch(entry):
+    opcode, mnemonic, destination, source, cycles = entry
+    pc = reg_source("pc")
+    taken, not_taken = cycles if isinstance(cycles, tuple) else (cycles, cycles)
+
+    lines = []
+    if mnemonic == "RST":
+        lines.append("target = 0x%02X" % source[1])
+    elif source is not None:
+        setup, src, _ = location(source)
+        if mnemonic == "JR":
+            src = "(%s + %s) & 0xFFFF" % (pc, src)
+        lines += setup + ["target = " + src]
+
+    if mnemonic in ("CALL", "RST"):
+        jump = ["mem.push_to_stack(%s)" % pc, "%s = target" % pc]
+    elif mnemonic in ("RET", "RETI"):
+        jump = ["%s = mem.pop_from_stack()" % pc]
+        if mnemonic == "RETI":
+            jump.append("mem.enable_interrupts()")
+    elif mnemonic == "HALT":
+        jump = ["cpu.halted = True"]
+    elif mnemonic == "STOP":
+        jump = ["cpu.get_n_byte()", "cpu.halted = True"]
+    elif mnemonic == "PREFIX":
+        return ["return CB_OPCODES[cpu.get_n_byte()](cpu)"]
+    else:
+        jump = ["%s = target" % pc]
+
+    if destination is None or destination[0] != "condition":
+        return lines + jump + ["return %d" % taken]
+    return (lines + ["if %s:" % condition_source(destination[1])] +
+            ["    " + line for line in jump] + ["    return %d" % taken, "return %d" % not_taken])
+
+
+BRANCH_MNEMONICS = ["JR", "JP", "CALL", "RET", "RETI", "RST", "HALT", "STOP", "PREFIX"]
+
+
+def generate_function(name, entry):
+    mnemonic, cycles = entry[1], entry[4]
+    if mnemonic in BRANCH_MNEMONICS:
+        body = generate_branch(entry)
+    else:
+        body = generate_straight(entry)
+        if body is None:
+            raise ValueError("No code generator for " + describe(entry))
+        body = body + ["return %d" % cycles]
+
+    text = "\n".join(body)
+    lines = ["def %s(cpu):" % name, "    # " + describe(entry)]
+    if "reg." in text:
+        lines.append("    reg = cpu.REGISTERS")
+    if re.search(r"\br\[", text):
+        lines.append("    r = reg.r" if "reg." in text else "    r = cpu.REGISTERS.r")
+    if "mem." in text:
+        lines.append("    mem = cpu.MEMORY")
+    lines += ["    " + line for line in body]
+    return "\n".join(lines)
+
+
+def illegal_opcode(cpu):
+    raise ValueError("Unknown opcode")
+
+
+def build_tables():
+    namespace = dict(TABLES, CB_OPCODES=[illegal_opcode] * 0x100)
+    source = []
+    for prefix, spec in (("op", INSTRUCTIONS), ("cb", CB_INSTRUCTIONS)):
+        for entry in spec:
+            source.append(generate_function("%s_0x%02x" % (prefix, entry[0]), entry))
+    exec(compile("\n\n".join(source), "<opcodes>", "exec"), namespace)
+
+    opcodes = [illegal_opcode] * 0x100
+    for entry in INSTRUCTIONS:
+        opcodes[entry[0]] = namespace["op_0x%02x" % entry[0]]
+    cb_opcodes = namespace["CB_OPCODES"]
+    for entry in CB_INSTRUCTIONS:
+        cb_opcodes[entry[0]] = namespace["cb_0x%02x" % entry[0]]
+    return opcodes, cb_opcodes
+
+
+OPCODES, CB_OPCODES = build_tables()
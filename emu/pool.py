@@ -0,0 +1,93 @@
+import collections
+import hashlib
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import emu.cpu
+import emu.rom
+from emu.memory import JOYPAD_KEYS
+
+#############################################################################
+#                                                                           #
+#                           MULTI INSTANCE RUNNER                           #
+#                                                                           #
+#############################################################################
+
+# The ROM is copied once into a shared memory block and every worker builds
+# its Cartridge straight on top of that block, so however many instances run
+# there is one copy of the game on the host.
+
+# frames to run; inputs as (frame, key, pressed) with key a JOYPAD_KEYS name
+# or number, applied before that frame runs; captures as (frame, start, end)
+# address ranges read after that frame has run
+Job = collections.namedtuple("Job", ["frames", "inputs", "captures", "tag"], defaults=((), (), None))
+
+# state_hash is the SHA-1 of the final save state, captures are
+# (frame, start, bytes) in the order they were taken
+Result = collections.namedtuple("Result", ["index", "tag", "frames", "state_hash", "captures", "seconds"])
+
+_cartridge = None
+_shared_rom = None
+
+
+def init_worker(name, size):
+    global _cartridge, _shared_rom
+    _shared_rom = shared_memory.SharedMemory(name=name)
+    _cartridge = emu.rom.Cartridge(_shared_rom.buf[:size])
+
+
+def run_job(indexed_job):
+    index, job = indexed_job
+    start = time.perf_counter()
+    cpu = emu.cpu.CPU(_cartridge)
+    memory = cpu.MEMORY
+
+    inputs = collections.defaultdict(list)
+    for frame, key, pressed in job.inputs:
+        inputs[frame].append((JOYPAD_KEYS.get(key, key), pressed))
+    captures = collections.defaultdict(list)
+    for frame, first, end in job.captures:
+        captures[frame].append((first, end))
+
+    captured = []
+    for frame in range(job.frames):
+        for key, pressed in inputs.get(frame, ()):
+            if pressed:
+                memory.key_pressed(key)
+            else:
+                memory.key_released(key)
+        cpu.update(render=False)
+        for first, end in captures.get(frame, ()):
+            captured.append((frame, first, memory.read_block(first, end - first)))
+
+    state_hash = hashlib.sha1(cpu.save_state()).hexdigest()
+    return Result(index, job.tag, job.frames, state_hash, captured, time.perf_counter() - start)
+
+
+class Pool:
+    def __init__(self, rom, processes=None):
+        with open(rom, "rb") as file:
+            data = file.read()
+        self.shared_rom = shared_memory.SharedMemory(create=True, size=len(data))
+        self.shared_rom.buf[:len(data)] = data
+        self.pool = multiprocessing.Pool(processes or os.cpu_count(), initializer=init_worker,
+                                         initargs=(self.shared_rom.name, len(data)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Results stream back as soon as each job finishes, not in job order;
+    # Result.index says which job it was
+    def run(self, jobs):
+        return self.pool.imap_unordered(run_job, enumerate(jobs))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.shared_rom.close()
+        self.shared_rom.unlink()
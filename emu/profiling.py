@@ -0,0 +1,194 @@
+import json
+import time
+
+from emu.opcodes import INSTRUCTIONS, CB_INSTRUCTIONS, describe
+
+#############################################################################
+#                                                                           #
+#                                 PROFILER                                  #
+#                                                                           #
+#############################################################################
+
+# Profiling never costs anything while it is off because nothing checks for
+# it: start() shadows the methods it measures with counting versions on the
+# CPU and Memory instances and stop() deletes them again, leaving the class
+# methods in charge. Anything that keeps its own reference to a bound method
+# (a local in a hot loop, say) has to pick it up after start(). Block
+# translation is switched off while profiling so every opcode is counted.
+
+# 0x000-0x0FF are the normal opcodes, 0x100-0x1FF the CB ones
+OPCODE_NAMES = ["0x%02X ILLEGAL" % opcode for opcode in range(0x100)] + [None] * 0x100
+for entry in INSTRUCTIONS:
+    OPCODE_NAMES[entry[0]] = "0x%02X %s" % (entry[0], describe(entry))
+for entry in CB_INSTRUCTIONS:
+    OPCODE_NAMES[0x100 | entry[0]] = "0xCB%02X %s" % (entry[0], describe(entry))
+
+REGIONS = [
+    ("rom0", 0x0000, 0x3FFF),
+    ("romx", 0x4000, 0x7FFF),
+    ("vram", 0x8000, 0x9FFF),
+    ("extram", 0xA000, 0xBFFF),
+    ("wram", 0xC000, 0xDFFF),
+    ("echo", 0xE000, 0xFDFF),
+    ("oam", 0xFE00, 0xFE9F),
+    ("unusable", 0xFEA0, 0xFEFF),
+    ("io", 0xFF00, 0xFF7F),
+    ("hram", 0xFF80, 0xFFFE),
+    ("ie", 0xFFFF, 0xFFFF),
+]
+
+# Memory methods CPU.update spends its time in besides executing instructions
+SUBSYSTEMS = ["run_events", "sync", "update_timers", "update_graphics", "draw_scan_line", "do_interrupts"]
+
+
+class Profiler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.running = False
+        self.opcode_counts = [0] * 0x200
+        self.opcode_cycles = [0] * 0x200
+        self.opcode_time = [0.0] * 0x200
+        self.reads = [0] * 0x10000
+        self.writes = [0] * 0x10000
+        self.subsystem_time = {}  # method name -> seconds spent in it, callees excluded
+        self.stack_time = {}  # call path -> seconds spent in it, callees excluded
+        self.path = ()
+        self.child_time = [0.0]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self.running:
+            return
+        cpu = self.cpu
+        memory = cpu.MEMORY
+        cpu.update = self.timed("CPU.update", cpu.update)
+        cpu.execute_next_block = cpu.execute_next_opcode  # translated blocks would hide the opcodes
+        cpu.execute_opcode = self.profiled_execute_opcode(cpu.execute_opcode, memory.read)
+        memory.read = self.counted(memory.read, self.reads)
+        memory.write = self.counted(memory.write, self.writes)
+        for name in SUBSYSTEMS:
+            setattr(memory, name, self.timed("Memory." + name, getattr(memory, name)))
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        cpu = self.cpu
+        memory = cpu.MEMORY
+        for name in ("update", "execute_next_block", "execute_opcode"):
+            delattr(cpu, name)
+        for name in ["read", "write"] + SUBSYSTEMS:
+            delattr(memory, name)
+        self.running = False
+
+    #############################################################################
+    #                                                                           #
+    #                          INSTRUMENTED METHODS                             #
+    #                                                                           #
+    #############################################################################
+
+    def enter(self, path):
+        parent = self.path
+        self.path = path
+        self.child_time.append(0.0)
+        return parent
+
+    def leave(self, name, parent, elapsed):
+        exclusive = elapsed - self.child_time.pop()
+        self.child_time[-1] += elapsed
+        self.stack_time[self.path] = self.stack_time.get(self.path, 0.0) + exclusive
+        self.subsystem_time[name] = self.subsystem_time.get(name, 0.0) + exclusive
+        self.path = parent
+
+    def timed(self, name, function):
+        perf_counter = time.perf_counter
+
+        def profiled(*args, **kwargs):
+            parent = self.enter(self.path + (name,))
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave(name, parent, perf_counter() - start)
+
+        return profiled
+
+    def profiled_execute_opcode(self, execute_opcode, read):
+        perf_counter = time.perf_counter
+        registers = self.cpu.REGISTERS
+        counts = self.opcode_counts
+        cycles = self.opcode_cycles
+        seconds = self.opcode_time
+
+        def profiled(opcode):
+            key = opcode
+            if opcode == 0xCB:
+                key = 0x100 | read(registers.pc)
+            parent = self.enter(self.path + ("execute_opcode", OPCODE_NAMES[key]))
+            start = perf_counter()
+            try:
+                taken = execute_opcode(opcode)
+            finally:
+                elapsed = perf_counter() - start
+                self.leave("execute_opcode", parent, elapsed)
+            counts[key] += 1
+            cycles[key] += taken
+            seconds[key] += elapsed
+            return taken
+
+        return profiled
+
+    @staticmethod
+    def counted(access, counts):
+        def profiled(address, *data):
+            counts[address] += 1
+            return access(address, *data)
+
+        return profiled
+
+    #############################################################################
+    #                                                                           #
+    #                                 REPORTS                                   #
+    #                                                                           #
+    #############################################################################
+
+    def report(self):
+        opcodes = [{
+            "opcode": OPCODE_NAMES[key].split(" ", 1)[0],
+            "name": OPCODE_NAMES[key].split(" ", 1)[1],
+            "count": self.opcode_counts[key],
+            "cycles": self.opcode_cycles[key],
+            "seconds": self.opcode_time[key],
+        } for key in range(0x200) if self.opcode_counts[key]]
+        opcodes.sort(key=lambda opcode: opcode["count"], reverse=True)
+
+        return {
+            "instructions": sum(self.opcode_counts),
+            "cycles": sum(self.opcode_cycles),
+            "opcodes": opcodes,
+            "memory": {
+                "reads": {name: sum(self.reads[start:end + 1]) for name, start, end in REGIONS},
+                "writes": {name: sum(self.writes[start:end + 1]) for name, start, end in REGIONS},
+            },
+            "subsystems": dict(sorted(self.subsystem_time.items(), key=lambda item: item[1], reverse=True)),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+    # One "frame;frame;frame microseconds" line per call path, the collapsed
+    # stack format flamegraph.pl and speedscope read
+    def folded_stacks(self):
+        return "".join("%s %d\n" % (";".join(path), round(seconds * 1e6))
+                       for path, seconds in sorted(self.stack_time.items()) if seconds >= 0.5e-6)
+
+    def write_folded(self, path):
+        with open(path, "w") as file:
+            file.write(self.folded_stacks())
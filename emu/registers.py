@@ -1,4 +1,4 @@
-MAX_BYTE_VALUE = 2 ** 8
+import struct
 
 FLAG_Z = 7
 FLAG_N = 6
@@ -6,87 +6,134 @@ FLAG_H = 5
 FLAG_C = 4
 
 
+# 8 bit registers are numbered the way opcodes encode them, with F taking
+# slot 6 since (HL) is never a register
+B = 0
+C = 1
+D = 2
+E = 3
+H = 4
+L = 5
+F = 6
+A = 7
+
+REGISTER_NUMBERS = {"b": B, "c": C, "d": D, "e": E, "h": H, "l": L, "f": F, "a": A}
+
+STATE_FORMAT = struct.Struct("<8sHH")
+
+
 class Registers:
+    __slots__ = ("r", "sp", "pc")
 
-    def __init__(self, a=0, b=0, c=0, d=0, e=0, f=0, h=0, l=0, s=0, p=0, pc=0):
-        self.a = a
-        self.b = b
-        self.c = c
-        self.d = d
-        self.e = e
-        self.f = f
-        self.h = h
-        self.l = l
-        self.s = s
-        self.p = p
+    def __init__(self, a=0, b=0, c=0, d=0, e=0, f=0, h=0, l=0, sp=0, pc=0):
+        self.r = [b, c, d, e, h, l, f, a]
+        self.sp = sp
         self.pc = pc
 
+    def to_bytes(self):
+        return STATE_FORMAT.pack(bytes(self.r), self.sp, self.pc & 0xFFFF)
+
+    def from_bytes(self, data):
+        r, self.sp, self.pc = STATE_FORMAT.unpack(data)
+        self.r[:] = r
+
+    @property
+    def a(self):
+        return self.r[A]
+
+    @a.setter
+    def a(self, val):
+        self.r[A] = val
+
+    @property
+    def b(self):
+        return self.r[B]
+
+    @b.setter
+    def b(self, val):
+        self.r[B] = val
+
+    @property
+    def c(self):
+        return self.r[C]
+
+    @c.setter
+    def c(self, val):
+        self.r[C] = val
+
+    @property
+    def d(self):
+        return self.r[D]
+
+    @d.setter
+    def d(self, val):
+        self.r[D] = val
+
+    @property
+    def e(self):
+        return self.r[E]
+
+    @e.setter
+    def e(self, val):
+        self.r[E] = val
+
+    @property
+    def f(self):
+        return self.r[F]
+
+    @f.setter
+    def f(self, val):
+        self.r[F] = val
+
+    @property
+    def h(self):
+        return self.r[H]
+
+    @h.setter
+    def h(self, val):
+        self.r[H] = val
+
+    @property
+    def l(self):
+        return self.r[L]
+
+    @l.setter
+    def l(self, val):
+        self.r[L] = val
+
     @property
     def af(self):
-        return (self.a << 8) | self.f
+        return (self.r[A] << 8) | self.r[F]
 
+    # the low nibble of F doesn't exist, it always reads 0
     @af.setter
     def af(self, val):
-        self.a = val // MAX_BYTE_VALUE
-        self.f = val % MAX_BYTE_VALUE
+        self.r[A] = (val >> 8) & 0xFF
+        self.r[F] = val & 0xF0
 
     @property
     def bc(self):
-        return (self.b << 8) | self.c
+        return (self.r[B] << 8) | self.r[C]
 
     @bc.setter
     def bc(self, val):
-        self.b = val // MAX_BYTE_VALUE
-        self.c = val % MAX_BYTE_VALUE
+        self.r[B] = (val >> 8) & 0xFF
+        self.r[C] = val & 0xFF
 
     @property
     def de(self):
-        return (self.d << 8) | self.e
+        return (self.r[D] << 8) | self.r[E]
 
     @de.setter
     def de(self, val):
-        self.d = val // MAX_BYTE_VALUE
-        self.e = val % MAX_BYTE_VALUE
+        self.r[D] = (val >> 8) & 0xFF
+        self.r[E] = val & 0xFF
 
     @property
     def hl(self):
-        return (self.h << 8) | self.l
+        return (self.r[H] << 8) | self.r[L]
 
     @hl.setter
     def hl(self, val):
-        self.h = val // MAX_BYTE_VALUE
-        self.l = val % MAX_BYTE_VALUE
-
-    @property
-    def sp(self):
-        return (self.s << 8) | self.p
-
-    @sp.setter
-    def sp(self, val):
-        self.s = val // MAX_BYTE_VALUE
-        self.p = val % MAX_BYTE_VALUE
-
-
-if __name__ == "__main__":
-    reg = Registers()
-
-    print("Test 1: Checking getter for 8 and 16 bit registers")
-    reg.a = 0b11110000
-    reg.f = 0b00001111
-    print("A:", reg.a)
-    assert (reg.a == 240)
-    print("F:", reg.f)
-    assert (reg.f == 15)
-    print("AF:", reg.af)
-    assert (reg.af == 61455)
-
-    print()
-
-    print("Test 2: Checking setter for 16 bit registers")
-    reg.af = 0b1010101010101010
-    print("A:", reg.a)
-    assert (reg.a == 170)
-    print("F:", reg.f)
-    assert (reg.f == 170)
-    print("AF:", reg.af)
-    assert (reg.af == 43690)
+        self.r[H] = (val >> 8) & 0xFF
+        self.r[L] = val & 0xFF
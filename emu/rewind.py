@@ -0,0 +1,85 @@
+import collections
+import zlib
+
+import numpy as np
+
+#############################################################################
+#                                                                           #
+#                                  REWIND                                   #
+#                                                                           #
+#############################################################################
+
+# Only the newest snapshot is kept whole. Every older one is stored as the
+# zlib compressed XOR against the snapshot after it, which is nearly all
+# zeros since a frame only touches a few hundred bytes, so going back is
+# XORing the deltas onto the newest state one at a time. When the history
+# outgrows the memory limit the oldest deltas are dropped.
+
+
+def xor_bytes(a, b):
+    return (np.frombuffer(a, dtype=np.uint8) ^ np.frombuffer(b, dtype=np.uint8)).tobytes()
+
+
+class Rewind:
+    def __init__(self, cpu, interval=1, memory_limit=64 * 1024 * 1024, level=1):
+        self.cpu = cpu
+        self.interval = interval  # frames between snapshots
+        self.memory_limit = memory_limit
+        self.level = level  # zlib level for the deltas
+        self.latest = None
+        self.deltas = collections.deque()
+        self.bytes_used = 0
+        self.frames_since_snapshot = 0
+
+    def __len__(self):
+        return len(self.deltas) + (self.latest is not None)
+
+    def attach(self):
+        self.cpu.frame_hooks.append(self.on_frame)
+
+    def detach(self):
+        self.cpu.frame_hooks.remove(self.on_frame)
+
+    def on_frame(self):
+        self.frames_since_snapshot += 1
+        if self.frames_since_snapshot >= self.interval:
+            self.record()
+
+    def record(self):
+        state = self.cpu.save_state()
+        if self.latest is not None:
+            if len(state) != len(self.latest):
+                self.clear()
+            else:
+                delta = zlib.compress(xor_bytes(state, self.latest), self.level)
+                self.deltas.append(delta)
+                self.bytes_used += len(delta) - len(self.latest)
+        self.latest = state
+        self.bytes_used += len(state)
+        self.frames_since_snapshot = 0
+
+        while self.deltas and self.bytes_used > self.memory_limit:
+            self.bytes_used -= len(self.deltas.popleft())
+
+    # Going back from part way between snapshots lands on the newest one,
+    # each step after that goes one snapshot further back
+    def step_back(self, steps=1):
+        if self.latest is None or not (self.frames_since_snapshot or self.deltas):
+            return False
+        if self.frames_since_snapshot:
+            steps -= 1
+        steps = min(steps, len(self.deltas))
+        for _ in range(steps):
+            delta = self.deltas.pop()
+            self.bytes_used -= len(self.latest) + len(delta)
+            self.latest = xor_bytes(self.latest, zlib.decompress(delta))
+            self.bytes_used += len(self.latest)
+        self.cpu.load_state(self.latest)
+        self.frames_since_snapshot = 0
+        return True
+
+    def clear(self):
+        self.latest = None
+        self.deltas.clear()
+        self.bytes_used = 0
+        self.frames_since_snapshot = 0
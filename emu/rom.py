@@ -1,14 +1,52 @@
-def get_instructions(file_path) -> list:
-    with open(file_path, "rb") as file:
-        instruction_list = []
-        byte = file.read(1)
+import mmap
+import os
 
-        while byte:
-            instruction = hex(ord(byte))
-            instruction_list.append(instruction)
-            byte = file.read(1)
+BANK_SIZE = 0x4000
+MAX_ROM_BANKS = 512  # MBC5
+PAGE_SIZE = 0x100  # Memory.PAGE_SIZE
 
-        return instruction_list
+RAM_SIZES = {0x00: 0, 0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}
+
+
+class Cartridge:
+    # The ROM is never copied: every bank is a memoryview slice of whatever
+    # buffer it was loaded from, normally a read only mmap of the file, so the
+    # bytes live once in the page cache no matter how many emulators use them.
+    # bank_pages holds every bank already cut into the memory page table's
+    # pages, so switching bank is one slice assignment.
+
+    def __init__(self, data):
+        self.data = data
+        self.view = memoryview(data)
+
+        banks = [self.view[i:i + BANK_SIZE] for i in range(0, len(self.view), BANK_SIZE)]
+        pages = [[bank[i:i + PAGE_SIZE] for i in range(0, BANK_SIZE, PAGE_SIZE)] for bank in banks]
+        self.bank_count = len(banks)  # banks actually in the file
+        # bank numbers past the end of the ROM mirror the banks that exist
+        self.banks = [banks[i % len(banks)] for i in range(MAX_ROM_BANKS)]
+        self.bank_pages = [pages[i % len(pages)] for i in range(MAX_ROM_BANKS)]
+
+        header = self.banks[0]
+        self.title = bytes(header[0x134:0x144]).split(b"\0", 1)[0].decode("ascii", "replace")
+        self.cartridge_type = header[0x147]
+        self.rom_size = (0x8000 << header[0x148]) if header[0x148] <= 8 else len(self.view)
+        self.rom_banks = self.rom_size // BANK_SIZE
+        self.ram_size = RAM_SIZES.get(header[0x149], 0)
+
+
+_cartridges = {}
+
+
+def load_cartridge(file_path) -> Cartridge:
+    file_path = os.path.realpath(file_path)
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+
+    if key not in _cartridges:
+        with open(file_path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        _cartridges[key] = Cartridge(data)
+    return _cartridges[key]
 
 
 def get_DMGbootstrap() -> list:
@@ -0,0 +1,40 @@
+#############################################################################
+#                                                                           #
+#                              EVENT SCHEDULER                              #
+#                                                                           #
+#############################################################################
+
+# Everything outside the CPU core only needs looking at when something can
+# actually happen, so each subsystem books the cycle its next event falls on
+# and the CPU runs flat out until the earliest one.
+
+NEVER = float("inf")
+
+TIMER = 0  # next TIMA overflow
+LCD = 1  # next LCD mode change, LY increment or VBlank
+INTERRUPT = 2  # interrupt state changed, check as soon as the instruction ends
+FRAME = 3  # end of the current CPU.update
+
+EVENT_COUNT = 4
+
+
+class Scheduler:
+    __slots__ = ("now", "deadlines", "next_deadline")
+
+    def __init__(self):
+        self.now = 0
+        self.deadlines = [NEVER] * EVENT_COUNT
+        self.next_deadline = NEVER
+
+    def schedule(self, event, at):
+        self.deadlines[event] = at
+        self.next_deadline = min(self.deadlines)
+
+    def schedule_in(self, event, cycles):
+        self.schedule(event, self.now + cycles)
+
+    def cancel(self, event):
+        self.schedule(event, NEVER)
+
+    def is_due(self, event):
+        return self.deadlines[event] <= self.now
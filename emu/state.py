@@ -0,0 +1,86 @@
+import struct
+
+import emu.mbc
+from emu.registers import STATE_FORMAT
+from emu.scheduler import INTERRUPT
+
+#############################################################################
+#                                                                           #
+#                               SAVE STATES                                 #
+#                                                                           #
+#############################################################################
+
+# A save state is the header, the scalar machine state, the cartridge
+# mapper's registers, the CPU registers and then Memory.memory and the
+# cartridge RAM copied over whole. The ROM is not part of it, the cartridge
+# header is only there to refuse a state that was made with a different game.
+
+MAGIC = b"GBST"
+VERSION = 3
+
+HEADER = struct.Struct("<4sH")
+# cartridge header, clock, timer, divider and scanline counters, IME, EI still
+# waiting on the instruction after it, halted, joypad
+MACHINE = struct.Struct("<28sQiii???B")
+
+CARTRIDGE_HEADER = slice(0x134, 0x150)
+REGISTERS_OFFSET = HEADER.size + MACHINE.size + emu.mbc.STATE.size
+MEMORY_OFFSET = REGISTERS_OFFSET + STATE_FORMAT.size
+
+
+def cartridge_header(memory):
+    if memory.cartridge is None:
+        return bytes(CARTRIDGE_HEADER.stop - CARTRIDGE_HEADER.start)
+    return bytes(memory.cartridge.view[CARTRIDGE_HEADER])
+
+
+def save_state(cpu) -> bytes:
+    memory = cpu.MEMORY
+    memory.sync()  # so the counters are exact at the saved clock
+    machine = MACHINE.pack(cartridge_header(memory), memory.scheduler.now, memory.timer_counter,
+                           memory.divider_counter, memory.scanline_counter, memory.interrupt_master,
+                           memory.ime_pending is not None, cpu.halted, memory.joypad_state)
+    return b"".join((HEADER.pack(MAGIC, VERSION), machine, memory.mapper.save_state(), cpu.REGISTERS.to_bytes(),
+                     memory.memory, memory.ram_banks))
+
+
+def load_state(cpu, data):
+    memory = cpu.MEMORY
+    view = memoryview(data)
+
+    magic, version = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a save state")
+    if version != VERSION:
+        raise ValueError("Unsupported save state version %d" % version)
+    if len(view) != MEMORY_OFFSET + len(memory.memory) + len(memory.ram_banks):
+        raise ValueError("Save state is the wrong size")
+
+    (header, now, timer_counter, divider_counter, scanline_counter, interrupt_master, ime_pending, halted,
+     joypad_state) = MACHINE.unpack_from(view, HEADER.size)
+    if header != cartridge_header(memory):
+        raise ValueError("Save state is for a different cartridge")
+
+    cpu.REGISTERS.from_bytes(view[REGISTERS_OFFSET:MEMORY_OFFSET])
+    ram_offset = MEMORY_OFFSET + len(memory.memory)
+    # slice assignment keeps the same buffers, the page table points into them
+    memory.memory[:] = view[MEMORY_OFFSET:ram_offset]
+    memory.ram_banks[:] = view[ram_offset:]
+
+    memory.timer_counter = timer_counter
+    memory.divider_counter = divider_counter
+    memory.scanline_counter = scanline_counter
+    memory.interrupt_master = interrupt_master
+    # a state is only saved between updates, which end on a run_events, so
+    # an EI still waiting then has just finished
+    memory.ime_pending = now if ime_pending else None
+    cpu.halted = halted
+    memory.mapper.load_state(view[HEADER.size + MACHINE.size:REGISTERS_OFFSET])
+    memory.joypad_state = joypad_state
+
+    memory.scheduler.now = now
+    memory.last_sync = now
+    memory.schedule_timer()
+    memory.schedule_lcd()
+    memory.scheduler.schedule_in(INTERRUPT, 0)
+    memory.invalidate_caches()
@@ -0,0 +1,72 @@
+import numpy as np
+
+import emu.cpu
+import emu.rom
+from emu.memory import GREYS, SCREEN_HEIGHT, SCREEN_WIDTH
+
+#############################################################################
+#                                                                           #
+#                         VECTORISED ENVIRONMENTS                           #
+#                                                                           #
+#############################################################################
+
+# N emulators drawing straight into their own slice of one (N, 144, 160)
+# greyscale array, so step() hands back the same array every time and no
+# frame is ever copied. A frame is an LCD frame ending at VBlank, so each
+# observation is one whole drawn frame. Only the last of the K frames a step
+# runs is drawn.
+#
+# An action is a bitmask of the keys held down for the whole step, bit n
+# being the key numbered n in memory.JOYPAD_KEYS.
+
+
+class VecEnv:
+    def __init__(self, rom, num_envs, frames_per_step=4, noop_max=30, seed=None):
+        cartridge = rom if isinstance(rom, emu.rom.Cartridge) else emu.rom.load_cartridge(rom)
+        self.num_envs = num_envs
+        self.frames_per_step = frames_per_step
+        self.noop_max = noop_max  # reset runs up to this many idle frames so starts differ
+        self.observations = np.zeros((num_envs, SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
+        self.cpus = [emu.cpu.CPU(cartridge, self.observations[i], GREYS) for i in range(num_envs)]
+        self.held = [0] * num_envs
+        self.initial_state = self.cpus[0].save_state()
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.random = np.random.default_rng(seed)
+
+    def reset(self, indices=None):
+        if indices is None:
+            indices = range(self.num_envs)
+        for i in indices:
+            cpu = self.cpus[i]
+            cpu.load_state(self.initial_state)
+            self.held[i] = 0
+            for _ in range(int(self.random.integers(0, self.noop_max + 1))):
+                cpu.run_frame(render=False)
+            cpu.run_frame()
+        return self.observations
+
+    def step(self, actions):
+        last = self.frames_per_step - 1
+        for i, cpu in enumerate(self.cpus):
+            self.set_keys(i, int(actions[i]))
+            for frame in range(self.frames_per_step):
+                cpu.run_frame(frame == last)
+        return self.observations
+
+    def set_keys(self, i, keys):
+        changed = keys ^ self.held[i]
+        if not changed:
+            return
+        memory = self.cpus[i].MEMORY
+        for key in range(8):
+            if changed >> key & 1:
+                if keys >> key & 1:
+                    memory.key_pressed(key)
+                else:
+                    memory.key_released(key)
+        self.held[i] = keys
+
+    def close(self):
+        self.cpus = []
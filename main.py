@@ -1,18 +1,6 @@
-from emu.rom import *
-# from emu.memory import *
-# from emu.cpu import *
-from emu.registers import *
-from emu import *
+import sys
 
-if __name__ == "__main__":
-    # Quick CPU memory test
-    # cpu = CPU()
-    # print(cpu.memory[0:4])
-    # print(cpu.get_opcode())
-    # print(cpu.get_opcode())
-    # print(cpu.get_opcode())
-    # print(cpu.get_opcode())
-
-    # print(len(set(get_DMGbootstrap())))
+from emu.__main__ import main
 
-    REG = Registers()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import emu.rom  # noqa: E402
+
+TETRIS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "roms", "Tetris (World).gb")
+
+
+# A cartridge with program at 0x100 and code at any other ROM address,
+# e.g. build_cartridge(program, {0x40: handler})
+def build_cartridge(program=b"", code=None, cartridge_type=0x00, banks=2, ram_size=0x00):
+    data = bytearray(banks * emu.rom.BANK_SIZE)
+    data[0x100:0x100 + len(program)] = program
+    for address, chunk in (code or {}).items():
+        data[address:address + len(chunk)] = chunk
+    data[0x134:0x13C] = b"TESTROM\0"
+    data[0x147] = cartridge_type
+    data[0x148] = max(banks.bit_length() - 2, 0)
+    data[0x149] = ram_size
+    return emu.rom.Cartridge(bytes(data))
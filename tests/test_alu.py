@@ -0,0 +1,262 @@
+import random
+
+import pytest
+
+import emu.cpu
+from emu.alu import (ADD_FLAGS, SUB_FLAGS, AND_FLAGS, ZERO_FLAGS, INC_FLAGS, DEC_FLAGS, SHIFT_RESULTS, SHIFT_FLAGS,
+                     BIT_FLAGS, DAA_RESULTS, DAA_FLAGS, SHIFT_OPERATIONS)
+from emu.opcodes import OPCODES, CB_OPCODES, CB_MNEMONICS
+from emu.registers import A, B, F
+
+# A plain ALU to hold the tables against, one instruction at a time with the
+# flags worked out bit by bit
+
+
+def flags(z=False, n=False, h=False, c=False):
+    return (0x80 if z else 0) | (0x40 if n else 0) | (0x20 if h else 0) | (0x10 if c else 0)
+
+
+def reference_add(a, operand, carry):
+    result = (a + operand + carry) & 0xFF
+    return result, flags(result == 0, False, (a & 0xF) + (operand & 0xF) + carry > 0xF, a + operand + carry > 0xFF)
+
+
+def reference_sub(a, operand, carry):
+    result = (a - operand - carry) & 0xFF
+    return result, flags(result == 0, True, (a & 0xF) < (operand & 0xF) + carry, a < operand + carry)
+
+
+def reference_shift(mnemonic, value, carry):
+    bits = [value >> i & 1 for i in range(8)]  # bit 0 first
+    if mnemonic == "RLC":
+        out, bits = bits[7], [bits[7]] + bits[:7]
+    elif mnemonic == "RRC":
+        out, bits = bits[0], bits[1:] + [bits[0]]
+    elif mnemonic == "RL":
+        out, bits = bits[7], [carry] + bits[:7]
+    elif mnemonic == "RR":
+        out, bits = bits[0], bits[1:] + [carry]
+    elif mnemonic == "SLA":
+        out, bits = bits[7], [0] + bits[:7]
+    elif mnemonic == "SRA":
+        out, bits = bits[0], bits[1:] + [bits[7]]
+    elif mnemonic == "SRL":
+        out, bits = bits[0], bits[1:] + [0]
+    else:  # SWAP
+        out, bits = 0, bits[4:] + bits[:4]
+    result = sum(bit << i for i, bit in enumerate(bits))
+    return result, flags(result == 0, c=out)
+
+
+# the correction a BCD add or subtract needs, as hardware applies it
+def reference_daa(a, f):
+    n, h, c = f & 0x40, f & 0x20, f & 0x10
+    if n:
+        if h:
+            a = (a - 0x06) & 0xFF
+        if c:
+            a -= 0x60
+    else:
+        if h or a & 0x0F > 0x09:
+            a += 0x06
+        if c or a > 0x9F:
+            a += 0x60
+    c = c or a & 0x100
+    a &= 0xFF
+    return a, flags(a == 0, n, False, c)
+
+
+INPUTS = [(carry, a, operand) for carry in range(2) for a in range(0x100) for operand in range(0x100)]
+
+
+def test_add_and_sub_tables():
+    for carry, a, operand in INPUTS:
+        index = carry << 16 | a << 8 | operand
+        assert ADD_FLAGS[index] == reference_add(a, operand, carry)[1], (carry, a, operand)
+        assert SUB_FLAGS[index] == reference_sub(a, operand, carry)[1], (carry, a, operand)
+
+
+def test_logic_inc_and_dec_tables():
+    for value in range(0x100):
+        assert ZERO_FLAGS[value] == flags(value == 0)
+        assert AND_FLAGS[value] == flags(value == 0, h=True)
+        assert INC_FLAGS[value] == flags((value + 1) & 0xFF == 0, False, value & 0xF == 0xF)
+        assert DEC_FLAGS[value] == flags((value - 1) & 0xFF == 0, True, value & 0xF == 0)
+
+
+def test_shift_tables():
+    for mnemonic in CB_MNEMONICS:
+        for carry in range(2):
+            for value in range(0x100):
+                index = SHIFT_OPERATIONS[mnemonic] | carry << 8 | value
+                assert (SHIFT_RESULTS[index], SHIFT_FLAGS[index]) == reference_shift(mnemonic, value, carry), \
+                    (mnemonic, carry, value)
+
+
+def test_bit_table():
+    for bit in range(8):
+        for value in range(0x100):
+            assert BIT_FLAGS[bit << 8 | value] == flags(not value >> bit & 1, h=True)
+
+
+def test_daa_table():
+    for f in range(0, 0x100, 0x10):
+        for a in range(0x100):
+            index = (f & 0x70) << 4 | a
+            assert (DAA_RESULTS[index], DAA_FLAGS[index]) == reference_daa(a, f), (hex(f), hex(a))
+
+
+def test_daa_corrects_bcd_sums_and_differences():
+    for x in range(100):
+        for y in range(100):
+            bx, by = x // 10 << 4 | x % 10, y // 10 << 4 | y % 10
+            total, f = reference_add(bx, by, 0)
+            index = (f & 0x70) << 4 | total
+            assert DAA_RESULTS[index] == (x + y) % 100 // 10 << 4 | (x + y) % 10
+            assert bool(DAA_FLAGS[index] & 0x10) == (x + y > 99)
+            difference, f = reference_sub(bx, by, 0)
+            index = (f & 0x70) << 4 | difference
+            assert DAA_RESULTS[index] == (x - y) % 100 // 10 << 4 | (x - y) % 10
+
+
+# The generated opcodes and the CPU helpers, run against the same reference
+
+ALU_REFERENCES = [("ADD", reference_add, False), ("ADC", reference_add, True), ("SUB", reference_sub, False),
+                  ("SBC", reference_sub, True)]
+
+
+@pytest.mark.parametrize("group", range(8), ids=["ADD", "ADC", "SUB", "SBC", "AND", "XOR", "OR", "CP"])
+def test_alu_opcodes(group):
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    execute = OPCODES[0x80 | group << 3]  # with B as the operand
+    for carry, a, operand in INPUTS[::3]:
+        r[A], r[B], r[F] = a, operand, carry << 4
+        execute(cpu)
+        if group < 4:
+            expected = ALU_REFERENCES[group][1](a, operand, carry if ALU_REFERENCES[group][2] else 0)
+        elif group == 7:
+            expected = (a, reference_sub(a, operand, 0)[1])
+        else:
+            result = [a & operand, a ^ operand, a | operand][group - 4]
+            expected = (result, flags(result == 0, h=group == 4))
+        assert (r[A], r[F]) == expected, (group, carry, a, operand)
+
+
+def test_cb_opcodes():
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    for opcode in range(0x100):
+        if opcode & 7 == 6:
+            continue  # (HL), the same code as the registers around a read and a write
+        register = opcode & 7
+        bit = opcode >> 3 & 7
+        for carry in range(2):
+            for value in range(0x100):
+                r[register], r[F] = value, carry << 4 | 0x40
+                CB_OPCODES[opcode](cpu)
+                if opcode < 0x40:
+                    expected = reference_shift(CB_MNEMONICS[opcode >> 3], value, carry)
+                elif opcode < 0x80:
+                    expected = (value, flags(not value >> bit & 1, False, True, carry))
+                elif opcode < 0xC0:
+                    expected = (value & ~(1 << bit) & 0xFF, carry << 4 | 0x40)
+                else:
+                    expected = (value | 1 << bit, carry << 4 | 0x40)
+                assert (r[register], r[F]) == expected, (hex(opcode), carry, value)
+
+
+def test_cb_opcodes_on_hl():
+    cpu = emu.cpu.CPU()
+    cpu.REGISTERS.hl = 0xC000
+    r = cpu.REGISTERS.r
+    for opcode in range(6, 0x100, 8):
+        for value in range(0x100):
+            cpu.MEMORY.memory[0xC000] = value
+            r[F] = 0x10
+            CB_OPCODES[opcode](cpu)
+            r[F], flags_hl = 0x10, r[F]
+            r[A] = value
+            CB_OPCODES[opcode + 1](cpu)
+            assert (cpu.MEMORY.memory[0xC000], flags_hl) == (r[A], r[F]), (hex(opcode), value)
+
+
+def test_rotates_on_a_clear_zero():
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    for opcode, mnemonic in ((0x07, "RLC"), (0x0F, "RRC"), (0x17, "RL"), (0x1F, "RR")):
+        for carry in range(2):
+            for value in range(0x100):
+                r[A], r[F] = value, carry << 4 | 0x80
+                OPCODES[opcode](cpu)
+                result, f = reference_shift(mnemonic, value, carry)
+                assert (r[A], r[F]) == (result, f & 0x10)
+
+
+def test_daa_opcode():
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    for f in range(0, 0x100, 0x10):
+        for a in range(0x100):
+            r[A], r[F] = a, f
+            OPCODES[0x27](cpu)
+            assert (r[A], r[F]) == reference_daa(a, f)
+
+
+def test_inc_and_dec_keep_carry():
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    for carry in (0x00, 0x10):
+        for value in range(0x100):
+            r[B], r[F] = value, carry
+            OPCODES[0x04](cpu)  # INC B
+            assert (r[B], r[F]) == ((value + 1) & 0xFF, INC_FLAGS[value] | carry)
+            r[B], r[F] = value, carry
+            OPCODES[0x05](cpu)  # DEC B
+            assert (r[B], r[F]) == ((value - 1) & 0xFF, DEC_FLAGS[value] | carry)
+
+
+def test_cpu_helpers():
+    cpu = emu.cpu.CPU()
+    r = cpu.REGISTERS.r
+    for carry, a, operand in INPUTS[::5]:
+        r[A], r[F] = a, carry << 4
+        cpu.add8bit(A, operand, False, True)
+        assert (r[A], r[F]) == reference_add(a, operand, carry)
+        r[A], r[F] = a, carry << 4
+        cpu.sub8bit(A, operand, False, True)
+        assert (r[A], r[F]) == reference_sub(a, operand, carry)
+        r[A] = a
+        cpu.cp8bit(A, operand, False)
+        assert (r[A], r[F]) == (a, reference_sub(a, operand, 0)[1])
+    for mnemonic in CB_MNEMONICS:
+        helper = getattr(cpu, mnemonic.lower() + "8bit")
+        for carry in range(2):
+            for value in range(0x100):
+                r[F] = carry << 4
+                result = helper(value)
+                assert (result, r[F]) == reference_shift(mnemonic, value, carry)
+
+
+# ADD HL,rr and ADD SP,e / LD HL,SP+e take their flags from bits 11 and 15,
+# and from bits 3 and 7 of the unsigned low byte
+def test_16_bit_adds():
+    cpu = emu.cpu.CPU()
+    registers = cpu.REGISTERS
+    rng = random.Random(0)
+    values = [0x0000, 0x0001, 0x00FF, 0x0FFF, 0x1000, 0x7FFF, 0x8000, 0xFFFF] + [rng.randrange(0x10000)
+                                                                                    for _ in range(200)]
+    for hl in values:
+        for operand in values:
+            for f in (0x00, 0xF0):
+                registers.hl, registers.r[F] = hl, f
+                cpu.add16bit(operand)
+                expected = (f & 0x80) | flags(False, False, (hl & 0xFFF) + (operand & 0xFFF) > 0xFFF,
+                                              hl + operand > 0xFFFF)
+                assert (registers.hl, registers.r[F]) == ((hl + operand) & 0xFFFF, expected)
+    for sp in values:
+        for offset in range(-128, 128):
+            registers.sp, registers.r[F] = sp, 0xF0
+            assert cpu.add_sp_signed(offset) == (sp + offset) & 0xFFFF
+            assert registers.r[F] == flags(False, False, (sp & 0xF) + (offset & 0xF) > 0xF,
+                                           (sp & 0xFF) + (offset & 0xFF) > 0xFF)
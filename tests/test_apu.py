@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import emu.apu
+import emu.cpu
+from conftest import build_cartridge
+
+
+def playing_wave_channel(volume_code):
+    channel = emu.apu.WaveChannel()
+    for index in range(16):
+        channel.write_sample(index, 0xF0)  # alternating 15 and 0
+    channel.write(0, 0x80)  # DAC on
+    channel.write(2, volume_code << 5)
+    channel.write(3, 0x00)
+    channel.write(4, 0x87)  # frequency 0x700, trigger
+    return channel
+
+
+@pytest.mark.parametrize("volume_code, peak", [(1, 15.0), (2, 7.5), (3, 3.75)])
+def test_wave_volume_codes(volume_code, peak):
+    samples = playing_wave_channel(volume_code).render(4800, 48000)
+    assert np.abs(samples).max() == pytest.approx(peak)
+
+
+def test_wave_volume_code_0_is_silent():
+    assert playing_wave_channel(0).render(4800, 48000) is None
+
+
+def test_square_full_volume_matches_wave():
+    channel = emu.apu.SquareChannel()
+    channel.write(1, 0x80)  # 50% duty
+    channel.write(2, 0xF0)  # volume 15
+    channel.write(4, 0x87)
+    assert np.abs(channel.render(4800, 48000)).max() == np.abs(playing_wave_channel(1).render(4800, 48000)).max()
+
+
+def test_apu_renders_a_frame_of_samples():
+    cpu = emu.cpu.CPU(build_cartridge(bytes([0x18, 0xFE])))  # JR -2
+    apu = emu.apu.APU(cpu)
+    apu.attach()
+    for _ in range(10):
+        cpu.update(False)
+    samples = apu.pull()
+    assert samples.dtype == np.int16 and samples.shape[1] == 2
+    assert abs(len(samples) - cpu.SCHEDULER.now * 48000 // emu.cpu.MAX_CYCLES_PER_SECOND) <= 1
+    apu.detach()
@@ -0,0 +1,117 @@
+import random
+
+import pytest
+
+import emu.cpu
+import emu.registers
+from conftest import build_cartridge
+from emu.opcodes import BRANCH_MNEMONICS, INSTRUCTIONS, instruction_length
+
+STRAIGHT = [entry for entry in INSTRUCTIONS if (entry[1] not in BRANCH_MNEMONICS or entry[1] == "PREFIX")
+            and entry[1] != "EI"]
+BRANCHES = [entry for entry in INSTRUCTIONS if entry[1] in BRANCH_MNEMONICS and entry[1] != "PREFIX"]
+
+
+def emit(rng, entry):
+    return [entry[0]] + [rng.randrange(0x100) for _ in range(instruction_length(entry) - 1)]
+
+
+# A few straight-line instructions and a branch at 0xC000, on top of random
+# work RAM and registers
+def random_machine(seed):
+    rng = random.Random(seed)
+    code = []
+    for _ in range(rng.randrange(0, 8)):
+        code += emit(rng, rng.choice(STRAIGHT))
+    code += emit(rng, rng.choice(BRANCHES))
+
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    memory.memory[0xC000:0xE000] = bytes(rng.randrange(0x100) for _ in range(0x2000))
+    memory.memory[0xC000:0xC000 + len(code)] = bytes(code)
+    registers = cpu.REGISTERS
+    registers.r[:] = [rng.randrange(0x100) for _ in range(8)]
+    registers.r[emu.registers.F] &= 0xF0
+    registers.sp = 0xDFF0
+    registers.pc = 0xC000
+    memory.interrupt_master = rng.random() < 0.5
+    return cpu
+
+
+def machine_state(cpu):
+    return (cpu.REGISTERS.to_bytes(), bytes(cpu.MEMORY.memory), cpu.SCHEDULER.now, cpu.MEMORY.interrupt_master,
+            cpu.MEMORY.ime_pending, cpu.halted)
+
+
+@pytest.mark.parametrize("first_seed", range(0, 300, 50))
+def test_blocks_match_the_interpreter(first_seed):
+    compared = 0
+    for seed in range(first_seed, first_seed + 50):
+        translated = random_machine(seed)
+        block = translated.BLOCKS.compile(0xC000, 0xC000)
+        if block is None:
+            continue
+        try:
+            translated.SCHEDULER.now += block(translated)
+        except Exception:
+            continue  # random code wandering into something unemulated
+
+        interpreted = random_machine(seed)
+        while interpreted.SCHEDULER.now < translated.SCHEDULER.now:
+            interpreted.SCHEDULER.now += interpreted.execute_next_opcode()
+        assert machine_state(interpreted) == machine_state(translated), seed
+        compared += 1
+    assert compared > 25
+
+
+def test_writing_over_ram_code_rebuilds_its_block():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    memory.memory[0xC000:0xC003] = bytes([0x3C, 0x18, 0xFD])  # INC A; JR -3
+    cpu.REGISTERS.pc = 0xC000
+    for _ in range(40):
+        cpu.execute_next_block()
+    assert 0xC000 in cpu.BLOCKS.blocks
+    memory.write(0xC000, 0x3D)  # DEC A
+    assert 0xC000 not in cpu.BLOCKS.blocks
+    a = cpu.REGISTERS.r[emu.registers.A]
+    for _ in range(40):
+        cpu.execute_next_block()
+    assert cpu.REGISTERS.r[emu.registers.A] < a or cpu.REGISTERS.r[emu.registers.A] > a + 40
+
+
+def test_idle_loop_runs_like_the_interpreter():
+    # LDH A,(0x44); CP 0x90; JR NZ,-6 waits for line 144, then counts frames
+    program = bytes([0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA, 0x21, 0x00, 0xC0, 0x34, 0xF0, 0x44, 0xFE, 0x90, 0x28,
+                     0xFA, 0x18, 0xEE])
+    cartridge = build_cartridge(program)
+    translated = emu.cpu.CPU(cartridge)
+    interpreted = emu.cpu.CPU(cartridge)
+    interpreted.execute_next_block = interpreted.execute_next_opcode
+    for _ in range(10):
+        translated.run_frame(False)
+        interpreted.run_frame(False)
+    # a frame ends after the block that crosses VBlank, so only the count is compared
+    assert translated.MEMORY.memory[0xC000] == interpreted.MEMORY.memory[0xC000] >= 9
+
+
+# Each bank starts with the store that switches to the other one, the code
+# after it has to come from the new bank
+@pytest.mark.parametrize("store", [bytes([0x77]), bytes([0xEA, 0x00, 0x20])], ids=["LD (HL),A", "LD (nn),A"])
+def test_bank_switch_inside_a_hot_loop(store):
+    check = 0x4000 + len(store) + 5
+    code = {0x150: bytes([0xFA, check & 0xFF, check >> 8,  # LD A,(check)
+                          0xBA, 0x20, 0x06,  # CP D; JR NZ,fail
+                          0x3E, 0x03, 0x92,  # LD A,3; SUB D
+                          0xC3, 0x00, 0x40,  # JP 0x4000
+                          0x3E, 0x01, 0xEA, 0x00, 0xC0, 0x76])}  # fail: LD (0xC000),1; HALT
+    for bank in (1, 2):
+        # switch; LD D,bank; JP 0x150; the bank number to check against
+        code[bank * 0x4000] = store + bytes([0x16, bank, 0xC3, 0x50, 0x01, bank])
+    program = bytes([0x21, 0x00, 0x20, 0x3E, 0x02, 0xC3, 0x00, 0x40])  # LD HL,0x2000; LD A,2; JP 0x4000
+    cpu = emu.cpu.CPU(build_cartridge(program, code, cartridge_type=0x01, banks=4))
+    for _ in range(3):
+        cpu.update(False)
+    assert 1 << 16 | 0x4000 in cpu.BLOCKS.blocks and 2 << 16 | 0x4000 in cpu.BLOCKS.blocks
+    assert cpu.MEMORY.memory[0xC000] == 0
+    assert not cpu.halted
@@ -0,0 +1,39 @@
+import numpy as np
+
+import emu.capture
+import emu.cpu
+from conftest import build_cartridge
+from emu.memory import SCREEN_HEIGHT, SCREEN_WIDTH
+
+
+def test_frames_are_taken_at_vblank(tmp_path):
+    cpu = emu.cpu.CPU(build_cartridge(bytes([0x18, 0xFE])))  # JR -2
+    lines = []
+    cpu.MEMORY.vblank_hooks.append(lambda screen: lines.append(cpu.MEMORY.memory[0xFF44]))
+    capture = emu.capture.Capture(str(tmp_path / "out.raw"), skip_duplicates=False)
+    capture.attach(cpu)
+    for _ in range(10):
+        cpu.update()
+    capture.close()
+    assert lines == [144] * len(lines)
+    vblanks = (cpu.SCHEDULER.now - 144 * 456) // emu.cpu.LCD_FRAME_CYCLES + 1
+    assert capture.stats()["written"] == len(lines) == vblanks
+    frame_size = SCREEN_HEIGHT * SCREEN_WIDTH * 3
+    assert (tmp_path / "out.raw").stat().st_size == vblanks * frame_size
+
+
+def test_duplicates_are_skipped(tmp_path):
+    capture = emu.capture.Capture(str(tmp_path / "out.raw"))
+    screen = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+    capture.on_frame(screen)
+    capture.on_frame(screen)
+    screen[0, 0] = 0xFF
+    capture.on_frame(screen)
+    capture.close()
+    assert capture.stats() == {"frames": 3, "written": 2, "duplicates": 1, "dropped": 0}
+
+
+def test_png_and_y4m_encoding():
+    frame = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+    assert emu.capture.png_bytes(frame).startswith(b"\x89PNG\r\n\x1a\n")
+    assert len(emu.capture.y4m_planes(frame)) == frame.size
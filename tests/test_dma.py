@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+import emu.cpu
+from conftest import build_cartridge
+
+
+# every byte of a switchable bank holds the bank's number, on an MBC1
+# cartridge
+def banked_cpu():
+    code = {bank * 0x4000: bytes([bank]) * 0x4000 for bank in range(1, 4)}
+    code.update({0x0000: bytes(range(0x100)), 0x3F00: bytes(range(0x100))})
+    return emu.cpu.CPU(build_cartridge(code=code, cartridge_type=0x01, banks=4))
+
+
+def fill(memory, seed=0):
+    rng = random.Random(seed)
+    memory.memory[0x8000:0xA000] = bytes(rng.randrange(0x100) for _ in range(0x2000))
+    memory.memory[0xC000:0xE000] = bytes(rng.randrange(0x100) for _ in range(0x2000))
+
+
+@pytest.mark.parametrize("address, length", [(0xC0F0, 0x20), (0xC000, 0x2000), (0x3FF0, 0x20), (0x7FFF, 1),
+                                             (0xDDF0, 0x400), (0xFF00, 0x10), (0xFE9C, 0x10), (0x0000, 0x10000)])
+def test_read_block_matches_reads(address, length):
+    by_block, by_byte = banked_cpu(), banked_cpu()
+    for cpu in (by_block, by_byte):
+        fill(cpu.MEMORY)
+        cpu.MEMORY.write(0x2000, 0x02)
+        cpu.SCHEDULER.now += 1000  # so reads of the timer and LCD registers have to sync
+    expected = bytes(by_byte.MEMORY.read(byte) for byte in range(address, address + length))
+    assert by_block.MEMORY.read_block(address, length) == expected
+
+
+# The other machine gets the same bytes a write at a time
+@pytest.mark.parametrize("address, length", [(0xC0F0, 0x20), (0x8FF0, 0x40), (0x97F8, 0x10), (0xFE90, 0x20),
+                                             (0xE0F8, 0x10), (0xFEFF, 0x3), (0xA000, 0x200)])
+def test_write_block_matches_writes(address, length):
+    data = bytes(random.Random(address).randrange(0x100) for _ in range(length))
+    by_block = banked_cpu().MEMORY
+    by_byte = banked_cpu().MEMORY
+    for memory in (by_block, by_byte):
+        memory.write(0x0000, 0x0A)  # cartridge RAM on
+        memory.decode_tiles()
+        memory.build_sprite_lines(8)
+    by_block.write_block(address, data)
+    for offset, byte in enumerate(data):
+        by_byte.write(address + offset, byte)
+    assert by_block.memory == by_byte.memory
+    assert by_block.ram_banks == by_byte.ram_banks
+    assert by_block.dirty_tiles == by_byte.dirty_tiles
+    assert (by_block.sprite_lines is None) == (by_byte.sprite_lines is None)
+
+
+def test_write_block_into_the_rom_area_reaches_the_mapper():
+    memory = banked_cpu().MEMORY
+    memory.write_block(0x2000, bytes([0x03]))
+    assert memory.read(0x4000) == 3
+    assert memory.memory[0x2000] == 0x00
+
+
+def test_blocks_past_the_address_space():
+    memory = emu.cpu.CPU().MEMORY
+    with pytest.raises(ValueError, match="runs past the address space"):
+        memory.read_block(0xFFF0, 0x20)
+    with pytest.raises(ValueError, match="runs past the address space"):
+        memory.write_block(0xFFFF, b"\x00\x00")
+
+
+# What do_dma_transfer used to do before it went through read_block
+def byte_by_byte_dma(memory, data):
+    for i in range(0xA0):
+        memory.write(0xFE00 + i, memory.read((data << 8) + i))
+
+
+@pytest.mark.parametrize("source", [0x00, 0x3F, 0x40, 0x7F, 0x80, 0xA0, 0xC0, 0xC1, 0xDF, 0xE0])
+def test_dma_matches_a_byte_by_byte_copy(source):
+    block = banked_cpu().MEMORY
+    byte = banked_cpu().MEMORY
+    for memory in (block, byte):
+        fill(memory)
+        memory.write(0x0000, 0x0A)
+        memory.write(0x2000, 0x03)
+        memory.write_block(0xA000, bytes(range(0x100)))
+        memory.build_sprite_lines(8)
+    block.write(0xFF46, source)
+    byte_by_byte_dma(byte, source)
+    assert block.memory[0xFE00:0xFEA0] == byte.memory[0xFE00:0xFEA0]
+    assert block.memory[0xFE00:0xFEA0] != bytes(0xA0)
+    assert block.sprite_lines is None
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import emu.cpu
+import emu.driver
+from conftest import build_cartridge
+
+
+def test_frames_are_whole_lcd_frames():
+    cpu = emu.cpu.CPU(build_cartridge(bytes([0x18, 0xFE])))  # JR -2
+    driver = emu.driver.AsyncDriver(cpu, uncapped=True)
+    lines = []
+
+    async def main():
+        async for frame in driver.frames(4):
+            lines.append(cpu.MEMORY.memory[0xFF44])
+            assert frame.shape == cpu.MEMORY.screen_data.shape
+
+    asyncio.run(main())
+    assert lines == [144] * 4
+    assert driver.frame == 4
+
+
+def test_paced_at_the_lcd_rate():
+    driver = emu.driver.AsyncDriver(emu.cpu.CPU(build_cartridge(bytes([0x18, 0xFE]))))
+    assert driver.frame_time == 70224 / 4194304
+    start = time.perf_counter()
+    asyncio.run(driver.run(6))
+    assert time.perf_counter() - start >= 5 * driver.frame_time
+
+
+def test_inputs_are_applied_between_frames():
+    cpu = emu.cpu.CPU(build_cartridge(bytes([0x18, 0xFE])))
+    driver = emu.driver.AsyncDriver(cpu, uncapped=True)
+
+    async def main():
+        driver.inputs = asyncio.Queue()
+        driver.press("start")
+        await driver.run(1)
+
+    asyncio.run(main())
+    assert not cpu.MEMORY.joypad_state & 0x80
@@ -0,0 +1,58 @@
+import pytest
+
+import emu.cpu
+import emu.framebuffer
+from conftest import TETRIS, build_cartridge
+
+
+def test_swap_publishes_the_back_buffer_and_moves_on():
+    cpu = emu.cpu.CPU(build_cartridge())
+    framebuffer = emu.framebuffer.FrameBuffer(cpu)
+    framebuffer.attach()
+    memory = cpu.MEMORY
+    assert framebuffer.acquire() is None
+
+    drawn = memory.screen_data
+    framebuffer.swap(drawn)
+    assert framebuffer.acquire() is drawn
+    assert memory.screen_data is not drawn
+
+    # while the consumer holds a frame the emulator never draws into it
+    for _ in range(5):
+        framebuffer.swap(memory.screen_data)
+        assert memory.screen_data is not drawn
+    framebuffer.release()
+    framebuffer.detach()
+
+
+def test_frames_come_out_in_order_and_skips_are_counted():
+    cpu = emu.cpu.CPU(build_cartridge())
+    framebuffer = emu.framebuffer.FrameBuffer(cpu)
+    framebuffer.attach()
+    memory = cpu.MEMORY
+    for number in range(1, 4):
+        memory.screen_data[0, 0] = number
+        framebuffer.swap(memory.screen_data)
+        assert framebuffer.acquire()[0, 0].tolist() == [number] * 3
+    for number in range(4, 7):
+        memory.screen_data[0, 0] = number
+        framebuffer.swap(memory.screen_data)
+    assert framebuffer.frame_age == 3
+    assert framebuffer.acquire()[0, 0].tolist() == [6] * 3
+    assert framebuffer.stats() == {"published": 6, "acquired": 6, "dropped": 2, "frame_age": 0}
+
+
+def test_swaps_at_vblank():
+    cpu = emu.cpu.CPU(TETRIS)
+    framebuffer = emu.framebuffer.FrameBuffer(cpu)
+    framebuffer.attach()
+    for _ in range(30):
+        cpu.run_frame()
+    assert framebuffer.published == cpu.MEMORY.vblank_count
+    assert (framebuffer.acquire() == framebuffer.buffers[framebuffer.latest[1]]).all()
+    framebuffer.detach()
+
+
+def test_needs_three_buffers():
+    with pytest.raises(ValueError):
+        emu.framebuffer.FrameBuffer(emu.cpu.CPU(build_cartridge()), buffers=2)
@@ -0,0 +1,40 @@
+import emu.__main__
+import emu.cpu
+from conftest import build_cartridge
+
+SPIN = bytes([0x18, 0xFE])  # JR -2
+
+
+def test_run_frame_ends_at_vblank():
+    cpu = emu.cpu.CPU(build_cartridge(SPIN))
+    ends = []
+    for _ in range(5):
+        cpu.run_frame()
+        ends.append(cpu.SCHEDULER.now)
+        assert cpu.MEMORY.memory[0xFF44] == 144
+    # instructions are 12 cycles here, so a frame can overshoot VBlank a little
+    assert all(0 <= end - (144 * 456 + i * emu.cpu.LCD_FRAME_CYCLES) < 12 for i, end in enumerate(ends))
+
+
+def test_run_frame_with_the_lcd_off_runs_one_frame_of_cycles():
+    cpu = emu.cpu.CPU(build_cartridge(SPIN))
+    cpu.MEMORY.memory[0xFF40] = 0x00
+    start = cpu.SCHEDULER.now
+    cpu.run_frame()
+    assert 0 <= cpu.SCHEDULER.now - start - emu.cpu.LCD_FRAME_CYCLES < 12
+
+
+def test_lcd_frame_rate():
+    assert round(emu.cpu.LCD_FRAMES_PER_SECOND, 2) == 59.73
+
+
+def test_frameskip_draws_the_last_frame():
+    drawn = [emu.__main__.is_drawn(frame, 10, 2) for frame in range(10)]
+    assert drawn == [False, False, True, False, False, True, False, False, True, True]
+
+
+def test_run_command(tmp_path, capsys):
+    rom = tmp_path / "spin.gb"
+    rom.write_bytes(bytes(build_cartridge(SPIN).view))
+    assert emu.__main__.main(["run", str(rom), "--frames", "3", "--turbo"]) == 0
+    assert capsys.readouterr().out.startswith("3 frames (3 drawn)")
@@ -0,0 +1,131 @@
+import pytest
+
+import emu.cpu
+from conftest import build_cartridge
+
+# LD A,n; LDH (0xFF),A enables the interrupt, XOR A; LDH (0x0F),A clears any
+# request, then EI; HALT; NOP; JR -4 sleeps until the next one
+def halt_loop(enabled):
+    return bytes([0x3E, enabled, 0xE0, 0xFF, 0xAF, 0xE0, 0x0F, 0xFB, 0x76, 0x00, 0x18, 0xFC])
+
+
+# LD HL,nn; INC (HL); RETI counts how often the handler ran
+def counting_handler(counter):
+    return bytes([0x21, counter & 0xFF, counter >> 8, 0x34, 0xD9])
+
+
+def make_cpu(cartridge, interpreted):
+    cpu = emu.cpu.CPU(cartridge)
+    if interpreted:
+        cpu.execute_next_block = cpu.execute_next_opcode
+    return cpu
+
+
+@pytest.mark.parametrize("interpreted", [True, False])
+def test_vblank_wakes_halt_every_frame(interpreted):
+    cpu = make_cpu(build_cartridge(halt_loop(0x01), {0x40: counting_handler(0xC000)}), interpreted)
+    frames = 20
+    for _ in range(frames):
+        cpu.update(False)
+    # one VBlank per 70224 cycle LCD frame, each handled in the frame it was raised
+    vblanks = cpu.SCHEDULER.now // 70224
+    assert cpu.MEMORY.memory[0xC000] in (vblanks, vblanks + 1)
+    assert cpu.MEMORY.memory[0xC000] >= frames - 1
+
+
+@pytest.mark.parametrize("interpreted", [True, False])
+def test_handler_runs_right_after_the_wake_up(interpreted):
+    # the handler reads LY, which must still be the VBlank line
+    handler = bytes([0xF0, 0x44, 0xEA, 0x00, 0xC0, 0xD9])  # LDH A,(0x44); LD (0xC000),A; RETI
+    cpu = make_cpu(build_cartridge(halt_loop(0x01), {0x40: handler}), interpreted)
+    cpu.MEMORY.memory[0xC000] = 0xFF
+    cpu.update(False)  # the first VBlank is at cycle 65664, inside the first update
+    assert cpu.MEMORY.memory[0xC000] == 144
+
+
+@pytest.mark.parametrize("interpreted", [True, False])
+def test_timer_wakes_halt(interpreted):
+    # TAC = 0x05 counts every 16 cycles, TIMA overflows every 4096
+    program = bytes([0x3E, 0x05, 0xE0, 0x07]) + halt_loop(0x04)
+    cpu = make_cpu(build_cartridge(program, {0x50: counting_handler(0xC000)}), interpreted)
+    cpu.MEMORY.memory[0xFF06] = 0x00  # TMA
+    for _ in range(2):
+        cpu.update(False)
+    overflows = cpu.SCHEDULER.now // 4096
+    assert cpu.MEMORY.memory[0xC000] in (overflows - 1, overflows)
+
+
+def test_halt_fast_forwards_to_the_next_event():
+    cpu = emu.cpu.CPU(build_cartridge())
+    cpu.MEMORY.memory[0xFFFF] = 0x00
+    cpu.halted = True
+    scheduler = cpu.SCHEDULER
+    deadline = scheduler.next_deadline
+    cycles = cpu.execute_next_opcode()
+    assert cycles % 4 == 0
+    assert scheduler.now + cycles >= deadline > scheduler.now + cycles - 4
+    assert cpu.halted
+
+
+def test_fast_forward_stops_for_the_handler():
+    cpu = make_cpu(build_cartridge(halt_loop(0x01), {0x40: counting_handler(0xC000)}), True)
+    execute = cpu.execute_next_opcode
+    handler_cycles = []
+
+    def traced():
+        if cpu.REGISTERS.pc == 0x40 and not cpu.halted:
+            handler_cycles.append(cpu.SCHEDULER.now)
+        return execute()
+
+    cpu.execute_next_block = traced
+    cpu.update(False)
+    cpu.update(False)
+    # VBlank starts at line 144 of each 70224 cycle frame, 456 cycles a line
+    assert [cycle // 70224 for cycle in handler_cycles] == [0, 1]
+    assert all(0 <= cycle % 70224 - 144 * 456 < 32 for cycle in handler_cycles)
+
+
+def test_pending_interrupt_ends_halt_without_ime():
+    cpu = emu.cpu.CPU(build_cartridge(bytes([0x00])))
+    cpu.MEMORY.interrupt_master = False
+    cpu.MEMORY.memory[0xFFFF] = 0x01
+    cpu.MEMORY.memory[0xFF0F] = 0x01
+    cpu.halted = True
+    cpu.execute_next_opcode()
+    assert not cpu.halted
+
+
+@pytest.mark.parametrize("interpreted", [True, False])
+def test_ei_waits_for_the_next_instruction(interpreted):
+    # DI; request serial; NOP; EI; INC B; JR back to the DI. The handler
+    # stores B, which the INC after the EI must already have counted up.
+    program = bytes([0x21, 0x00, 0xC0, 0x3E, 0x08, 0xE0, 0xFF,  # LD HL,0xC000; enable serial
+                     0xF3, 0x3E, 0x08, 0xE0, 0x0F, 0x00, 0xFB, 0x04, 0x18, 0xF6])
+    handler = bytes([0x78, 0x22, 0xD9])  # LD A,B; LD (HL+),A; RETI
+    cpu = make_cpu(build_cartridge(program, {0x58: handler}), interpreted)
+    cpu.update(False)
+    stored = cpu.REGISTERS.hl - 0xC000
+    assert stored > 100
+    assert list(cpu.MEMORY.memory[0xC000:0xC000 + stored]) == [(i + 1) & 0xFF for i in range(stored)]
+    if not interpreted:
+        assert 0x010C in cpu.BLOCKS.blocks
+
+
+def test_ei_halt_with_an_interrupt_already_pending():
+    # DI; request and enable VBlank; EI; HALT; INC C; JR -2. IME only comes
+    # on after the HALT, so the handler returns past it instead of to it.
+    program = bytes([0xF3, 0x21, 0x00, 0xC0, 0x3E, 0x01, 0xE0, 0xFF, 0xE0, 0x0F, 0xFB, 0x76, 0x0C, 0x18, 0xFE])
+    handler = bytes([0x79, 0x22, 0xD9])  # LD A,C; LD (HL+),A; RETI
+    cpu = emu.cpu.CPU(build_cartridge(program, {0x40: handler}))
+    cpu.update(False)
+    first, second = cpu.MEMORY.memory[0xC000:0xC002]
+    assert second == first + 1
+    assert not cpu.halted
+
+
+def test_di_straight_after_ei_keeps_interrupts_off():
+    program = bytes([0xF3, 0x3E, 0x01, 0xE0, 0xFF, 0xE0, 0x0F, 0xFB, 0xF3, 0x18, 0xFE])  # ...; EI; DI; JR -2
+    cpu = emu.cpu.CPU(build_cartridge(program, {0x40: bytes([0x76])}))
+    cpu.update(False)
+    assert not cpu.MEMORY.interrupt_master and cpu.MEMORY.ime_pending is None
+    assert cpu.REGISTERS.pc == 0x109
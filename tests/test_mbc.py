@@ -0,0 +1,149 @@
+import pytest
+
+import emu.cpu
+import emu.mbc
+import emu.memory
+import emu.rom
+from conftest import build_cartridge
+
+
+# every byte of a bank holds the bank's number
+def banked_memory(cartridge_type, banks, ram_size=0x03):
+    code = {bank * emu.rom.BANK_SIZE: bytes([bank & 0xFF]) * emu.rom.BANK_SIZE for bank in range(1, banks)}
+    return emu.memory.Memory(build_cartridge(code=code, cartridge_type=cartridge_type, banks=banks,
+                                             ram_size=ram_size))
+
+
+def test_mapper_comes_from_the_header():
+    assert type(banked_memory(0x00, 2).mapper) is emu.mbc.ROMOnly
+    assert type(banked_memory(0x03, 4).mapper) is emu.mbc.MBC1
+    assert type(banked_memory(0x06, 4).mapper) is emu.mbc.MBC2
+    assert banked_memory(0x10, 4).mapper.has_rtc
+    assert not banked_memory(0x13, 4).mapper.has_rtc
+    assert type(banked_memory(0x1B, 4).mapper) is emu.mbc.MBC5
+    with pytest.raises(ValueError, match="Unsupported cartridge type 0xFC"):
+        banked_memory(0xFC, 2)
+
+
+def test_mbc1_banks():
+    memory = banked_memory(0x03, 128)
+    read, write = memory.read, memory.write
+    assert read(0x4000) == 1 and read(0xA000) == 0xFF
+    write(0x2000, 0x00)
+    assert read(0x4000) == 1  # bank 0 selects 1
+    write(0x2000, 0x05)
+    assert read(0x7FFF) == 5 and memory.current_rom_bank == 5
+    write(0x4000, 0x02)
+    assert read(0x4000) == 0x45
+    write(0x2000, 0x00)
+    assert read(0x4000) == 0x41
+    assert memory.read_block(0x4000, 4) == b"\x41" * 4
+
+    write(0x0000, 0x0A)
+    write(0xA000, 0x12)
+    assert read(0xA000) == 0x12 and memory.ram_banks[0] == 0x12
+    write(0x6000, 0x01)  # mode 1, the upper bits pick the RAM bank and the bank at 0x0000
+    assert read(0x0000) == 0x40 and read(0xA000) == 0x00
+    write(0xA001, 0x07)
+    assert memory.ram_banks[2 * 0x2000 + 1] == 0x07
+    write(0x0000, 0x00)
+    assert read(0xA001) == 0xFF
+    write(0xA001, 0x09)
+    assert memory.ram_banks[2 * 0x2000 + 1] == 0x07
+
+
+def test_mbc1_bank0_switch_drops_blocks_built_there():
+    cpu = emu.cpu.CPU(build_cartridge(cartridge_type=0x01, banks=64))
+    cpu.BLOCKS.blocks[0x0150] = cpu.BLOCKS.blocks[0xC000] = lambda cpu: 4
+    cpu.MEMORY.write(0x4000, 0x01)
+    cpu.MEMORY.write(0x6000, 0x01)
+    assert 0x0150 not in cpu.BLOCKS.blocks and 0xC000 in cpu.BLOCKS.blocks
+
+
+def test_mbc2_banks_and_nibble_ram():
+    memory = banked_memory(0x06, 16)
+    memory.write(0x2100, 0x03)  # address bit 8 set, ROM bank
+    assert memory.read(0x4000) == 3
+    memory.write(0x2000, 0x0A)  # bit 8 clear, RAM enable
+    assert memory.read(0x4000) == 3
+    memory.write(0xA203, 0x5C)
+    assert memory.read(0xA003) == 0xFC  # 512 cells, mirrored, upper bits read 1
+
+
+def test_mbc3_banks():
+    memory = banked_memory(0x13, 128)
+    memory.write(0x2000, 0x7F)
+    assert memory.read(0x4000) == 0x7F
+    memory.write(0x2000, 0x00)
+    assert memory.read(0x4000) == 1
+    memory.write(0x0000, 0x0A)
+    memory.write(0x4000, 0x03)
+    memory.write(0xBFFF, 0xAB)
+    assert memory.ram_banks[0x7FFF] == 0xAB
+    memory.write(0x4000, 0x08)  # no clock on this cartridge
+    assert memory.read(0xA000) == 0xFF
+
+
+def test_mbc3_clock_latching():
+    cpu = emu.cpu.CPU(build_cartridge(cartridge_type=0x10, banks=4))
+    memory = cpu.MEMORY
+
+    def latched():
+        memory.write(0x6000, 0x00)
+        memory.write(0x6000, 0x01)
+        values = []
+        for register in range(0x08, 0x0D):
+            memory.write(0x4000, register)
+            values.append(memory.read(0xA000))
+        return values
+
+    memory.write(0x0000, 0x0A)
+    memory.scheduler.now += emu.mbc.CLOCK * (86400 + 3661) + 5
+    memory.last_sync = memory.scheduler.now  # nothing else needs to catch up
+    assert latched() == [1, 1, 1, 1, 0]
+
+    # the registers hold still until the next latch
+    memory.scheduler.now += emu.mbc.CLOCK * 10
+    memory.last_sync = memory.scheduler.now
+    memory.write(0x4000, 0x08)
+    assert memory.read(0xA000) == 1
+    assert latched()[0] == 11
+
+    # halted, the clock stops
+    memory.write(0x4000, 0x0C)
+    memory.write(0xA000, 0x40)
+    memory.scheduler.now += emu.mbc.CLOCK * 100
+    memory.last_sync = memory.scheduler.now
+    assert latched() == [11, 1, 1, 1, 0x40]
+
+
+def test_mbc3_clock_day_carry():
+    cpu = emu.cpu.CPU(build_cartridge(cartridge_type=0x0F, banks=4))
+    memory = cpu.MEMORY
+    memory.write(0x0000, 0x0A)
+    memory.mapper.rtc_seconds = 511 * 86400 + 86399
+    memory.scheduler.now += emu.mbc.CLOCK
+    memory.last_sync = memory.scheduler.now
+    memory.write(0x6000, 0x00)
+    memory.write(0x6000, 0x01)
+    memory.write(0x4000, 0x0C)
+    assert memory.read(0xA000) == 0x80
+
+
+def test_mbc5_banks():
+    memory = banked_memory(0x1B, 512, ram_size=0x04)
+    memory.write(0x2000, 0x00)
+    assert memory.read(0x4000) == 0  # bank 0 can be selected
+    memory.write(0x2000, 0x34)
+    memory.write(0x3000, 0x01)
+    assert memory.current_rom_bank == 0x134 and memory.read(0x4000) == 0x34
+    memory.write(0x0000, 0x0A)
+    memory.write(0x4000, 0x0F)
+    memory.write(0xBFFF, 0xAB)
+    assert len(memory.ram_banks) == 0x20000 and memory.ram_banks[0x1FFFF] == 0xAB
+
+
+def test_banks_past_the_end_of_the_rom_mirror():
+    memory = banked_memory(0x19, 8)
+    memory.write(0x2000, 0x0B)
+    assert memory.read(0x4000) == 3 and memory.current_rom_bank == 3
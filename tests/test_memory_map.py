@@ -0,0 +1,98 @@
+import emu.cpu
+from conftest import build_cartridge
+
+
+# every byte of a switchable bank holds the bank's number
+def banked_cpu(cartridge_type=0x03):
+    code = {bank * 0x4000: bytes([bank]) * 0x4000 for bank in range(1, 4)}
+    return emu.cpu.CPU(build_cartridge(code=code, cartridge_type=cartridge_type, banks=4, ram_size=0x02))
+
+
+def test_echo_ram_is_work_ram():
+    memory = emu.cpu.CPU().MEMORY
+    memory.write(0xE123, 0x42)
+    assert memory.read(0xC123) == 0x42
+    memory.write(0xDDFF, 0x17)
+    assert memory.read(0xFDFF) == 0x17
+    # OAM follows straight after, it isn't echoed
+    memory.write(0xDE00, 0x99)
+    assert memory.read(0xFE00) == 0x00
+    for page in range(0xE0, 0xFE):
+        assert memory.read_pages[page] is memory.read_pages[page - 0x20]
+        assert memory.write_pages[page] is memory.write_pages[page - 0x20]
+
+
+def test_unusable_area():
+    memory = emu.cpu.CPU().MEMORY
+    for address in (0xFEA0, 0xFEC5, 0xFEFF):
+        memory.write(address, 0x55)
+        assert memory.read(address) == 0x00
+    memory.write(0xFE9F, 0x55)
+    assert memory.read(0xFE9F) == 0x55
+
+
+def test_plain_pages_and_handler_pages():
+    memory = emu.cpu.CPU().MEMORY
+    plain = list(range(0x80, 0xA0)) + list(range(0xC0, 0xFF))
+    assert all(memory.read_pages[page] is not None for page in plain)
+    assert all(memory.write_pages[page] is not None for page in range(0xC0, 0xFE))
+    # VRAM and OAM read straight from memory but writes go through their caches
+    assert all(memory.write_handlers[page] == memory.write_tile_data for page in range(0x80, 0x98))
+    assert memory.write_pages[0x98] is not None
+    assert memory.write_handlers[0xFE] == memory.write_oam
+    assert memory.read_pages[0xFF] is None and memory.write_pages[0xFF] is None
+
+
+def test_handlers_are_routed():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    memory.write(0x8123, 0x77)
+    assert memory.read(0x8123) == 0x77 and memory.dirty_tiles == {0x12}
+    memory.build_sprite_lines(8)
+    memory.write(0xFE10, 0x20)
+    assert memory.read(0xFE10) == 0x20 and memory.sprite_lines is None
+    cpu.SCHEDULER.now += 456 * 5
+    assert memory.read(0xFF44) == 5  # I/O reads sync the LCD
+    memory.write(0xFF04, 0x12)  # any write clears DIV
+    assert memory.read(0xFF04) == 0
+    memory.write(0xFF00, 0x20)  # select the directions
+    memory.joypad_state = 0xFE  # right held
+    assert memory.read(0xFF00) & 0x0F == 0x0E
+    memory.write(0xFF80, 0x33)
+    assert memory.read(0xFF80) == 0x33
+    memory.write(0xFFFF, 0x1F)
+    assert memory.read(0xFFFF) == 0x1F
+
+
+def test_rom_is_read_only():
+    memory = banked_cpu(0x00).MEMORY
+    before = memory.read(0x0150), memory.read(0x4000)
+    memory.write(0x0150, 0x12)
+    memory.write(0x4000, 0x12)
+    assert (memory.read(0x0150), memory.read(0x4000)) == before
+    assert memory.read(0x4000) == 1
+
+
+def test_bank_switch_remaps_the_pages():
+    memory = banked_cpu().MEMORY
+    page = memory.read_pages[0x40]
+    assert memory.read(0x4000) == 1 and memory.read(0x7FFF) == 1
+    memory.write(0x2000, 0x03)
+    assert memory.read_pages[0x40] is not page
+    assert memory.read(0x4000) == 3 and memory.read(0x7FFF) == 3
+    assert memory.read(0x0000) == 0  # the fixed bank stays put
+    memory.write(0x2000, 0x02)
+    assert memory.read(0x5555) == 2
+
+
+def test_cartridge_ram_is_mapped_only_while_enabled():
+    memory = banked_cpu().MEMORY
+    assert memory.read_pages[0xA0] is None
+    memory.write(0xA000, 0x12)
+    assert memory.read(0xA000) == 0xFF
+    memory.write(0x0000, 0x0A)
+    assert memory.read_pages[0xA0] is not None
+    memory.write(0xA000, 0x12)
+    assert memory.read(0xA000) == 0x12 and memory.ram_banks[0] == 0x12
+    memory.write(0x0000, 0x00)
+    assert memory.read(0xA000) == 0xFF
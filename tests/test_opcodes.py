@@ -0,0 +1,117 @@
+import pytest
+
+import emu.cpu
+import emu.registers
+from emu.opcodes import INSTRUCTIONS, CB_INSTRUCTIONS, OPCODES, CB_OPCODES, ILLEGAL_OPCODES, instruction_length
+
+# Bytes and cycles of every opcode as the usual LR35902 opcode tables list
+# them, written out by hand rather than from the spec. A length of 0 is an
+# unused opcode, conditional instructions are (taken, not taken) and 0xCB is
+# the prefix alone, its instructions' cycles are in the CB table.
+LENGTHS = [
+    1, 3, 1, 1, 1, 1, 2, 1, 3, 1, 1, 1, 1, 1, 2, 1,
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1,
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1,
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1,
+] + [1] * 0x80 + [
+    1, 1, 3, 3, 3, 1, 2, 1, 1, 1, 3, 2, 3, 3, 2, 1,
+    1, 1, 3, 0, 3, 1, 2, 1, 1, 1, 3, 0, 3, 0, 2, 1,
+    2, 1, 1, 0, 0, 1, 2, 1, 2, 1, 3, 0, 0, 0, 2, 1,
+    2, 1, 1, 1, 0, 1, 2, 1, 2, 1, 3, 1, 0, 0, 2, 1,
+]
+
+CYCLES = [
+    4, 12, 8, 8, 4, 4, 8, 4, 20, 8, 8, 8, 4, 4, 8, 4,
+    4, 12, 8, 8, 4, 4, 8, 4, 12, 8, 8, 8, 4, 4, 8, 4,
+    (12, 8), 12, 8, 8, 4, 4, 8, 4, (12, 8), 8, 8, 8, 4, 4, 8, 4,
+    (12, 8), 12, 8, 8, 12, 12, 12, 4, (12, 8), 8, 8, 8, 4, 4, 8, 4,
+] + [8 if op & 7 == 6 or 0x70 <= op < 0x78 else 4 for op in range(0x40, 0x80)] + [
+    8 if op & 7 == 6 else 4 for op in range(0x80, 0xC0)
+] + [
+    (20, 8), 12, (16, 12), 16, (24, 12), 16, 8, 16, (20, 8), 16, (16, 12), 0, (24, 12), 24, 8, 16,
+    (20, 8), 12, (16, 12), 0, (24, 12), 16, 8, 16, (20, 8), 16, (16, 12), 0, (24, 12), 0, 8, 16,
+    12, 12, 8, 0, 0, 16, 8, 16, 16, 4, 16, 0, 0, 0, 8, 16,
+    12, 12, 8, 4, 0, 16, 8, 16, 12, 8, 16, 4, 0, 0, 8, 16,
+]
+CYCLES[0x76] = 4  # HALT sits where LD (HL),(HL) would be
+
+# BIT only reads (HL), the rest read and write it back
+CB_CYCLES = [(12 if 0x40 <= op < 0x80 else 16) if op & 7 == 6 else 8 for op in range(0x100)]
+
+SPEC = {entry[0]: entry for entry in INSTRUCTIONS}
+CB_SPEC = {entry[0]: entry for entry in CB_INSTRUCTIONS}
+LEGAL = [op for op in range(0x100) if op not in ILLEGAL_OPCODES]
+UNPREFIXED = [op for op in LEGAL if op != 0xCB]
+
+
+def test_spec_covers_the_instruction_set():
+    assert sorted(SPEC) == LEGAL
+    assert sorted(CB_SPEC) == list(range(0x100))
+    assert [op for op in range(0x100) if LENGTHS[op] == 0] == ILLEGAL_OPCODES
+
+
+@pytest.mark.parametrize("opcode", LEGAL, ids=hex)
+def test_spec_lengths_and_cycles(opcode):
+    entry = SPEC[opcode]
+    assert instruction_length(entry) == LENGTHS[opcode]
+    assert entry[4] == CYCLES[opcode]
+
+
+def test_cb_spec_cycles():
+    assert [entry[4] for entry in CB_INSTRUCTIONS] == CB_CYCLES
+
+
+# Runs one instruction from work RAM. Operand bytes 0x80 0xC8 make every
+# immediate address land in work RAM or high RAM, and the registers point
+# (HL) and friends into work RAM too.
+def execute(opcode, flags, cb_opcode=None):
+    cpu = emu.cpu.CPU()
+    registers = cpu.REGISTERS
+    registers.r[:] = [0xC8, 0x40, 0xC9, 0x10, 0xCA, 0x20, flags, 0x12]
+    registers.sp = 0xDFF0
+    registers.pc = 0xC001
+    operands = [0x80, 0xC8] if cb_opcode is None else [cb_opcode]
+    cpu.MEMORY.memory[0xC000:0xC001 + len(operands)] = bytes([opcode] + operands)
+    return cpu.execute_opcode(opcode), registers.pc - 0xC000
+
+
+@pytest.mark.parametrize("opcode", UNPREFIXED, ids=hex)
+def test_opcode_cycles_and_pc(opcode):
+    cycles = CYCLES[opcode]
+    if isinstance(cycles, tuple):
+        condition = SPEC[opcode][2][1]
+        taken_flags = 0x00 if condition.startswith("n") else 0xF0
+        taken, pc = execute(opcode, taken_flags)
+        assert taken == cycles[0]
+        assert pc != LENGTHS[opcode]
+        not_taken, pc = execute(opcode, taken_flags ^ 0xF0)
+        assert (not_taken, pc) == (cycles[1], LENGTHS[opcode])
+    elif SPEC[opcode][1] in ("JR", "JP", "CALL", "RET", "RETI", "RST"):
+        taken, pc = execute(opcode, 0x00)
+        assert taken == cycles and pc != LENGTHS[opcode]
+    else:
+        assert execute(opcode, 0x00) == (cycles, LENGTHS[opcode])
+
+
+@pytest.mark.parametrize("cb_opcode", range(0x100), ids=hex)
+def test_cb_opcode_cycles_and_pc(cb_opcode):
+    assert execute(0xCB, 0x00, cb_opcode) == (CB_CYCLES[cb_opcode], 2)
+
+
+def test_tables_are_full():
+    assert len(OPCODES) == len(CB_OPCODES) == 0x100
+    assert OPCODES[0x00] is not OPCODES[ILLEGAL_OPCODES[0]]
+
+
+@pytest.mark.parametrize("opcode", ILLEGAL_OPCODES, ids=hex)
+def test_unused_opcodes_raise(opcode):
+    with pytest.raises(ValueError, match="Unknown opcode"):
+        execute(opcode, 0x00)
+
+
+def test_pop_af_keeps_the_low_nibble_of_f_clear():
+    cpu = emu.cpu.CPU()
+    cpu.REGISTERS.sp = 0xDFF0
+    cpu.MEMORY.memory[0xDFF0:0xDFF2] = bytes([0xFF, 0x12])
+    cpu.execute_opcode(0xF1)
+    assert (cpu.REGISTERS.r[emu.registers.A], cpu.REGISTERS.r[emu.registers.F]) == (0x12, 0xF0)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import emu.cpu
+from emu.memory import COLOURS, COLOUR_SCHEMES, GREYS
+
+
+# shades of colour numbers 0-3 under a palette register, two bits each
+def shades(value):
+    return [value >> (2 * colour) & 3 for colour in range(4)]
+
+
+@pytest.mark.parametrize("register", [0xFF47, 0xFF48, 0xFF49], ids=["BGP", "OBP0", "OBP1"])
+def test_writing_a_palette_register_rebuilds_its_colours(register):
+    memory = emu.cpu.CPU().MEMORY
+    first = (register - 0xFF47) * 4
+    before = memory.palette_colours.copy()
+    for value in (0xE4, 0x1B, 0x00, 0xFF, 0x9C):
+        memory.write(register, value)
+        assert memory.read(register) == value
+        assert (memory.palette_colours[first:first + 4] == COLOURS[shades(value)]).all()
+    others = [index for index in range(12) if not first <= index < first + 4]
+    assert (memory.palette_colours[others] == before[others]).all()
+
+
+def test_startup_palettes():
+    memory = emu.cpu.CPU().MEMORY
+    assert (memory.palette_colours == COLOURS[shades(0xFC) + shades(0xFF) + shades(0xFF)]).all()
+
+
+def test_colour_scheme_change_keeps_the_registers():
+    cpu = emu.cpu.CPU(colours=GREYS)
+    memory = cpu.MEMORY
+    memory.write(0xFF48, 0xE4)
+    assert memory.palette_colours[4:8].tolist() == GREYS.tolist()
+    memory.set_colours(GREYS[::-1].copy())
+    assert memory.palette_colours[4:8].tolist() == GREYS[::-1].tolist()
+    with pytest.raises(ValueError, match="can't be drawn"):
+        memory.set_colours(COLOUR_SCHEMES["green"])
+
+
+def test_scanlines_use_the_palette_at_the_time():
+    memory = emu.cpu.CPU(colours=GREYS).MEMORY
+    memory.write(0x8000, 0xFF)  # tile 0's first row, colour 3
+    memory.write(0x8001, 0xFF)
+    memory.memory[0xFF44] = 0
+    memory.draw_scan_line()
+    assert (memory.screen_data[0] == GREYS[3]).all()
+    memory.write(0xFF47, 0x3F)  # colour 3 to shade 0
+    memory.draw_scan_line()
+    assert (memory.screen_data[0] == GREYS[0]).all()
+
+
+def test_load_state_rebuilds_the_palettes():
+    cpu = emu.cpu.CPU()
+    saved = cpu.save_state()
+    before = cpu.MEMORY.palette_colours.copy()
+    cpu.MEMORY.write(0xFF47, 0x1B)
+    cpu.load_state(saved)
+    assert np.array_equal(cpu.MEMORY.palette_colours, before)
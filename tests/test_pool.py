@@ -0,0 +1,13 @@
+import emu.pool
+from conftest import TETRIS
+
+
+def test_jobs_run_in_parallel_and_deterministically():
+    jobs = [emu.pool.Job(60, tag="idle"), emu.pool.Job(60, tag="idle again"),
+            emu.pool.Job(60, inputs=[(30, "start", True)], captures=[(59, 0xC000, 0xC010)], tag="start")]
+    with emu.pool.Pool(TETRIS, processes=2) as pool:
+        results = sorted(pool.run(jobs))
+    assert [result.tag for result in results] == ["idle", "idle again", "start"]
+    assert results[0].state_hash == results[1].state_hash
+    assert results[2].state_hash != results[0].state_hash
+    assert [(frame, start, len(data)) for frame, start, data in results[2].captures] == [(59, 0xC000, 0x10)]
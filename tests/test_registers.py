@@ -0,0 +1,64 @@
+import pytest
+
+from emu.registers import Registers, REGISTER_NUMBERS, STATE_FORMAT, A, B, C, D, E, F, H, L
+
+
+def test_8_bit_registers_and_pairs():
+    reg = Registers()
+    reg.a = 0b11110000
+    reg.f = 0b00001111
+    assert reg.a == 240
+    assert reg.f == 15
+    assert reg.af == 61455
+
+
+@pytest.mark.parametrize("pair, high, low", [("bc", B, C), ("de", D, E), ("hl", H, L)])
+def test_pair_set_and_get(pair, high, low):
+    reg = Registers()
+    setattr(reg, pair, 0xABCD)
+    assert (reg.r[high], reg.r[low]) == (0xAB, 0xCD)
+    assert getattr(reg, pair) == 0xABCD
+    assert (getattr(reg, pair[0]), getattr(reg, pair[1])) == (0xAB, 0xCD)
+    reg.r[high], reg.r[low] = 0x12, 0x34
+    assert getattr(reg, pair) == 0x1234
+
+
+def test_pairs_wrap_to_16_bits():
+    reg = Registers()
+    reg.hl = 0x10001
+    assert reg.hl == 1
+    reg.bc = -1
+    assert reg.bc == 0xFFFF
+
+
+def test_af_keeps_the_low_nibble_of_f_clear():
+    reg = Registers()
+    reg.af = 0b1010101010101010
+    assert reg.a == 170
+    assert reg.f == 0xA0
+    assert reg.af == 0xAAA0
+
+
+def test_registers_by_number():
+    reg = Registers(a=1, b=2, c=3, d=4, e=5, f=0x60, h=7, l=8)
+    assert [reg.r[REGISTER_NUMBERS[name]] for name in "bcdehfa"] == [2, 3, 4, 5, 7, 0x60, 1]
+    assert reg.r[L] == 8
+    reg.b = 0x12
+    reg.c = 0x34
+    assert reg.r[B] == 0x12 and reg.r[C] == 0x34
+    reg.r[A] = 0x56
+    assert reg.a == 0x56 and reg.r[F] == 0x60
+
+
+def test_state_round_trip():
+    reg = Registers(a=0x01, f=0xB0, b=0x00, c=0x13, d=0x00, e=0xD8, h=0x01, l=0x4D, sp=0xFFFE, pc=0x100)
+    data = reg.to_bytes()
+    assert len(data) == STATE_FORMAT.size
+    copy = Registers()
+    copy.from_bytes(data)
+    assert copy.to_bytes() == data
+    assert (copy.af, copy.bc, copy.de, copy.hl, copy.sp, copy.pc) == (0x01B0, 0x0013, 0x00D8, 0x014D, 0xFFFE, 0x100)
+    # from_bytes fills the same list the generated code holds on to
+    r = copy.r
+    copy.from_bytes(Registers().to_bytes())
+    assert copy.r is r and r == [0] * 8
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import emu.cpu
+from emu.memory import GREYS
+
+
+# One scanline worked out a pixel at a time, the way render_tiles did before
+# it drew whole tile rows: the window covers everything from WX-7 onwards,
+# the background wraps at 256 pixels both ways
+def per_pixel_line(memory, scanline):
+    mem = memory.memory
+    control, scroll_y, scroll_x, window_y, window_x = mem[0xFF40], mem[0xFF42], mem[0xFF43], mem[0xFF4A], mem[0xFF4B]
+    line = []
+    for pixel in range(160):
+        if control & 0x20 and window_y <= scanline and pixel >= window_x - 7:
+            tile_map = 0x9C00 if control & 0x40 else 0x9800
+            x_pos, y_pos = pixel - (window_x - 7), scanline - window_y
+        else:
+            tile_map = 0x9C00 if control & 0x08 else 0x9800
+            x_pos, y_pos = (pixel + scroll_x) & 0xFF, (scroll_y + scanline) & 0xFF
+        tile_num = mem[tile_map + (y_pos // 8) * 32 + x_pos // 8]
+        if control & 0x10:
+            address = 0x8000 + tile_num * 16
+        else:
+            address = 0x9000 + ((tile_num ^ 0x80) - 0x80) * 16
+        low, high = mem[address + (y_pos % 8) * 2], mem[address + (y_pos % 8) * 2 + 1]
+        bit = 7 - x_pos % 8
+        colour = (high >> bit & 1) << 1 | (low >> bit & 1)
+        line.append(GREYS[mem[0xFF47] >> (colour * 2) & 3].tolist())
+    return line
+
+
+def random_vram(seed):
+    memory = emu.cpu.CPU(colours=GREYS).MEMORY
+    rng = random.Random(seed)
+    memory.write_block(0x8000, bytes(rng.randrange(0x100) for _ in range(0x2000)))
+    memory.write(0xFF47, 0xE4)
+    return memory
+
+
+# LCDC, SCY, SCX, WY, WX
+CASES = {
+    "origin": (0x91, 0, 0, 0, 0),
+    "fine scroll": (0x91, 3, 5, 0, 0),
+    "wrap both ways": (0x91, 200, 250, 0, 0),
+    "last pixel": (0x91, 255, 255, 0, 0),
+    "signed tiles": (0x81, 17, 129, 0, 0),
+    "high background map": (0x99, 40, 77, 0, 0),
+    "window at the left edge": (0xB1, 9, 13, 0, 7),
+    "window partly off the left": (0xB1, 9, 13, 0, 3),
+    "window at WX 0": (0xB1, 9, 13, 0, 0),
+    "window mid screen": (0xB1, 100, 250, 30, 83),
+    "window at the right edge": (0xB1, 0, 0, 0, 166),
+    "window off the right": (0xB1, 0, 0, 0, 167),
+    "window below the line": (0xB1, 0, 0, 200, 7),
+    "window on the high map": (0xF1, 6, 250, 50, 40),
+    "window with signed tiles": (0xA1, 6, 250, 20, 99),
+    "window on the low map, background on the high": (0xB9, 33, 1, 10, 50),
+}
+
+
+@pytest.mark.parametrize("registers", list(CASES.values()), ids=list(CASES))
+def test_scanlines_match_a_per_pixel_render(registers):
+    memory = random_vram(sum(registers))
+    for address, value in zip((0xFF40, 0xFF42, 0xFF43, 0xFF4A, 0xFF4B), registers):
+        memory.memory[address] = value
+    for scanline in (0, 1, 7, 8, 29, 30, 31, 50, 100, 143):
+        memory.memory[0xFF44] = scanline
+        memory.draw_scan_line()
+        assert memory.screen_data[scanline].tolist() == per_pixel_line(memory, scanline), scanline
+
+
+def test_background_off_leaves_the_line_alone():
+    memory = random_vram(1)
+    memory.memory[0xFF40] = 0x91
+    memory.memory[0xFF44] = 10
+    memory.draw_scan_line()
+    before = memory.screen_data[10].copy()
+    memory.write_block(0x9800, bytes(0x400))
+    memory.memory[0xFF40] = 0x90
+    memory.draw_scan_line()
+    assert (memory.screen_data[10] == before).all()
@@ -0,0 +1,48 @@
+import emu.cpu
+import emu.rewind
+from conftest import TETRIS
+
+
+def test_step_back_reproduces_earlier_frames():
+    cpu = emu.cpu.CPU(TETRIS)
+    rewind = emu.rewind.Rewind(cpu)
+    rewind.attach()
+    states = []
+    screens = []
+    for _ in range(30):
+        cpu.run_frame()
+        states.append(cpu.save_state())
+        screens.append(cpu.MEMORY.screen_data.copy())
+
+    assert rewind.step_back(5)
+    assert cpu.save_state() == states[-6]
+    for i in range(5):
+        cpu.run_frame()
+        assert cpu.save_state() == states[-5 + i]
+        assert (cpu.MEMORY.screen_data == screens[-5 + i]).all()
+    rewind.detach()
+
+
+def test_step_back_stops_at_the_oldest_snapshot():
+    cpu = emu.cpu.CPU(TETRIS)
+    rewind = emu.rewind.Rewind(cpu, interval=2)
+    rewind.attach()
+    first = None
+    for frame in range(10):
+        cpu.run_frame(False)
+        if frame == 1:
+            first = cpu.save_state()
+    assert len(rewind) == 5
+    assert rewind.step_back(100)
+    assert cpu.save_state() == first
+    assert not rewind.step_back()
+
+
+def test_memory_limit_drops_the_oldest_deltas():
+    cpu = emu.cpu.CPU(TETRIS)
+    rewind = emu.rewind.Rewind(cpu, memory_limit=len(cpu.save_state()) + 2000)
+    rewind.attach()
+    for _ in range(60):
+        cpu.run_frame(False)
+    assert rewind.bytes_used <= rewind.memory_limit
+    assert 1 < len(rewind) < 60
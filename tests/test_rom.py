@@ -0,0 +1,70 @@
+import os
+
+import emu.rom
+from conftest import TETRIS, build_cartridge
+
+
+def test_header_is_parsed():
+    cartridge = build_cartridge(cartridge_type=0x1B, banks=8, ram_size=0x03)
+    assert cartridge.title == "TESTROM"
+    assert cartridge.cartridge_type == 0x1B
+    assert cartridge.rom_size == 8 * emu.rom.BANK_SIZE and cartridge.rom_banks == 8
+    assert cartridge.ram_size == 0x8000
+    assert cartridge.bank_count == 8
+
+
+def test_tetris_header():
+    cartridge = emu.rom.load_cartridge(TETRIS)
+    assert cartridge.title == "TETRIS"
+    assert cartridge.cartridge_type == 0x00
+    assert cartridge.rom_size == 0x8000 and cartridge.ram_size == 0
+
+
+def test_ram_sizes():
+    for code, size in ((0x00, 0), (0x01, 0x800), (0x02, 0x2000), (0x03, 0x8000), (0x04, 0x20000), (0x05, 0x10000),
+                       (0x7F, 0)):
+        assert build_cartridge(ram_size=code).ram_size == size
+
+
+def test_banks_mirror_up_to_512():
+    code = {bank * emu.rom.BANK_SIZE: bytes([bank]) for bank in range(6)}
+    cartridge = build_cartridge(code=code, banks=6)
+    assert len(cartridge.banks) == len(cartridge.bank_pages) == emu.rom.MAX_ROM_BANKS
+    assert [cartridge.banks[bank][0] for bank in range(12)] == [0, 1, 2, 3, 4, 5] * 2
+    assert cartridge.banks[511][0] == 511 % 6
+    # pages are 256 byte views into the banks, not copies
+    assert len(cartridge.bank_pages[3]) == emu.rom.BANK_SIZE // emu.rom.PAGE_SIZE
+    assert cartridge.bank_pages[9][0][0] == 3
+    assert cartridge.bank_pages[9][0].obj is cartridge.data
+
+
+def test_cartridges_are_shared_until_the_file_changes(tmp_path):
+    path = tmp_path / "game.gb"
+    path.write_bytes(bytes(build_cartridge(b"\x00", cartridge_type=0x00).view))
+    first = emu.rom.load_cartridge(str(path))
+    link = tmp_path / "link.gb"
+    os.symlink(str(path), str(link))
+    assert emu.rom.load_cartridge(str(link)) is first
+    assert emu.rom.load_cartridge(str(tmp_path / "." / "game.gb")) is first
+
+    # same size, the modification time tells them apart
+    data = bytearray(first.view)
+    data[0x100] = 0x76
+    path.write_bytes(bytes(data))
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    second = emu.rom.load_cartridge(str(path))
+    assert second is not first
+    assert second.banks[0][0x100] == 0x76
+
+    # and a different size is a different ROM too
+    path.write_bytes(bytes(data) * 2)
+    third = emu.rom.load_cartridge(str(path))
+    assert third is not second and third.bank_count == 4
+
+
+def test_loaded_rom_is_read_only(tmp_path):
+    path = tmp_path / "game.gb"
+    path.write_bytes(bytes(build_cartridge().view))
+    cartridge = emu.rom.load_cartridge(str(path))
+    assert cartridge.view.readonly
@@ -0,0 +1,98 @@
+import emu.cpu
+from emu.scheduler import Scheduler, NEVER, TIMER, LCD, INTERRUPT, FRAME
+
+
+def test_next_deadline_is_the_earliest():
+    scheduler = Scheduler()
+    assert scheduler.next_deadline == NEVER
+    scheduler.schedule(TIMER, 100)
+    scheduler.schedule(LCD, 50)
+    scheduler.schedule(FRAME, 70)
+    assert scheduler.next_deadline == 50
+    scheduler.cancel(LCD)
+    assert scheduler.next_deadline == 70
+    scheduler.cancel(FRAME)
+    scheduler.cancel(TIMER)
+    assert scheduler.next_deadline == NEVER
+
+
+def test_rescheduling_replaces_the_deadline():
+    scheduler = Scheduler()
+    scheduler.schedule(TIMER, 100)
+    scheduler.schedule(TIMER, 30)
+    assert scheduler.next_deadline == 30
+    scheduler.schedule(TIMER, 200)  # later than before, not kept at the earlier one
+    assert scheduler.next_deadline == 200
+    assert scheduler.deadlines[TIMER] == 200
+
+
+def test_schedule_in_and_is_due():
+    scheduler = Scheduler()
+    scheduler.now = 1000
+    scheduler.schedule_in(INTERRUPT, 0)
+    scheduler.schedule_in(LCD, 8)
+    assert scheduler.is_due(INTERRUPT) and not scheduler.is_due(LCD)
+    assert scheduler.next_deadline == 1000
+    scheduler.cancel(INTERRUPT)
+    assert scheduler.next_deadline == 1008
+    scheduler.now += 8
+    assert scheduler.is_due(LCD)
+    assert not scheduler.is_due(TIMER)
+
+
+# The clock moves without anything else being run, like it does between
+# events, and the read of a timer or LCD register has to catch up first
+
+def test_timer_catches_up_on_read():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    memory.write(0xFF07, 0x05)  # on, a tick every 16 cycles
+    cpu.SCHEDULER.now += 160
+    assert memory.read(0xFF05) == 10
+    assert memory.last_sync == cpu.SCHEDULER.now
+    divider = memory.read(0xFF04)
+    cpu.SCHEDULER.now += 512
+    assert memory.read(0xFF04) == divider + 2
+
+
+def test_timer_overflow_is_booked_with_the_scheduler():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    memory.write(0xFF05, 0xF0)
+    memory.write(0xFF06, 0x42)
+    memory.write(0xFF07, 0x05)
+    deadline = cpu.SCHEDULER.deadlines[TIMER]
+    assert deadline == cpu.SCHEDULER.now + 16 * 16
+    cpu.SCHEDULER.now = deadline - 1
+    memory.run_events()
+    assert memory.read(0xFF0F) & 0x04 == 0
+    cpu.SCHEDULER.now = deadline
+    memory.run_events()
+    assert memory.memory[0xFF0F] & 0x04
+    assert memory.read(0xFF05) == 0x42
+    # cancelled once the timer is off
+    memory.write(0xFF07, 0x00)
+    assert cpu.SCHEDULER.deadlines[TIMER] == NEVER
+
+
+def test_lcd_catches_up_on_read():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    cpu.SCHEDULER.now += 456 * 3 + 100
+    assert memory.read(0xFF44) == 3
+    assert memory.read(0xFF41) & 0x03 == 3  # 100 cycles into the line, drawing
+    cpu.SCHEDULER.now += 456 * 141
+    assert memory.read(0xFF44) == 144
+    assert memory.memory[0xFF0F] & 0x01
+
+
+def test_other_reads_leave_the_clock_behind():
+    cpu = emu.cpu.CPU()
+    memory = cpu.MEMORY
+    cpu.SCHEDULER.now += 1000
+    memory.read(0xFF42)
+    memory.read(0xC000)
+    assert memory.last_sync == 0
+    assert memory.memory[0xFF44] == 0
+    memory.write(0xFF45, 0x00)  # LYC is one of the registers that syncs
+    assert memory.last_sync == 1000 and memory.memory[0xFF44] == 2
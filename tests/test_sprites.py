@@ -0,0 +1,98 @@
+import emu.cpu
+import emu.memory
+
+WHITE, LIGHT, DARK, BLACK = emu.memory.GREYS
+
+
+def make_memory(control=0x93):
+    memory = emu.cpu.CPU(colours=emu.memory.GREYS).MEMORY
+    memory.write(0xFF40, control)
+    memory.write(0xFF48, 0xE4)  # OBP0 maps colour n to shade n
+    for tile, colour in ((1, 1), (2, 2), (3, 3)):
+        fill_tile(memory, tile, colour)
+    return memory
+
+
+# every pixel of the tile is colour
+def fill_tile(memory, tile, colour):
+    row = [0xFF if colour & 1 else 0x00, 0xFF if colour & 2 else 0x00]
+    for offset in range(0, 16, 2):
+        memory.write(0x8000 + tile * 16 + offset, row[0])
+        memory.write(0x8000 + tile * 16 + offset + 1, row[1])
+
+
+def put_sprite(memory, sprite, y, x, tile, attributes=0):
+    for offset, value in enumerate((y, x, tile, attributes)):
+        memory.write(0xFE00 + sprite * 4 + offset, value)
+
+
+def draw_line(memory, line):
+    memory.memory[0xFF44] = line
+    memory.draw_scan_line()
+    return memory.screen_data[line].tolist()
+
+
+def test_ten_sprites_a_line_in_oam_order():
+    memory = make_memory()
+    for sprite in range(10):
+        put_sprite(memory, sprite, 16, 48 + sprite * 10, 3)
+    # two more further left, but after ten others in OAM
+    put_sprite(memory, 10, 16, 8, 3)
+    put_sprite(memory, 11, 16, 16, 3)
+    pixels = draw_line(memory, 0)
+    assert len(memory.sprite_lines[0]) == emu.memory.Memory.MAX_SPRITES_PER_LINE
+    assert pixels[:16] == [WHITE] * 16
+    assert all(pixels[40 + sprite * 10:48 + sprite * 10] == [BLACK] * 8 for sprite in range(10))
+    # a line the first ten don't reach still gets the others
+    put_sprite(memory, 0, 30, 48, 3)
+    assert draw_line(memory, 20)[40:48] == [BLACK] * 8
+
+
+def test_smaller_x_wins_then_oam_order():
+    memory = make_memory()
+    put_sprite(memory, 0, 16, 20, 1)  # screen x 12-19
+    put_sprite(memory, 1, 16, 16, 2)  # screen x 8-15, drawn over sprite 0
+    pixels = draw_line(memory, 0)
+    assert pixels[8:20] == [DARK] * 8 + [LIGHT] * 4
+
+    put_sprite(memory, 1, 16, 20, 2)  # same x, OAM order decides
+    assert draw_line(memory, 0)[12:20] == [LIGHT] * 8
+
+
+def test_transparent_pixels_show_the_sprite_behind():
+    memory = make_memory()
+    memory.write(0x8000 + 4 * 16, 0x0F)  # tile 4's first row: left half colour 0, right half colour 1
+    put_sprite(memory, 0, 16, 20, 4)  # screen x 12-19
+    put_sprite(memory, 1, 16, 22, 2)  # screen x 14-21, only seen where sprite 0 is colour 0
+    assert draw_line(memory, 0)[12:22] == [WHITE] * 2 + [DARK] * 2 + [LIGHT] * 4 + [DARK] * 2
+
+
+def test_tall_sprites():
+    memory = make_memory(0x97)
+    put_sprite(memory, 0, 16, 8, 3)  # tiles 2 and 3, the low bit is ignored
+    assert [draw_line(memory, line)[0] for line in range(17)] == [DARK] * 8 + [BLACK] * 8 + [WHITE]
+    put_sprite(memory, 0, 16, 8, 2, 0x40)  # y flip swaps the halves
+    assert [draw_line(memory, line)[0] for line in range(16)] == [BLACK] * 8 + [DARK] * 8
+
+
+def test_sprite_index_follows_oam_and_height():
+    memory = make_memory()
+    put_sprite(memory, 0, 16, 8, 3)
+    draw_line(memory, 0)
+    assert memory.sprite_lines is not None
+    assert len(memory.sprite_lines[8]) == 0
+
+    memory.write(0xFE00, 24)  # move it down 8 lines
+    assert memory.sprite_lines is None
+    assert draw_line(memory, 0)[0] == WHITE
+    assert draw_line(memory, 8)[0] == BLACK
+
+    memory.write(0xFF40, 0x97)  # 8x16, the same sprite now covers two more tiles of lines
+    assert draw_line(memory, 16)[0] == BLACK
+    assert memory.sprite_height == 16
+
+    # DMA replaces OAM in one go
+    memory.memory[0xC000:0xC0A0] = bytes(0xA0)
+    memory.write(0xFF46, 0xC0)
+    assert memory.sprite_lines is None
+    assert draw_line(memory, 8)[0] == WHITE
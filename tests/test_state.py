@@ -0,0 +1,74 @@
+import pytest
+
+import emu.cpu
+import emu.state
+from conftest import TETRIS, build_cartridge
+
+
+def run_frames(cpu, frames):
+    for _ in range(frames):
+        cpu.run_frame()
+    return cpu.save_state(), cpu.MEMORY.screen_data.copy()
+
+
+def test_round_trip_replays_the_same_frames():
+    cpu = emu.cpu.CPU(TETRIS)
+    for frame in range(90):
+        if frame == 70:
+            cpu.MEMORY.key_pressed(7)  # start
+        cpu.run_frame(False)
+    saved = cpu.save_state()
+    state, screen = run_frames(cpu, 20)
+
+    cpu.load_state(saved)
+    assert cpu.save_state() == saved
+    replayed_state, replayed_screen = run_frames(cpu, 20)
+    assert replayed_state == state
+    assert (replayed_screen == screen).all()
+
+
+def test_loading_into_a_fresh_emulator():
+    cpu = emu.cpu.CPU(TETRIS)
+    for _ in range(30):
+        cpu.run_frame(False)
+    other = emu.cpu.CPU(TETRIS)
+    other.load_state(cpu.save_state())
+    assert run_frames(other, 10)[0] == run_frames(cpu, 10)[0]
+
+
+def test_mapper_and_clock_are_saved():
+    cartridge = build_cartridge(cartridge_type=0x10, banks=16, ram_size=0x03)  # MBC3 with timer
+    cpu = emu.cpu.CPU(cartridge)
+    memory = cpu.MEMORY
+    memory.write(0x0000, 0x0A)
+    memory.write(0x2000, 0x05)
+    memory.write(0x4000, 0x02)
+    memory.write(0xA123, 0x42)
+    memory.mapper.rtc_seconds = 3 * 86400 + 3661
+    memory.write(0x4000, 0x08)
+    memory.write(0x6000, 0x00)
+    memory.write(0x6000, 0x01)
+    saved = cpu.save_state()
+
+    other = emu.cpu.CPU(cartridge)
+    other.load_state(saved)
+    mapper = other.MEMORY.mapper
+    assert (mapper.rom_bank, mapper.ram_bank, mapper.ram_enabled) == (5, 8, True)
+    assert other.MEMORY.current_rom_bank == 5
+    assert other.MEMORY.read(0xA000) == 1  # latched seconds
+    assert mapper.rtc_seconds == 3 * 86400 + 3661
+    other.MEMORY.write(0x4000, 0x02)
+    assert other.MEMORY.read(0xA123) == 0x42
+    assert other.save_state() != saved
+
+
+def test_bad_states_are_refused():
+    cpu = emu.cpu.CPU(TETRIS)
+    saved = cpu.save_state()
+    with pytest.raises(ValueError, match="Not a save state"):
+        cpu.load_state(b"XXXX" + saved[4:])
+    with pytest.raises(ValueError, match="wrong size"):
+        cpu.load_state(saved[:-1])
+    with pytest.raises(ValueError, match="different cartridge"):
+        emu.cpu.CPU(build_cartridge()).load_state(saved)
+    assert emu.state.VERSION == 3
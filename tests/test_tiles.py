@@ -0,0 +1,68 @@
+import random
+
+import numpy as np
+
+import emu.cpu
+
+
+# colour numbers of one tile row, pixel by pixel the way the LCD reads them
+def direct_decode(memory, tile, line):
+    low = memory.memory[0x8000 + tile * 16 + line * 2]
+    high = memory.memory[0x8000 + tile * 16 + line * 2 + 1]
+    return [(high >> (7 - x) & 1) << 1 | (low >> (7 - x) & 1) for x in range(8)]
+
+
+def assert_decoded(memory, tiles):
+    for tile in tiles:
+        for line in range(8):
+            row = direct_decode(memory, tile, line)
+            assert memory.tile_cache[0, tile, line].tolist() == row, (tile, line)
+            assert memory.tile_cache[1, tile, line].tolist() == row[::-1], (tile, line)
+
+
+def test_cache_matches_a_direct_decode():
+    memory = emu.cpu.CPU().MEMORY
+    rng = random.Random(0)
+    for address in range(0x8000, 0x9800):
+        memory.write(address, rng.randrange(0x100))
+    assert memory.dirty_tiles == set(range(384))
+    memory.decode_tiles()
+    assert not memory.dirty_tiles
+    assert_decoded(memory, range(384))
+
+
+def test_a_write_dirties_only_its_tile():
+    memory = emu.cpu.CPU().MEMORY
+    memory.decode_tiles()
+    memory.tile_cache[:] = 9  # anything decoded again loses the 9s
+
+    memory.write(0x8000 + 7 * 16 + 5, 0xA5)
+    memory.write(0x9000 + 3, 0x3C)  # tile 256 in the 0x8800 area
+    memory.write(0x9800, 0x12)  # the tile map isn't tile data
+    assert memory.dirty_tiles == {7, 256}
+    memory.decode_tiles()
+    assert_decoded(memory, [7, 256])
+    untouched = np.ones(384, dtype=bool)
+    untouched[[7, 256]] = False
+    assert (memory.tile_cache[:, untouched] == 9).all()
+
+
+def test_tiles_are_decoded_before_a_line_is_drawn():
+    memory = emu.cpu.CPU().MEMORY
+    memory.write(0x9800, 0x01)  # top left of the background is tile 1
+    memory.write(0x8010, 0xFF)  # its first row, colour 1
+    assert memory.dirty_tiles == {1}
+    memory.memory[0xFF44] = 0
+    memory.draw_scan_line()
+    assert not memory.dirty_tiles
+    assert memory.background_line[:9].tolist() == [1] * 8 + [0]
+
+
+def test_write_block_and_invalidate_dirty_whole_tiles():
+    memory = emu.cpu.CPU().MEMORY
+    memory.write_block(0x8FF8, bytes(range(16)))  # the end of tile 255 and the start of 256
+    assert memory.dirty_tiles == {255, 256}
+    memory.decode_tiles()
+    assert_decoded(memory, [255, 256])
+    memory.invalidate_caches()
+    assert memory.dirty_tiles == set(range(384))
@@ -0,0 +1,26 @@
+import numpy as np
+
+import emu.cpu
+import emu.vecenv
+from conftest import TETRIS
+
+
+def test_observations_are_vblank_frames():
+    env = emu.vecenv.VecEnv(TETRIS, 2, frames_per_step=2, noop_max=0, seed=0)
+    observations = env.reset()
+    for _ in range(40):
+        assert env.step([0, 0]) is observations
+    for cpu in env.cpus:
+        assert cpu.MEMORY.memory[0xFF44] == 144
+    assert np.array_equal(observations[0], observations[1])
+
+
+def test_observation_matches_a_single_emulator():
+    env = emu.vecenv.VecEnv(TETRIS, 1, frames_per_step=3, noop_max=0)
+    env.reset()
+    for _ in range(30):
+        env.step([0])
+    cpu = emu.cpu.CPU(TETRIS, colours=emu.memory.GREYS)
+    for _ in range(1 + 30 * 3):
+        cpu.run_frame()
+    assert np.array_equal(env.observations[0], cpu.MEMORY.screen_data)